@@ -571,7 +571,7 @@ class CompetitionSubmissionViewSet(viewsets.ModelViewSet):
             response = dict()
             lb = webmodels.PhaseLeaderBoard.objects.get(phase=submission.phase)
             lbe = webmodels.PhaseLeaderBoardEntry.objects.get(board=lb, result=submission)
-            lbe.delete()
+            webmodels.remove_submission_from_leaderboard(submission)
             response['status'] = lbe.id
             return Response(response, status=response['status'], content_type="application/json")
         except ObjectDoesNotExist:
@@ -7,6 +7,7 @@ import threading
 import traceback
 
 from codalabtools.azure_extensions import AzureServiceBusQueue
+from codalabtools.local_queue import SQLiteQueue
 from django.conf import settings
 from django.db import (models,
                        transaction)
@@ -29,14 +30,50 @@ def getQueue(name=None):
 
     queue = None
     with _lock:
-        queue = AzureServiceBusQueue(settings.SBS_NAMESPACE,
-                                     settings.SBS_ACCOUNT_KEY,
-                                     settings.SBS_ISSUER,
-                                     name)
+        if settings.QUEUE_BACKEND == 'local':
+            queue = SQLiteQueue(settings.LOCAL_QUEUE_PATH, name)
+        else:
+            queue = AzureServiceBusQueue(settings.SBS_NAMESPACE,
+                                         settings.SBS_ACCOUNT_KEY,
+                                         settings.SBS_ISSUER,
+                                         name)
         _queues[name] = queue
 
     return queue
 
+# Lanes of the site worker. Each lane has its own queue, configured by SITE_JOB_LANES, and
+# its own workers, so that status and score updates do not wait behind bulk jobs.
+LANE_UPDATES = 'updates'
+LANE_BULK = 'bulk'
+LANE_SCHEDULED = 'scheduled'
+
+# Maps a task type to the lane its jobs are dispatched to (see TASKS in codalab/worker.py for
+# the functions running them). Task types which are not listed go to LANE_UPDATES.
+TASK_LANES = {
+    'status_update': LANE_UPDATES,
+    'echo': LANE_UPDATES,
+    'create_competition': LANE_BULK,
+    'evaluate_submission': LANE_UPDATES,
+    'run_update': LANE_UPDATES,
+    'send_mass_email': LANE_BULK,
+    'precompute_scoring_artifacts': LANE_BULK,
+    'check_phase_migrations': LANE_SCHEDULED,
+}
+
+def getLaneQueueName(lane):
+    """
+    Returns the name of the queue of a lane of the site worker. Lanes without a queue of
+    their own share the default site queue.
+    """
+    name = settings.SITE_JOB_LANES.get(lane, {}).get('queue')
+    return name or settings.SBS_RESPONSE_QUEUE
+
+def getTaskQueueName(task_type):
+    """
+    Returns the name of the queue to which jobs of the given task type are dispatched.
+    """
+    return getLaneQueueName(TASK_LANES.get(task_type, LANE_UPDATES))
+
 # Jobs
 
 class JobManager(models.Manager):
@@ -65,13 +102,51 @@ class JobManager(models.Manager):
         task_args: An object defining the task's input arguments. The object must allow
         serialization to a JSON string using `json.dumps(obj)`. A None value is acceptable
         if the task requires no input arguments.
-        queue_name: The name of the target Queue. If name is None, the queue connected to
-        the site workers is used.
+        queue_name: The name of the target Queue. If name is None, the job goes to the queue
+        of the site worker lane the task type is routed to.
         """
+        if queue_name is None:
+            queue_name = getTaskQueueName(task_type)
         job = self.create_job(task_type, task_args)
         getQueue(queue_name).send_message(job.create_json_message())
         return job
 
+    def create_jobs(self, task_type, task_args_list):
+        """
+        Creates several jobs of the same type, within the caller's transaction.
+
+        task_type: A string identifying the type of task to carry out.
+        task_args_list: A list with the task's input arguments of each job (see create_job).
+        """
+        return [self.create_job(task_type, task_args) for task_args in task_args_list]
+
+    def dispatch_jobs(self, jobs, queue_name=None):
+        """
+        Dispatches jobs of the same type which were already created as a batch of messages.
+
+        jobs: The list of Job objects.
+        queue_name: The name of the target Queue (see create_and_dispatch_job).
+        """
+        if not jobs:
+            return
+        if queue_name is None:
+            queue_name = getTaskQueueName(jobs[0].task_type)
+        getQueue(queue_name).send_messages([job.create_json_message() for job in jobs])
+
+    def create_and_dispatch_jobs(self, task_type, task_args_list, queue_name=None):
+        """
+        Creates several jobs of the same type in one transaction and dispatches them to the
+        specified queue as a batch of messages.
+
+        task_type: A string identifying the type of task to carry out.
+        task_args_list: A list with the task's input arguments of each job (see create_job).
+        queue_name: The name of the target Queue (see create_and_dispatch_job).
+        """
+        with transaction.commit_on_success():
+            jobs = self.create_jobs(task_type, task_args_list)
+        self.dispatch_jobs(jobs, queue_name)
+        return jobs
+
 class Job(models.Model):
     """
     Defines a job which will carry out a long running task.
@@ -2,6 +2,7 @@
 Defines unit tests for this Django app.
 """
 import json
+import mock
 import logging
 import time
 
@@ -228,3 +229,51 @@ class JobsTests(TestCase):
         self.assertEqual(j.status, Job.FINISHED)
         self.assertDictEqual(j.get_task_info(), info2)
         job.delete()
+
+class JobLaneTests(TestCase):
+    """
+    Tests for routing jobs to the lanes of the site worker.
+    """
+    LANES = {
+        models.LANE_UPDATES: {'queue': 'updates-queue'},
+        models.LANE_BULK: {'queue': 'bulk-queue'},
+        models.LANE_SCHEDULED: {},
+    }
+
+    def test_lane_queue_names(self):
+        with self.settings(SITE_JOB_LANES=self.LANES, SBS_RESPONSE_QUEUE='site-queue'):
+            self.assertEqual('updates-queue', models.getLaneQueueName(models.LANE_UPDATES))
+            self.assertEqual('site-queue', models.getLaneQueueName(models.LANE_SCHEDULED))
+            self.assertEqual('site-queue', models.getLaneQueueName('unknown'))
+            self.assertEqual('bulk-queue', models.getTaskQueueName('precompute_scoring_artifacts'))
+            self.assertEqual('site-queue', models.getTaskQueueName('check_phase_migrations'))
+            self.assertEqual('updates-queue', models.getTaskQueueName('unknown'))
+
+    def test_jobs_are_dispatched_to_the_queue_of_their_lane(self):
+        with self.settings(SITE_JOB_LANES=self.LANES, SBS_RESPONSE_QUEUE='site-queue'):
+            with mock.patch('apps.jobs.models.getQueue') as get_queue_mock:
+                Job.objects.create_and_dispatch_job('send_mass_email', {})
+                get_queue_mock.assert_called_with('bulk-queue')
+                Job.objects.create_and_dispatch_job('run_update', {})
+                get_queue_mock.assert_called_with('updates-queue')
+                Job.objects.create_and_dispatch_job('echo', {}, queue_name='other-queue')
+                get_queue_mock.assert_called_with('other-queue')
+
+    def test_batch_of_jobs_is_dispatched_at_once(self):
+        with self.settings(SITE_JOB_LANES=self.LANES, SBS_RESPONSE_QUEUE='site-queue'):
+            with mock.patch('apps.jobs.models.getQueue') as get_queue_mock:
+                jobs = Job.objects.create_and_dispatch_jobs('run_update', [{'n': 1}, {'n': 2}])
+        get_queue_mock.assert_called_once_with('updates-queue')
+        bodies = get_queue_mock.return_value.send_messages.call_args[0][0]
+        self.assertEqual([{'id': job.pk, 'task_type': 'run_update', 'task_args': {'n': n}} for job, n in zip(jobs, [1, 2])],
+                         [json.loads(body) for body in bodies])
+
+    def test_created_jobs_are_dispatched_later(self):
+        with self.settings(SITE_JOB_LANES=self.LANES, SBS_RESPONSE_QUEUE='site-queue'):
+            with mock.patch('apps.jobs.models.getQueue') as get_queue_mock:
+                jobs = Job.objects.create_jobs('send_mass_email', [{}, {}])
+                self.assertFalse(get_queue_mock.called)
+                Job.objects.dispatch_jobs(jobs)
+                Job.objects.dispatch_jobs([])
+        get_queue_mock.assert_called_once_with('bulk-queue')
+        self.assertEqual(2, len(get_queue_mock.return_value.send_messages.call_args[0][0]))
@@ -0,0 +1,68 @@
+"""
+Helpers to stream large exports (e.g. competition results) without building them in memory.
+"""
+import csv
+import logging
+import StringIO
+import zlib
+
+from django.http import StreamingHttpResponse
+
+logger = logging.getLogger(__name__)
+
+# Rows are buffered until this many bytes are ready to be sent
+CHUNK_SIZE = 64 * 1024
+
+
+def csv_chunks(rows, chunk_size=CHUNK_SIZE, error_row=None):
+    """
+    Writes the given rows as CSV and yields the output in chunks of about chunk_size bytes.
+
+    error_row: The row written, and the error logged, in place of a row which cannot be
+        written (e.g. cells which do not encode). By default the error is raised.
+    """
+    csvfile = StringIO.StringIO()
+    csvwriter = csv.writer(csvfile)
+    for row in rows:
+        try:
+            csvwriter.writerow(row)
+        except Exception:
+            if error_row is None:
+                raise
+            logger.exception("Failed to write a CSV row")
+            csvwriter.writerow(error_row)
+        if csvfile.tell() >= chunk_size:
+            yield csvfile.getvalue()
+            csvfile.seek(0)
+            csvfile.truncate()
+    if csvfile.tell() > 0:
+        yield csvfile.getvalue()
+
+
+def gzip_chunks(chunks, compresslevel=6):
+    """
+    Compresses the given chunks on the fly and yields them in the gzip file format.
+    """
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def csv_response(rows, filename, compress=False, error_row=None):
+    """
+    Returns a StreamingHttpResponse which sends the given rows as a CSV attachment, compressed
+    with gzip when compress is True. The rows are produced while the response is sent, once
+    its status went out: errors must be raised before calling this function. See csv_chunks
+    for error_row.
+    """
+    chunks = csv_chunks(rows, error_row=error_row)
+    if compress:
+        response = StreamingHttpResponse(gzip_chunks(chunks), status=200, content_type="application/x-gzip")
+        filename = "%s.gz" % filename
+    else:
+        response = StreamingHttpResponse(chunks, status=200, content_type="text/csv")
+    response["Content-Disposition"] = "attachment; filename=%s" % filename
+    return response
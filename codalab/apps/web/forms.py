@@ -49,6 +49,12 @@ class CompetitionPhaseForm(forms.ModelForm):
             'max_submissions',
             'max_submissions_per_day',
             'execution_time_limit',
+            'memory_limit',
+            'cpu_limit',
+            'process_limit',
+            'disk_limit',
+            'output_compression_level',
+            'reuse_identical_results',
             'color',
             'is_scoring_only',
             'auto_migration',
@@ -0,0 +1,361 @@
+"""
+Defines the ranking structures, functions and scoring backends used to build competition leaderboards.
+"""
+import exceptions
+import logging
+import operator
+
+from bisect import bisect_right, insort
+
+from django.conf import settings
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+
+def rank_values(ids, id_value_pairs, sort_ascending=True, eps=1.0e-12):
+    """ Given a set of identifiers (ids) and a set of (id, value)-pairs
+        computes a ranking based on the value. The ranking is provided
+        as a set of (id, rank) pairs for all id in ids.
+    """
+    ranks = {}
+    # Only keep pairs for which the key is in the list of ids
+    id_set = set(ids)
+    valid_pairs = {k: v for k, v in id_value_pairs.iteritems() if k in id_set}
+    if len(valid_pairs) == 0:
+        return {id: 1 for id in ids}
+    # Sort and compute ranks
+    sorted_pairs = sorted(valid_pairs.iteritems(), key = operator.itemgetter(1), reverse=not sort_ascending)
+    r = 1
+    k, v = sorted_pairs[0]
+    ranks[k] = r
+    for i in range(1, len(sorted_pairs)):
+        k, vnow = sorted_pairs[i]
+        # Increment the rank only when values are different
+        if abs(vnow - v) > eps:
+            r = r + 1
+            v = vnow
+        ranks[k] = r
+    # Fill in ranks for ids which were not seen in the input
+    r = r + 1
+    for id in ids:
+        if id not in ranks:
+            ranks[id] = r
+    return ranks
+
+
+def _rank_key(rank, limit=1000000):
+    """Returns the integer a rank sorts by; ranks which are not numbers sort last."""
+    try:
+        return int(rank)
+    except exceptions.ValueError:
+        return limit
+
+
+def rank_submissions(ranks_by_id):
+    def compare_ranks(a, b):
+        return _rank_key(ranks_by_id[a]) - _rank_key(ranks_by_id[b])
+    return compare_ranks
+
+
+class ScoreIndex(object):
+    """
+    Keeps the values of a single score definition sorted so that the dense rank of a
+    submission is found with a binary search. Values are grouped as in rank_values: a group
+    starts at the first value which is more than eps away from the first value of the
+    previous group, and all the values of a group share a rank.
+
+    Adding or removing a value only changes its own group, except when it changes the first
+    value of a group; the following groups are then formed again until one starts where it
+    did before, which only happens with values spaced closer than eps.
+    """
+    def __init__(self, sort_ascending=True, eps=1.0e-12):
+        self.sort_ascending = sort_ascending
+        self.eps = eps
+        # First key of each group, in rank order (keys are the values, negated when sorting descending)
+        self._anchors = []
+        # Sorted distinct keys of each group
+        self._groups = []
+        # Number of submissions having each distinct key
+        self._counts = {}
+        # Maps a submission id to its key
+        self._keys_by_id = {}
+
+    def __len__(self):
+        return len(self._keys_by_id)
+
+    def __contains__(self, submission_id):
+        return submission_id in self._keys_by_id
+
+    def add(self, submission_id, value):
+        """Adds or replaces the value of a submission."""
+        if submission_id in self._keys_by_id:
+            self.remove(submission_id)
+        key = value if self.sort_ascending else -value
+        self._keys_by_id[submission_id] = key
+        self._counts[key] = self._counts.get(key, 0) + 1
+        if self._counts[key] > 1:
+            return
+        i = bisect_right(self._anchors, key)
+        if i > 0 and key - self._anchors[i - 1] <= self.eps:
+            insort(self._groups[i - 1], key)
+        elif i < len(self._anchors) and self._anchors[i] - key <= self.eps:
+            # The key becomes the first one of the next group
+            self._groups[i].insert(0, key)
+            self._regroup(i)
+        else:
+            self._anchors.insert(i, key)
+            self._groups.insert(i, [key])
+
+    def remove(self, submission_id):
+        """Removes the value of a submission, if any."""
+        key = self._keys_by_id.pop(submission_id, None)
+        if key is None:
+            return
+        self._counts[key] -= 1
+        if self._counts[key] > 0:
+            return
+        del self._counts[key]
+        i = bisect_right(self._anchors, key) - 1
+        group = self._groups[i]
+        group.remove(key)
+        if not group:
+            del self._anchors[i]
+            del self._groups[i]
+        elif key == self._anchors[i]:
+            self._regroup(i)
+
+    def _regroup(self, start):
+        """Forms the groups again from the group at position start, whose first key changed."""
+        anchors, groups = [], []
+        end = start
+        while end < len(self._groups):
+            if end > start and self._anchors[end] - anchors[-1] > self.eps:
+                # This group starts where it did before, and so do the following ones
+                break
+            for key in self._groups[end]:
+                if groups and key - anchors[-1] <= self.eps:
+                    groups[-1].append(key)
+                else:
+                    anchors.append(key)
+                    groups.append([key])
+            end += 1
+        self._anchors[start:end] = anchors
+        self._groups[start:end] = groups
+
+    def rank(self, submission_id):
+        """
+        Returns the dense rank of a submission. Submissions without a value rank right
+        after the last value, so that all of them tie for last place.
+        """
+        key = self._keys_by_id.get(submission_id)
+        if key is None:
+            return len(self._anchors) + 1
+        return bisect_right(self._anchors, key)
+
+
+class LeaderboardRanking(object):
+    """
+    Maintains the ranks of the submissions on a leaderboard incrementally: adding or removing
+    a submission updates one ScoreIndex per non-computed score definition, in O(log n) per
+    index, instead of re-sorting every column. The averages of the computed ('Avg') score
+    definitions depend on the ranks of every submission, one insert shifting the rank of all
+    the entries below it, so they are derived from the indexes when the leaderboard is built.
+    """
+    def __init__(self, sort_orders):
+        """
+        sort_orders: A map from the id of a non-computed score definition to True when it
+            sorts ascending.
+        """
+        self.submission_ids = set()
+        self.indexes = dict((sdef_id, ScoreIndex(sort_ascending))
+                            for sdef_id, sort_ascending in sort_orders.iteritems())
+
+    @classmethod
+    def build(cls, sort_orders, submission_ids, values):
+        """
+        Creates a ranking from scratch.
+
+        submission_ids: The ids of the submissions on the leaderboard.
+        values: A map from the id of a score definition to a map of submission id to value.
+        """
+        ranking = cls(sort_orders)
+        ranking.submission_ids.update(submission_ids)
+        for sdef_id, index in ranking.indexes.iteritems():
+            for submission_id, value in values.get(sdef_id, {}).iteritems():
+                if submission_id in ranking.submission_ids:
+                    index.add(submission_id, value)
+        return ranking
+
+    def add(self, submission_id, values):
+        """
+        Adds a submission to the ranking.
+
+        values: A map from the id of a score definition to the submission's value.
+        """
+        self.submission_ids.add(submission_id)
+        for sdef_id, index in self.indexes.iteritems():
+            if sdef_id in values:
+                index.add(submission_id, values[sdef_id])
+            else:
+                index.remove(submission_id)
+
+    def remove(self, submission_id):
+        """Removes a submission from the ranking."""
+        self.submission_ids.discard(submission_id)
+        for index in self.indexes.itervalues():
+            index.remove(submission_id)
+
+    def ranks(self, sdef_id, submission_ids):
+        """Returns a map from submission id to rank for a non-computed score definition."""
+        index = self.indexes[sdef_id]
+        return dict((submission_id, index.rank(submission_id)) for submission_id in submission_ids)
+
+
+class PythonScoringBackend(object):
+    """
+    Ranks leaderboard columns with dictionaries keyed by submission id. This is the
+    reference implementation; other backends must produce identical results.
+    """
+    name = 'python'
+
+    def __init__(self, eps=1.0e-12):
+        self.eps = eps
+
+    def rank(self, submission_ids, sort_orders, computed_columns, values, ranks=None):
+        """
+        Returns a map from the id of a score definition to a map of submission id to rank.
+
+        submission_ids: The ids of the ranked submissions, in display order.
+        sort_orders: A map from the id of a non-computed score definition to True when it
+            sorts ascending.
+        computed_columns: A list of (sdef_id, sort_ascending, dep_ids) tuples for the
+            computed ('Avg') score definitions, where dep_ids lists the ids of the score
+            definitions whose ranks are averaged.
+        values: A map from the id of a non-computed score definition to a map of submission
+            id to value. The values of the computed score definitions are added to it.
+        ranks: The ranks of the non-computed score definitions when they are already known,
+            e.g. from a LeaderboardRanking. The ranks of the computed ones are added to it.
+        """
+        if ranks is None:
+            ranks = {}
+            for (sdef_id, v) in values.iteritems():
+                ranks[sdef_id] = rank_values(submission_ids, v, sort_ascending=sort_orders[sdef_id], eps=self.eps)
+        for (sdef_id, sort_ascending, dep_ids) in computed_columns:
+            cnt = len(dep_ids)
+            computed_values = {}
+            for id in submission_ids:
+                computed_values[id] = sum([ranks[d][id] for d in dep_ids]) / float(cnt)
+            values[sdef_id] = computed_values
+            ranks[sdef_id] = rank_values(submission_ids, computed_values, sort_ascending=sort_ascending, eps=self.eps)
+        return ranks
+
+    def order(self, submission_ids, ranks_by_id):
+        """Returns the submission ids sorted by rank, keeping the given order between ties."""
+        return sorted(submission_ids, cmp=rank_submissions(ranks_by_id))
+
+
+class NumpyScoringBackend(PythonScoringBackend):
+    """
+    Ranks leaderboard columns with NumPy: the scores are loaded into a dense
+    submissions x score definitions matrix and every column is ranked with a single
+    stable sort. Values are compared as 64-bit floats, and tie within eps of the first
+    value of their group, as in rank_values.
+    """
+    name = 'numpy'
+
+    def __init__(self, eps=1.0e-12):
+        if numpy is None:
+            raise ImportError("The numpy scoring backend requires numpy to be installed.")
+        super(NumpyScoringBackend, self).__init__(eps)
+
+    def _dense_ranks(self, column, present, sort_ascending):
+        """
+        Returns the dense ranks of a column of values, as rank_values does. Submissions
+        without a value (present is False) rank right after the last value.
+        """
+        ranks = numpy.ones(len(column), dtype=numpy.int64)
+        rows = numpy.flatnonzero(present)
+        if len(rows) == 0:
+            return ranks
+        keys = column[rows] if sort_ascending else -column[rows]
+        order = numpy.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        # Each group ends at the first value more than eps away from the value it starts with
+        starts = numpy.zeros(len(keys), dtype=numpy.int64)
+        start = 0
+        while start < len(keys):
+            starts[start] = 1
+            end = numpy.searchsorted(keys, keys[start] + self.eps, side='right')
+            # The differences are compared as in rank_values, keys[start] + eps may be rounded
+            while end < len(keys) and keys[end] - keys[start] <= self.eps:
+                end += 1
+            while end > start + 1 and keys[end - 1] - keys[start] > self.eps:
+                end -= 1
+            start = end
+        dense = numpy.cumsum(starts)
+        ranks[rows[order]] = dense
+        ranks[~present] = dense[-1] + 1
+        return ranks
+
+    def _score_matrix(self, submission_ids, columns, values):
+        """Returns the (scores, present) matrices of the given non-computed columns."""
+        rows_by_id = dict((id, i) for (i, id) in enumerate(submission_ids))
+        rows, cols, data = [], [], []
+        for (j, sdef_id) in enumerate(columns):
+            for (id, value) in values[sdef_id].iteritems():
+                if id in rows_by_id:
+                    rows.append(rows_by_id[id])
+                    cols.append(j)
+                    data.append(float(value))
+        scores = numpy.zeros((len(submission_ids), len(columns)))
+        present = numpy.zeros((len(submission_ids), len(columns)), dtype=bool)
+        scores[rows, cols] = data
+        present[rows, cols] = True
+        return scores, present
+
+    def rank(self, submission_ids, sort_orders, computed_columns, values, ranks=None):
+        columns = list(values.iterkeys())
+        column_index = dict((sdef_id, j) for (j, sdef_id) in enumerate(columns))
+        rank_matrix = numpy.empty((len(submission_ids), len(columns) + len(computed_columns)), dtype=numpy.int64)
+        if ranks is None:
+            scores, present = self._score_matrix(submission_ids, columns, values)
+            for (j, sdef_id) in enumerate(columns):
+                rank_matrix[:, j] = self._dense_ranks(scores[:, j], present[:, j], sort_orders[sdef_id])
+        else:
+            for (j, sdef_id) in enumerate(columns):
+                rank_matrix[:, j] = [ranks[sdef_id][id] for id in submission_ids]
+        all_present = numpy.ones(len(submission_ids), dtype=bool)
+        for (k, (sdef_id, sort_ascending, dep_ids)) in enumerate(computed_columns):
+            deps = [column_index[d] for d in dep_ids]
+            averages = rank_matrix[:, deps].sum(axis=1) / float(len(deps))
+            j = len(columns) + k
+            rank_matrix[:, j] = self._dense_ranks(averages, all_present, sort_ascending)
+            column_index[sdef_id] = j
+            values[sdef_id] = dict(zip(submission_ids, averages.tolist()))
+        rank_lists = rank_matrix.T.tolist()
+        return dict((sdef_id, dict(zip(submission_ids, rank_lists[j]))) for (sdef_id, j) in column_index.iteritems())
+
+    def order(self, submission_ids, ranks_by_id):
+        keys = numpy.array([_rank_key(ranks_by_id[id]) for id in submission_ids], dtype=numpy.int64)
+        return [submission_ids[i] for i in numpy.argsort(keys, kind='mergesort')]
+
+
+SCORING_BACKENDS = dict((backend.name, backend) for backend in (PythonScoringBackend, NumpyScoringBackend))
+
+
+def get_scoring_backend(name=None):
+    """
+    Returns an instance of the scoring backend named by the LEADERBOARD_SCORING_BACKEND
+    setting. Falls back to the python backend when numpy is not installed.
+    """
+    if name is None:
+        name = settings.LEADERBOARD_SCORING_BACKEND
+    if name == NumpyScoringBackend.name and numpy is None:
+        logger.warning("numpy is not installed; falling back to the python scoring backend.")
+        name = PythonScoringBackend.name
+    return SCORING_BACKENDS[name]()
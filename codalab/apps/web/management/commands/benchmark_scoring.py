@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand, CommandError
+from apps.web.leaderboard import SCORING_BACKENDS, get_scoring_backend, numpy
+
+from optparse import make_option
+
+import random
+import time
+
+
+class Command(BaseCommand):
+    help = "Compares the leaderboard scoring backends on synthetic submissions."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes',
+                    dest='sizes',
+                    default='1000,10000,100000',
+                    help="Comma separated numbers of submissions to rank"),
+        make_option('--columns',
+                    dest='columns',
+                    type='int',
+                    default=5,
+                    help="Number of score columns averaged into the overall rank"),
+        make_option('--repeat',
+                    dest='repeat',
+                    type='int',
+                    default=3,
+                    help="Number of runs per size; the best time is reported"),
+        make_option('--seed',
+                    dest='seed',
+                    type='int',
+                    default=0,
+                    help="Seed of the generated scores"),
+    )
+
+    def _generate(self, rand, size, columns):
+        submission_ids = range(1, size + 1)
+        sort_orders = dict((sdef_id, sdef_id % 2 == 0) for sdef_id in range(1, columns + 1))
+        values = {}
+        for sdef_id in sort_orders:
+            # Round the scores so that some submissions tie, and leave a few unscored
+            values[sdef_id] = dict((id, round(rand.random(), 3)) for id in submission_ids if rand.random() > 0.01)
+        computed_columns = [(columns + 1, True, sorted(sort_orders))]
+        return submission_ids, sort_orders, computed_columns, values
+
+    def _run(self, backend, submission_ids, sort_orders, computed_columns, values):
+        values = dict((sdef_id, dict(v)) for (sdef_id, v) in values.iteritems())
+        start = time.time()
+        ranks = backend.rank(submission_ids, sort_orders, computed_columns, values)
+        ordering = backend.order(submission_ids, ranks[computed_columns[0][0]])
+        return time.time() - start, (ranks, values, ordering)
+
+    def handle(self, *args, **options):
+        if numpy is None:
+            raise CommandError("numpy is not installed; only the python backend is available.")
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError("--sizes must be a comma separated list of integers.")
+        rand = random.Random(options['seed'])
+        backends = [get_scoring_backend(name) for name in sorted(SCORING_BACKENDS)]
+
+        self.stdout.write("%10s %s" % ("size", " ".join("%12s" % backend.name for backend in backends)))
+        for size in sizes:
+            data = self._generate(rand, size, options['columns'])
+            timings = []
+            results = []
+            for backend in backends:
+                best = None
+                for _ in range(options['repeat']):
+                    elapsed, result = self._run(backend, *data)
+                    best = elapsed if best is None else min(best, elapsed)
+                timings.append(best)
+                results.append(result)
+            if any(result != results[0] for result in results[1:]):
+                raise CommandError("The backends disagree on %d submissions." % size)
+            self.stdout.write("%10d %s" % (size, " ".join("%11.3fs" % elapsed for elapsed in timings)))
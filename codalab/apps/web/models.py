@@ -1,7 +1,6 @@
 import exceptions
 import logging
 import random
-import operator
 import os, io
 from os.path import abspath, basename, dirname, join, normpath, split
 import zipfile
@@ -12,18 +11,19 @@ import datetime
 import django.dispatch
 import time
 import string
-import StringIO
-import csv
+import hashlib
 import uuid
 from django.db import models
 from django.db import IntegrityError
-from django.db.models import Max
-from django.db.models.signals import post_save
+from django.db.models import F, Max, Q
+from django.db.models.signals import post_init, post_save, post_delete
 from django.db import transaction
 from django.dispatch import receiver
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.core.files import File
+from django.core.files.base import ContentFile
 from django.core.files.storage import get_storage_class
 from django.core.urlresolvers import reverse, reverse_lazy
 from django.utils.dateparse import parse_datetime
@@ -37,8 +37,12 @@ from guardian.shortcuts import assign_perm
 from django_extensions.db.fields import UUIDField
 from django.utils.functional import cached_property
 
+from apps.authenz.models import ClUser
 from apps.forums.models import Forum
-from apps.coopetitions.models import DownloadRecord
+from apps.web import leaderboard
+from apps.web.export import csv_chunks
+from apps.coopetitions.models import Dislike, DownloadRecord, Like
+from apps.jobs.models import Job
 
 
 User = settings.AUTH_USER_MODEL
@@ -174,6 +178,7 @@ class Competition(models.Model):
     show_datasets_from_yaml = models.BooleanField(default=True, blank=True)
     reward = models.PositiveIntegerField(null=True, blank=True)
     is_migrating_delayed = models.BooleanField(default=False)
+    coopetition_version = models.PositiveIntegerField(default=0)
     allow_teams = models.BooleanField(default=False)
     enable_per_submission_metadata = models.BooleanField(default=False)
     allow_public_submissions = models.BooleanField(default=False, verbose_name="Allow sharing of public submissions")
@@ -255,50 +260,14 @@ class Competition(models.Model):
         logger.info('Doing phase migration on competition pk=%s from phase: %s to phase: %s' %
                     (self.pk, last_phase.phasenumber, current_phase.phasenumber))
 
-        if self.is_migrating:
+        # Claims the competition, so concurrent checks do not migrate it too
+        if Competition.objects.filter(pk=self.pk, is_migrating=False).update(is_migrating=True) == 0:
             logger.info('Trying to migrate competition pk=%s, but it is already being migrated!' % self.pk)
             return
-
         self.is_migrating = True
-        self.save()
-
-        try:
-            submissions = []
-            leader_board = PhaseLeaderBoard.objects.get(phase=last_phase)
-
-            leader_board_entries = PhaseLeaderBoardEntry.objects.filter(board=leader_board)
-            for submission in leader_board_entries:
-                submissions.append(submission.result)
-
-            participants = {}
 
-            for s in submissions:
-                participants[s.participant] = s
-
-            from tasks import evaluate_submission
-
-            for participant, submission in participants.items():
-                logger.info('Moving submission %s over' % submission)
-
-                new_submission = CompetitionSubmission(
-                    participant=participant,
-                    file=submission.file,
-                    phase=current_phase
-                )
-                new_submission.save(ignore_submission_limits=True)
-
-                evaluate_submission(new_submission.pk, current_phase.is_scoring_only)
-        except PhaseLeaderBoard.DoesNotExist:
-            pass
-
-        current_phase.is_migrated = True
-        current_phase.save()
-
-        # TODO: ONLY IF SUCCESSFUL
-        self.is_migrating = False # this should really be True until evaluate_submission tasks are all the way completed
-        self.is_migrating_delayed = False
-        self.last_phase_migration = current_phase.phasenumber
-        self.save()
+        migration = PhaseMigration.objects.create(competition=self, source_phase=last_phase, target_phase=current_phase)
+        self.complete_phase_migration(migration)
 
     def check_trailing_phase_submissions(self):
         '''
@@ -376,12 +345,22 @@ class Competition(models.Model):
         current_phase: The new phase object we are entering
         last_phase: The phase object to transfer submissions from
         '''
+        migration = PhaseMigration(competition=self, source_phase=current_phase, target_phase=next_phase,
+                                   mark_source_migrated=True)
+        if not migration.has_sources():
+            logger.info("No submissions to migrate on competition pk=%s" % self.pk)
+            if self.is_migrating_delayed:
+                self.is_migrating_delayed = False
+                self.save()
+            return
+
         logger.info("Checking for submissions that may still be running competition pk=%s" % self.pk)
 
         if current_phase.submissions.filter(status__codename=CompetitionSubmissionStatus.RUNNING).exists():
             logger.info('Some submissions still marked as processing for competition pk=%s' % self.pk)
-            self.is_migrating_delayed = True
-            self.save()
+            if not self.is_migrating_delayed:
+                self.is_migrating_delayed = True
+                self.save()
             return
         else:
             logger.info("No submissions running for competition pk=%s" % self.pk)
@@ -389,70 +368,62 @@ class Competition(models.Model):
         logger.info('Doing phase migration on competition pk=%s from phase: %s to phase: %s' %
                     (self.pk, current_phase.phasenumber, next_phase.phasenumber))
 
-        if self.is_migrating:
+        # Claims the competition, so concurrent checks do not migrate it too
+        if Competition.objects.filter(pk=self.pk, is_migrating=False).update(is_migrating=True) == 0:
             logger.info('Trying to migrate competition pk=%s, but it is already being migrated!' % self.pk)
             return
-
         self.is_migrating = True
-        self.save()
 
-        try:
-            submissions = []
-            leader_board = PhaseLeaderBoard.objects.get(phase=current_phase)
-
-            leader_board_entries = PhaseLeaderBoardEntry.objects.filter(board=leader_board)
-            for submission in leader_board_entries:
-                submissions.append(submission.result)
-
-            participants = {}
-
-            for s in submissions:
-                if s.is_migrated is False:
-                    participants[s.participant] = s
-
-            from tasks import evaluate_submission
-
-            for participant, submission in participants.items():
-                logger.info('Moving submission %s over' % submission)
+        migration.save()
+        self.complete_phase_migration(migration)
 
-                new_submission = CompetitionSubmission(
-                    participant=participant,
-                    file=submission.file,
-                    phase=next_phase
-                )
-                new_submission.save(ignore_submission_limits=True)
-
-                submission.is_migrated = True
-                submission.save()
+    def complete_phase_migration(self, migration):
+        '''
+        Runs a PhaseMigration of this competition to its end, then marks its target phase as
+        migrated and lets the competition migrate again. If the migration fails, the competition
+        stays migrating until the migration is resumed (see PhaseMigration.resume_stalled).
 
-                evaluate_submission(new_submission.pk, current_phase.is_scoring_only)
-        except PhaseLeaderBoard.DoesNotExist:
-            pass
+        migration: The PhaseMigration object.
+        '''
+        migration.run()
 
         # To check for submissions being migrated, does not allow to enter new submission
-        next_phase.is_migrated = True
-        next_phase.save()
-
+        target_phase = migration.target_phase
+        target_phase.is_migrated = True
+        target_phase.save()
 
-        # TODO: ONLY IF SUCCESSFUL
         self.is_migrating = False # this should really be True until evaluate_submission tasks are all the way completed
         self.is_migrating_delayed = False
-        self.last_phase_migration = current_phase.phasenumber
+        # apply_phase_migration moves the submissions of the current phase ahead, and records that phase
+        last_phase = migration.source_phase if migration.mark_source_migrated else target_phase
+        self.last_phase_migration = last_phase.phasenumber
         self.save()
 
+    # Written in place of a row of the results CSV which cannot be built or written
+    RESULTS_ERROR_ROW = ["Exception parsing scores!"]
+
     def get_results_csv(self, phase_pk, include_scores_not_on_leaderboard=False):
         phase = self.phases.get(pk=phase_pk)
         if phase.is_blind:
             return 'Not allowed, phase is blind.'
 
-        groups = phase.scores(include_scores_not_on_leaderboard=include_scores_not_on_leaderboard)
+        rows = self.get_results_rows(phase, include_scores_not_on_leaderboard)
+        return ''.join(csv_chunks(rows, error_row=self.RESULTS_ERROR_ROW))
 
-        csvfile = StringIO.StringIO()
-        csvwriter = csv.writer(csvfile)
+    def get_results_rows(self, phase, include_scores_not_on_leaderboard=False):
+        """
+        Returns an iterator over the rows of the results CSV of the given phase, one list of
+        cells at a time. The leaderboard is read before returning, so its errors are raised
+        here rather than while the rows are sent.
+        """
+        groups = phase.scores(include_scores_not_on_leaderboard=include_scores_not_on_leaderboard)
+        return self._results_rows(groups)
 
+    def _results_rows(self, groups):
+        """Yields the rows of the results CSV of the given leaderboard groups."""
         for group in groups:
-            #csvwriter.writerow([group['label']])
-            #csvwriter.writerow([])
+            #yield [group['label']]
+            #yield []
 
             headers = ["User"]
             sub_headers = [""]
@@ -468,32 +439,30 @@ class Competition(models.Model):
                         sub_headers.append(sub['label'])
                 else:
                     headers.append(header['label'])
-            csvwriter.writerow(['submission_pk',] + headers)
+            yield ['submission_pk',] + headers
             if sub_headers != ['']:
-                csvwriter.writerow(sub_headers)
-
-            try:
-                if len(group['scores']) <= 0:
-                    csvwriter.writerow(["No data available"])
-                else:
-                    for pk, scores in group['scores']:
-                        #print pk, scores
-                        row = [scores['username']] + (['']*(len(ordering) + 1))
-                        for v in scores['values']:
-                            if 'rnk' in v:
-                                # Based on the header label insert the score into the proper column
-                                row[ordering[v['name']] + 1] = "%s (%s)" % (v['val'], v['rnk'])
-                            else:
-                                row[ordering[v['name']] + 1] = "%s (%s)" % (v['val'], v['hidden_rnk'])
-                        csvwriter.writerow([scores['id'],] + row)
-            except:
-                csvwriter.writerow(["Exception parsing scores!"])
-                logger.error("Error parsing scores for competition PK=%s" % self.pk)
+                yield sub_headers
 
-            csvwriter.writerow([])
-            csvwriter.writerow([])
+            if len(group['scores']) <= 0:
+                yield ["No data available"]
+            for pk, scores in group['scores']:
+                # Rows are built outside of the yield so that closing the generator is not caught
+                try:
+                    row = [scores['username']] + (['']*(len(ordering) + 1))
+                    for v in scores['values']:
+                        if 'rnk' in v:
+                            # Based on the header label insert the score into the proper column
+                            row[ordering[v['name']] + 1] = "%s (%s)" % (v['val'], v['rnk'])
+                        else:
+                            row[ordering[v['name']] + 1] = "%s (%s)" % (v['val'], v['hidden_rnk'])
+                except:
+                    yield self.RESULTS_ERROR_ROW
+                    logger.error("Error parsing scores for competition PK=%s" % self.pk)
+                    break
+                yield [scores['id'],] + row
 
-        return csvfile.getvalue()
+            yield []
+            yield []
 
     def get_score_headers(self):
         qs = self.submissionscoredef_set.filter(computed=False)
@@ -672,6 +641,8 @@ class CompetitionPhase(models.Model):
         ('blue', 'Blue'),
         ('purple', 'Purple'),
     )
+    # zlib levels, from no compression to the best, slowest one
+    OUTPUT_COMPRESSION_CHOICES = tuple((level, str(level)) for level in range(10))
 
     competition = models.ForeignKey(Competition,related_name='phases')
     description = models.CharField(max_length=1000, null=True, blank=True)
@@ -690,6 +661,16 @@ class CompetitionPhase(models.Model):
     auto_migration = models.BooleanField(default=False)
     is_migrated = models.BooleanField(default=False)
     execution_time_limit = models.PositiveIntegerField(default=(5 * 60), verbose_name="Execution time limit (in seconds)")
+    # Limits of the programs run for a submission, no limit when empty
+    memory_limit = models.PositiveIntegerField(null=True, blank=True, verbose_name="Memory limit (in MB)")
+    cpu_limit = models.PositiveIntegerField(null=True, blank=True, verbose_name="CPU limit (in cores)")
+    process_limit = models.PositiveIntegerField(null=True, blank=True, verbose_name="Process limit")
+    disk_limit = models.PositiveIntegerField(null=True, blank=True, verbose_name="Disk quota (in MB)")
+    output_compression_level = models.PositiveIntegerField(default=6, choices=OUTPUT_COMPRESSION_CHOICES,
+                                                           verbose_name="Compression level of the outputs (0-9)")
+    # Turn off when the scoring program depends on more than the submission and the bundles of
+    # the phase, e.g. on the leaderboard or the history of the participant
+    reuse_identical_results = models.BooleanField(default=True, verbose_name="Reuse the results of identical submissions")
     color = models.CharField(max_length=24, choices=COLOR_CHOICES, blank=True, null=True)
 
     input_data_organizer_dataset = models.ForeignKey('OrganizerDataSet', null=True, blank=True, related_name="input_data_organizer_dataset", verbose_name="Input Data", on_delete=models.SET_NULL)
@@ -742,44 +723,11 @@ class CompetitionPhase(models.Model):
             computes a ranking based on the value. The ranking is provided
             as a set of (id, rank) pairs for all id in ids.
         """
-        ranks = {}
-        # Only keep pairs for which the key is in the list of ids
-        valid_pairs = {k: v for k, v in id_value_pairs.iteritems() if k in ids}
-        if len(valid_pairs) == 0:
-            return {id: 1 for id in ids}
-        # Sort and compute ranks
-        sorted_pairs = sorted(valid_pairs.iteritems(), key = operator.itemgetter(1), reverse=not sort_ascending)
-        r = 1
-        k, v = sorted_pairs[0]
-        ranks[k] = r
-        for i in range(1, len(sorted_pairs)):
-            k, vnow = sorted_pairs[i]
-            # Increment the rank only when values are different
-            if abs(vnow - v) > eps:
-                r = r + 1
-                v = vnow
-            ranks[k] = r
-        # Fill in ranks for ids which were not seen in the input
-        r = r + 1
-        for id in ids:
-            if id not in ranks:
-                ranks[id] = r
-        return ranks
+        return leaderboard.rank_values(ids, id_value_pairs, sort_ascending=sort_ascending, eps=eps)
 
     @staticmethod
     def rank_submissions(ranks_by_id):
-        def compare_ranks(a, b):
-            limit = 1000000
-            try:
-                ia = int(ranks_by_id[a])
-            except exceptions.ValueError:
-                ia = limit
-            try:
-                ib = int(ranks_by_id[b])
-            except exceptions.ValueError:
-                ib = limit
-            return ia - ib
-        return compare_ranks
+        return leaderboard.rank_submissions(ranks_by_id)
 
     @staticmethod
     def format_value(v, precision="2"):
@@ -792,51 +740,54 @@ class CompetitionPhase(models.Model):
         return ("{:." + str(p) + "f}").format(v)
 
     def scores(self, include_scores_not_on_leaderboard=False, **kwargs):
+        """
+        Returns the leaderboard groups (headers, ranks and formatted values) of this phase.
+
+        The result is served from a snapshot kept in the cache backend. Snapshots are keyed
+        by the version of the phase's leaderboard, which is bumped by invalidate_leaderboard
+        whenever the leaderboard entries, the scores or the score definitions change.
+        """
         score_filters = kwargs.pop('score_filters',{})
 
-        # Get the list of submissions in this leaderboard
-        submissions = []
-        result_location = []
         lb, created = PhaseLeaderBoard.objects.get_or_create(phase=self)
-        if not created:
-            if include_scores_not_on_leaderboard:
-                qs = CompetitionSubmission.objects.filter(
-                    phase=self,
-                    status__codename=CompetitionSubmissionStatus.FINISHED
-                )
-                for submission in qs:
-                    result_location.append(submission.file.name)
-                    submissions.append((submission.pk, submission.participant.user))
-            else:
-                qs = PhaseLeaderBoardEntry.objects.filter(board=lb)
-                for entry in qs:
-                    result_location.append(entry.result.file.name)
+        if len(kwargs) > 0:
+            # Custom score set filters are not part of the snapshot.
+            return self._compute_scores(lb, created, include_scores_not_on_leaderboard, **kwargs)
+
+        cache_key = leaderboard_cache_key(self.pk, lb.version, include_scores_not_on_leaderboard)
+        results = cache.get(cache_key)
+        if results is None:
+            results = self._compute_scores(lb, created, include_scores_not_on_leaderboard)
+            cache.set(cache_key, results, settings.LEADERBOARD_CACHE_TIMEOUT)
+        return results
 
-                for entry in qs:
-                    submissions.append((entry.result.id, entry.result.participant.user))
+    def _compute_scores(self, lb, created, include_scores_not_on_leaderboard=False, **kwargs):
+        """
+        Builds the leaderboard groups of this phase from the database. See scores().
+        """
+        data = LeaderboardData.load(self, None if created else lb, include_scores_not_on_leaderboard, **kwargs)
+        submissions = data.submissions
 
         results = []
-        for count, g in enumerate(SubmissionResultGroup.objects.filter(phases__in=[self]).order_by('ordering')):
+        for count, g in enumerate(data.groups):
             label = g.label
             headers = []
             scores = {}
 
             # add the location of the results on the blob storage to the scores
-            for (pk, user) in submissions:
+            for (pk, file_name, user_pk, username, team_name) in submissions:
                 scores[pk] = {
-                    'username': user.username,
-                    'user_pk': user.pk,
-                    'team_name': user.team_name,
+                    'username': username,
+                    'user_pk': user_pk,
+                    'team_name': team_name,
                     'id': pk,
                     'values': [],
-                    'resultLocation': result_location[count]
+                    'resultLocation': submissions[count][1]
                 }
 
             scoreDefs = []
             columnKeys = {} # maps a column key to its index in headers list
-            for x in SubmissionScoreSet.objects.order_by('tree_id','lft').filter(scoredef__isnull=False,
-                                                                        scoredef__groups__in=[g],
-                                                                        **kwargs).select_related('scoredef', 'parent'):
+            for x in data.scoresets[g.id]:
                 if x.parent is not None:
                     columnKey = x.parent.key
                     columnLabel = x.parent.label
@@ -875,56 +826,30 @@ class CompetitionPhase(models.Model):
                              'scores': scores, 'scoredefs': scoreDefs })
 
         if len(submissions) > 0:
-            # Figure out which submission scores we need to read from the database.
-            submission_ids = [id for (id,name) in submissions]
-            # not_computed_scoredefs: map (scoredef.id, scoredef) to keep track of non-computed scoredefs
-            not_computed_scoredefs = {}
-            computed_scoredef_ids = []
-            # computed_deps: maps id of a computed scoredef to a list of ids for scoredefs which are
-            #                input to the computation
-            computed_deps = {}
-            for result in results:
-                for sdef in result['scoredefs']:
-                    if sdef.computed is True:
-                        computed_scoredef_ids.append(sdef.id)
-                    else:
-                        not_computed_scoredefs[sdef.id] = sdef
-                if len(computed_scoredef_ids) > 0:
-                    computed_ids = SubmissionComputedScore.objects.filter(scoredef_id__in=computed_scoredef_ids).values_list('id')
-                    fields = SubmissionComputedScoreField.objects.filter(computed_id__in=computed_ids).select_related('scoredef', 'computed')
-                    for field in fields:
-                        if not field.scoredef.computed:
-                            not_computed_scoredefs[field.scoredef.id] = field.scoredef
-                        if field.computed.scoredef_id not in computed_deps:
-                            computed_deps[field.computed.scoredef_id] = []
-                        computed_deps[field.computed.scoredef_id].append(field.scoredef)
-            # Now read the submission scores
-            values = {}
-            scoredef_ids = [sdef_id for (sdef_id, sdef) in not_computed_scoredefs.iteritems()]
-            for s in SubmissionScore.objects.filter(scoredef_id__in=scoredef_ids, result_id__in=submission_ids):
-                if s.scoredef_id not in values:
-                    values[s.scoredef_id] = {}
-                values[s.scoredef_id][s.result_id] = s.value
+            submission_ids = [submission[0] for submission in submissions]
+            not_computed_scoredefs = data.scoredefs
+            computed_deps = data.computed_deps
+            values = data.values
 
             # rank values per scoredef.key (not computed)
-            ranks = {}
-            for (sdef_id, v) in values.iteritems():
-                sdef = not_computed_scoredefs[sdef_id]
-                ranks[sdef_id] = self.rank_values(submission_ids, v, sort_ascending=sdef.sorting=='asc')
-
-            # compute values for computed scoredefs
+            backend = leaderboard.get_scoring_backend()
+            sort_orders = dict((sdef_id, sdef.sorting == 'asc') for (sdef_id, sdef) in not_computed_scoredefs.iteritems())
+            ranks = None
+            if not include_scores_not_on_leaderboard and len(kwargs) == 0 and not created:
+                # Submissions on the leaderboard are ranked by the incrementally maintained ranking
+                ranking = self._leaderboard_ranking(lb, submission_ids, sort_orders, values)
+                ranks = dict((sdef_id, ranking.ranks(sdef_id, submission_ids)) for sdef_id in values.iterkeys())
+
+            # rank computed scoredefs by the average of their dependencies' ranks
+            computed_columns = []
             for result in results:
                 for sdef in result['scoredefs']:
-                    if sdef.computed:
-                        operation = getattr(models, sdef.computed_score.operation)
+                    if sdef.computed and sdef.id in computed_deps:
+                        operation = getattr(models, data.operations[sdef.id])
                         if (operation.name == 'Avg'):
-                            cnt = len(computed_deps[sdef.id])
-                            if (cnt > 0):
-                                computed_values = {}
-                                for id in submission_ids:
-                                    computed_values[id] = sum([ranks[d.id][id] for d in computed_deps[sdef.id]]) / float(cnt)
-                                values[sdef.id] = computed_values
-                                ranks[sdef.id] = self.rank_values(submission_ids, computed_values, sort_ascending=sdef.sorting=='asc')
+                            dep_ids = [d.id for d in computed_deps[sdef.id]]
+                            computed_columns.append((sdef.id, sdef.sorting == 'asc', dep_ids))
+            ranks = backend.rank(submission_ids, sort_orders, computed_columns, values, ranks=ranks)
 
             #format values
             for result in results:
@@ -949,12 +874,25 @@ class CompetitionPhase(models.Model):
                             scores[id]['values'].append({'val': v, 'hidden_rnk': r, 'name' : sdef.key})
                     if (sdef.key == result['selection_key']):
                         overall_ranks = ranks[sdef.id]
-                ranked_submissions = sorted(submission_ids, cmp=CompetitionPhase.rank_submissions(overall_ranks))
+                ranked_submissions = backend.order(submission_ids, overall_ranks)
                 final_scores = [(overall_ranks[id], scores[id]) for id in ranked_submissions]
                 result['scores'] = final_scores
                 del result['scoredefs']
         return results
 
+    def _leaderboard_ranking(self, lb, submission_ids, sort_orders, values):
+        """
+        Returns the LeaderboardRanking of the submissions on this phase's leaderboard: the one
+        kept in the cache backend when it belongs to the current version of the leaderboard,
+        or one built from the given values otherwise.
+        """
+        ranking = get_leaderboard_ranking(lb)
+        if ranking is None:
+            logger.debug("Building leaderboard ranking (phase_id=%s)", self.pk)
+            ranking = leaderboard.LeaderboardRanking.build(sort_orders, submission_ids, values)
+            set_leaderboard_ranking(lb, ranking)
+        return ranking
+
 # Competition Participant
 class CompetitionParticipant(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL,related_name='participation')
@@ -988,6 +926,29 @@ class CompetitionSubmissionStatus(models.Model):
     def __unicode__(self):
         return self.name
 
+def _complete_utf8_length(data):
+    """
+    Returns the length of the longest prefix of data which does not end in the middle of a
+    UTF-8 encoded character, e.g. one which the compute worker did not upload entirely yet.
+    """
+    # A character takes at most 4 bytes, so only one of the last 3 bytes may start an incomplete one
+    for i in range(1, min(4, len(data) + 1)):
+        byte = ord(data[-i])
+        if byte & 0xC0 == 0x80:
+            # Continuation byte
+            continue
+        if byte & 0xE0 == 0xC0:
+            length = 2
+        elif byte & 0xF0 == 0xE0:
+            length = 3
+        elif byte & 0xF8 == 0xF0:
+            length = 4
+        else:
+            # ASCII, or a byte which is not UTF-8 and is left to the decoder
+            return len(data)
+        return len(data) - i if i < length else len(data)
+    return len(data)
+
 # Competition Submission
 class CompetitionSubmission(models.Model):
     """
@@ -1042,6 +1003,11 @@ class CompetitionSubmission(models.Model):
     dislike_count = models.IntegerField(default=0)
 
     is_migrated = models.BooleanField(default=False) # Will be used to auto  migrate
+    # The PhaseMigration which created the submission, if any
+    phase_migration = models.ForeignKey('PhaseMigration', null=True, blank=True, related_name='submissions',
+                                        on_delete=models.SET_NULL)
+    # Hash of the content of the file and of the bundles of the phase it was evaluated with
+    evaluation_key = models.CharField(max_length=64, null=True, blank=True, db_index=True)
 
     class Meta:
         unique_together = (('submission_number','phase','participant'),)
@@ -1189,6 +1155,9 @@ class CompetitionSubmission(models.Model):
                     raise PermissionDenied()
                 if file_has_restricted_access and self.phase.is_blind:
                     raise PermissionDenied()
+        elif competition.has_registration and not competition.participants.filter(user=requested_by).exists():
+            # Public submissions of a competition with registration are shared with its participants
+            raise PermissionDenied()
 
         if key == 'private_output.zip':
             if self.participant.competition.creator.id != requested_by.id:
@@ -1206,6 +1175,50 @@ class CompetitionSubmission(models.Model):
         file_name = "{0}-{1}-{2}".format(self.participant.user.username, self.submission_number, key)
         return getattr(self, file_attr), file_type, file_name
 
+    # Names of the Blobs which the compute workers write the output of a run to while it executes
+    LOG_FILE_NAMES = {
+        'stdout.txt': submission_stdout_filename,
+        'stderr.txt': submission_stderr_filename,
+        'predict_stdout.txt': predict_submission_stdout_filename,
+        'predict_stderr.txt': predict_submission_stderr_filename,
+    }
+
+    def read_log(self, key, requested_by, offset=0, max_size=64 * 1024):
+        """
+        Reads the output of a run from an offset, with a ranged read. The compute workers upload
+        the output every few seconds while the run executes, so following it costs a small read.
+
+        key: The log to read: 'stdout.txt', 'stderr.txt', 'predict_stdout.txt' or 'predict_stderr.txt'.
+        requested_by: A user object identifying the user making the request.
+        offset: The number of bytes already read.
+        max_size: The maximum number of bytes to read.
+
+        Returns the bytes read and the offset to read from next. The bytes end on a character
+        boundary, so a character split by the read is returned whole by the next one.
+
+        Raises:
+           ValueError exception for improper arguments.
+           PermissionDenied exception when access to the log cannot be granted.
+        """
+        if key not in self.LOG_FILE_NAMES:
+            raise ValueError("Log requested is not valid.")
+        # Checks the permissions
+        log_file = self.get_file_for_download(key, requested_by)[0]
+        name = self.LOG_FILE_NAMES[key](self)
+        if not log_file.storage.exists(name):
+            return '', offset
+        f = log_file.storage.open(name)
+        try:
+            size = int(f.size)
+            if offset >= size:
+                return '', size
+            f.seek(offset)
+            data = f.read(min(max_size, size - offset))
+        finally:
+            f.close()
+        data = data[:_complete_utf8_length(data)]
+        return data, offset + len(data)
+
     def get_overall_like_count(self):
         return self.like_count - self.dislike_count
 
@@ -1225,6 +1238,127 @@ class CompetitionSubmission(models.Model):
         return scores
 
 
+class PhaseMigration(models.Model):
+    """
+    Moves the submissions on the leaderboard of a phase to another phase of the competition and
+    starts their evaluation. Submissions are created and dispatched in batches, and the progress
+    is recorded after each batch, so a migration which stopped halfway can be resumed without
+    moving a submission twice. The jobs of a batch are recorded in the transaction creating them
+    and their messages sent after it, so a resumed migration only sends again the messages of the
+    batch it stopped in.
+    """
+    # Number of submissions created, or dispatched, at once
+    batch_size = 500
+    # A migration which made no progress for this long is considered stopped and can be resumed
+    stall_timeout = datetime.timedelta(minutes=10)
+
+    competition = models.ForeignKey(Competition, related_name='phase_migrations')
+    source_phase = models.ForeignKey(CompetitionPhase, related_name='migrations_from')
+    target_phase = models.ForeignKey(CompetitionPhase, related_name='migrations_to')
+    # True to mark the moved submissions as migrated, so they are not moved again
+    mark_source_migrated = models.BooleanField(default=False)
+    # ID of the last submission whose evaluation was started, submissions being dispatched by ID
+    last_dispatched_id = models.PositiveIntegerField(default=0)
+    # JSON list of the IDs of the jobs created for the last batch whose messages may not be sent yet
+    pending_job_ids = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __unicode__(self):
+        return "Migration of %s from phase %s to phase %s" % (self.competition, self.source_phase.phasenumber,
+                                                               self.target_phase.phasenumber)
+
+    def _get_source_entries(self):
+        """Returns the leaderboard entries of the source phase whose submissions are to move."""
+        entries = PhaseLeaderBoardEntry.objects.filter(board__phase=self.source_phase)
+        if self.mark_source_migrated:
+            entries = entries.filter(result__is_migrated=False)
+        return entries
+
+    def _get_sources(self):
+        """Returns the submissions to move by participant ID: those on the leaderboard of the source phase."""
+        entries = self._get_source_entries().select_related('result')
+        return dict((entry.result.participant_id, entry.result) for entry in entries.order_by('pk'))
+
+    def has_sources(self):
+        """Returns True if this migration has submissions to move."""
+        return self._get_source_entries().exists()
+
+    def _create_submissions(self):
+        """Creates the submissions of the participants which have none from this migration yet."""
+        sources = self._get_sources()
+        created = set(self.submissions.values_list('participant_id', flat=True))
+        pending = [sources[participant_id] for participant_id in sorted(sources) if participant_id not in created]
+        status = CompetitionSubmissionStatus.objects.get_or_create(codename=CompetitionSubmissionStatus.SUBMITTING)[0]
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            participant_ids = [source.participant_id for source in batch]
+            # Numbers follow the submissions the participants already have in the target phase
+            numbers = dict(CompetitionSubmission.objects.filter(phase=self.target_phase, participant__in=participant_ids)
+                                                        .values_list('participant').annotate(Max('submission_number')))
+            submissions = [CompetitionSubmission(
+                participant_id=source.participant_id,
+                phase=self.target_phase,
+                file=source.file.name,
+                file_url_base=source.file.storage.url(''),
+                readable_filename=source.readable_filename,
+                status=status,
+                submission_number=(numbers.get(source.participant_id) or 0) + 1,
+                phase_migration=self,
+            ) for source in batch]
+            with transaction.commit_on_success():
+                CompetitionSubmission.objects.bulk_create(submissions)
+                if self.mark_source_migrated:
+                    CompetitionSubmission.objects.filter(pk__in=[source.pk for source in batch]).update(is_migrated=True)
+                self.save()
+            logger.info("Created %s submissions of %s (competition pk=%s)", len(batch), self, self.competition_id)
+
+    def _send_pending_jobs(self):
+        """Sends the messages of the jobs of the last batch, unless they were sent already."""
+        if not self.pending_job_ids:
+            return
+        # A job which left the pending status was started from a message sent earlier
+        jobs = list(Job.objects.filter(pk__in=json.loads(self.pending_job_ids), status=Job.PENDING).order_by('pk'))
+        Job.objects.dispatch_jobs(jobs)
+        self.pending_job_ids = ''
+        self.save()
+
+    def _dispatch_submissions(self):
+        """Starts the evaluation of the submissions of this migration which were not dispatched yet."""
+        from tasks import create_evaluation_jobs
+        self._send_pending_jobs()
+        while True:
+            submission_ids = list(self.submissions.filter(pk__gt=self.last_dispatched_id)
+                                                  .order_by('pk').values_list('pk', flat=True)[:self.batch_size])
+            if not submission_ids:
+                break
+            with transaction.commit_on_success():
+                jobs = create_evaluation_jobs(submission_ids, self.target_phase.is_scoring_only)
+                self.last_dispatched_id = submission_ids[-1]
+                self.pending_job_ids = json.dumps([job.pk for job in jobs])
+                self.save()
+            self._send_pending_jobs()
+            logger.info("Dispatched %s submissions of %s (competition pk=%s)", len(submission_ids), self, self.competition_id)
+
+    def run(self):
+        """Runs the migration, or resumes it where it stopped."""
+        self._create_submissions()
+        self._dispatch_submissions()
+        self.completed_at = now()
+        self.save()
+
+    @classmethod
+    def resume_stalled(cls):
+        """Resumes the migrations which stopped making progress, e.g. when their worker died."""
+        stalled = cls.objects.filter(completed_at__isnull=True, updated_at__lt=now() - cls.stall_timeout)
+        for migration in stalled.select_related('competition'):
+            # Claims the migration, so concurrent callers do not resume it too
+            if cls.objects.filter(pk=migration.pk, updated_at=migration.updated_at).update(updated_at=now()) == 1:
+                logger.info("Resuming %s (competition pk=%s)", migration, migration.competition_id)
+                migration.competition.complete_phase_migration(migration)
+
+
 class SubmissionResultGroup(models.Model):
     competition = models.ForeignKey(Competition)
     key = models.CharField(max_length=50)
@@ -1704,6 +1838,8 @@ class SubmissionScore(models.Model):
 class PhaseLeaderBoard(models.Model):
     phase = models.OneToOneField(CompetitionPhase,related_name='board')
     is_open = models.BooleanField(default=True)
+    # Regenerated each time the leaderboard content changes; used to key cached snapshots.
+    version = UUIDField(version=4)
 
     def submissions(self):
         return CompetitionSubmission.objects.filter(leaderboard_entry_result__board=self)
@@ -1777,6 +1913,18 @@ class CompetitionSubmissionMetadata(models.Model):
     end_swap_memory_usage = models.TextField(blank=True, null=True)
     end_cpu_usage = models.TextField(blank=True, null=True)
 
+    # Resources used by the programs of the run, summed over its commands (peak memory is the
+    # largest of them). The usage of each command is kept as a JSON list in command_usage.
+    elapsed_time = models.FloatField(blank=True, null=True)
+    cpu_user_time = models.FloatField(blank=True, null=True)
+    cpu_system_time = models.FloatField(blank=True, null=True)
+    peak_memory = models.BigIntegerField(blank=True, null=True)
+    io_read_bytes = models.BigIntegerField(blank=True, null=True)
+    io_write_bytes = models.BigIntegerField(blank=True, null=True)
+    command_usage = models.TextField(blank=True, null=True)
+    # The limit which made the run fail: 'time', 'memory', 'processes' or 'disk'
+    limit_exceeded = models.CharField(max_length=16, blank=True, null=True)
+
     def _get_json_property_percent(self, name):
         if hasattr(self, name):
             try:
@@ -1805,6 +1953,140 @@ class CompetitionSubmissionMetadata(models.Model):
         }
 
 
+def scoring_artifact_file_name(instance, filename):
+    return os.path.join("competition", str(instance.competition_id), "artifacts", instance.content_hash, filename)
+
+
+class ScoringArtifact(models.Model):
+    """
+    A file handed to the scoring runs of a competition (e.g. scores.txt). Artifacts are
+    generated once per version of the data they are built from and stored under the hash
+    of their content, so scoring runs can reference them instead of rebuilding them.
+
+    Storing an artifact deletes the ones it supersedes, except those stored recently, which a
+    later store deletes. The file of a deleted artifact is kept while a submission references
+    it as its scores or coopetition file.
+    """
+    # Superseded artifacts younger than this may have just been handed to a scoring run
+    keep_superseded_for = datetime.timedelta(minutes=10)
+
+    SCORES = 'scores'
+    COOPETITION = 'coopetition'
+    KINDS = (
+        (SCORES, 'Scores'),
+        (COOPETITION, 'Coopetition'),
+    )
+    competition = models.ForeignKey(Competition, related_name='scoring_artifacts')
+    phase = models.ForeignKey(CompetitionPhase, null=True, blank=True, related_name='scoring_artifacts')
+    kind = models.CharField(max_length=16, choices=KINDS)
+    # Identifies the data the artifact was generated from, e.g. the version of a leaderboard
+    version = models.CharField(max_length=40, db_index=True)
+    # SHA-256 of the file content
+    content_hash = models.CharField(max_length=64)
+    file = models.FileField(upload_to=scoring_artifact_file_name, storage=BundleStorage, max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __unicode__(self):
+        return "%s artifact %s of %s" % (self.kind, self.version, self.competition)
+
+    @classmethod
+    def get_current(cls, competition, phase, kind, version):
+        """Returns the artifact generated for the given version, or None."""
+        artifacts = cls.objects.filter(competition=competition, phase=phase, kind=kind, version=version).order_by('-pk')
+        return artifacts[0] if artifacts else None
+
+    @classmethod
+    def store(cls, competition, phase, kind, version, filename, content):
+        """
+        Stores the content generated for the given version and returns the artifact. Content
+        which is already in blob storage (same hash) is not uploaded again.
+        """
+        artifact = cls(competition=competition, phase=phase, kind=kind, version=version,
+                       content_hash=hashlib.sha256(content).hexdigest())
+        name = scoring_artifact_file_name(artifact, filename)
+        if artifact.file.storage.exists(name):
+            artifact.file.name = name
+        else:
+            artifact.file.save(filename, ContentFile(content), save=False)
+        # Workers racing on the same version may both store it; get_current returns the latest.
+        artifact.save()
+        artifact.delete_superseded()
+        return artifact
+
+    def delete_superseded(self):
+        """Deletes the artifacts superseded by this one, and their files when no longer used."""
+        superseded = ScoringArtifact.objects.filter(competition=self.competition_id, phase=self.phase_id, kind=self.kind,
+                                                    pk__lt=self.pk, created_at__lt=now() - self.keep_superseded_for)
+        for artifact in superseded:
+            name = artifact.file.name
+            artifact.delete()
+            # Artifacts with the same content share their file
+            if ScoringArtifact.objects.filter(file=name).exists():
+                continue
+            # Scored submissions keep the files they were scored with
+            submissions = CompetitionSubmission.objects.filter(phase__competition=self.competition_id)
+            if submissions.filter(Q(scores_file=name) | Q(coopetition_file=name)).exists():
+                continue
+            artifact.file.storage.delete(name)
+
+
+class FileContentHash(models.Model):
+    """
+    The SHA-256 of the content of a version of a file in blob storage, e.g. a submission or a
+    phase bundle. The version is the ETag of the Blob, so an overwritten file is hashed again.
+    It is only computed for the Blobs whose MD5 is not recorded by the storage.
+    """
+    name = models.CharField(max_length=255)
+    version = models.CharField(max_length=100, blank=True)
+    content_hash = models.CharField(max_length=64, db_index=True)
+
+    class Meta:
+        unique_together = (('name', 'version'),)
+
+    def __unicode__(self):
+        return "%s %s@%s" % (self.content_hash, self.name, self.version)
+
+    @staticmethod
+    def get_properties(field_file):
+        """
+        Returns the version of a stored file and the base64 MD5 of its content recorded by the
+        storage, or None when the storage does not record it.
+        """
+        storage = field_file.storage
+        if hasattr(storage, 'properties'):
+            properties = storage.properties(field_file.name)
+            return properties.get('etag', ''), properties.get('content-md5') or None
+        # Local storage: the modification time tells the versions apart
+        return storage.modified_time(field_file.name).isoformat(), None
+
+    @classmethod
+    def get_hash(cls, field_file):
+        """
+        Returns the hash of the content of a stored file. The MD5 recorded by the storage is
+        used when there is one; otherwise the file is read the first time its version is seen.
+        """
+        version, content_md5 = cls.get_properties(field_file)
+        if content_md5:
+            return "md5:%s" % content_md5
+        hashes = cls.objects.filter(name=field_file.name, version=version).values_list('content_hash', flat=True)
+        if hashes:
+            return hashes[0]
+        content_hash = hashlib.sha256()
+        field_file.open('rb')
+        try:
+            for chunk in field_file.chunks():
+                content_hash.update(chunk)
+        finally:
+            field_file.close()
+        try:
+            with transaction.commit_on_success():
+                cls.objects.create(name=field_file.name, version=version, content_hash=content_hash.hexdigest())
+        except IntegrityError:
+            # Hashed at the same time by another task
+            pass
+        return content_hash.hexdigest()
+
+
 def add_submission_to_leaderboard(submission):
     """
     Adds the given submission to its leaderboard. It is the caller responsiblity to make
@@ -1814,10 +2096,274 @@ def add_submission_to_leaderboard(submission):
 
     logger.info('Adding submission %s to leaderboard %s' % (submission, lb))
 
-    # Currently we only allow one submission into the leaderboard although the leaderboard
-    # is setup to accept multiple submissions from the same participant.
-    entries = PhaseLeaderBoardEntry.objects.filter(board=lb, result__participant=submission.participant)
-    for entry in entries:
-        entry.delete()
-    lbe, created = PhaseLeaderBoardEntry.objects.get_or_create(board=lb, result=submission)
+    with transaction.commit_on_success():
+        # Lock the leaderboard so changes reach its cached ranking one at a time
+        lb = PhaseLeaderBoard.objects.select_for_update().get(pk=lb.pk)
+        ranking = get_leaderboard_ranking(lb)
+        # Currently we only allow one submission into the leaderboard although the leaderboard
+        # is setup to accept multiple submissions from the same participant.
+        entries = PhaseLeaderBoardEntry.objects.filter(board=lb, result__participant=submission.participant)
+        for entry in entries:
+            if ranking is not None:
+                ranking.remove(entry.result_id)
+            entry.delete()
+        lbe, created = PhaseLeaderBoardEntry.objects.get_or_create(board=lb, result=submission)
+        if ranking is not None:
+            scores = SubmissionScore.objects.filter(result=submission, scoredef__in=ranking.indexes.keys())
+            ranking.add(submission.pk, dict(scores.values_list('scoredef', 'value')))
+            set_leaderboard_ranking(PhaseLeaderBoard.objects.get(pk=lb.pk), ranking)
     return lbe, created
+
+
+def remove_submission_from_leaderboard(submission):
+    """
+    Removes the given submission from its leaderboard.
+    """
+    logger.info('Removing submission %s from leaderboard' % submission)
+
+    with transaction.commit_on_success():
+        lb = PhaseLeaderBoard.objects.select_for_update().get(phase=submission.phase)
+        ranking = get_leaderboard_ranking(lb)
+        PhaseLeaderBoardEntry.objects.filter(board=lb, result=submission).delete()
+        if ranking is not None:
+            ranking.remove(submission.pk)
+            set_leaderboard_ranking(PhaseLeaderBoard.objects.get(pk=lb.pk), ranking)
+
+
+def leaderboard_ranking_cache_key(phase_pk):
+    """
+    Returns the cache key of the LeaderboardRanking of a phase.
+    """
+    return "leaderboard:ranking:%s" % phase_pk
+
+
+def get_leaderboard_ranking(lb):
+    """
+    Returns the cached LeaderboardRanking of a leaderboard, or None when there is none for its
+    current version. Every change of the leaderboard gives it a new version (see
+    invalidate_leaderboard), so a ranking which missed a change is never used.
+
+    lb: The PhaseLeaderBoard object.
+    """
+    cached = cache.get(leaderboard_ranking_cache_key(lb.phase_id))
+    if cached is None or cached[0] != lb.version:
+        return None
+    return cached[1]
+
+
+def set_leaderboard_ranking(lb, ranking):
+    """
+    Caches the LeaderboardRanking of the current version of a leaderboard. The ranking is
+    updated by the changes applied under the leaderboard's row lock, and dropped by the others.
+
+    lb: The PhaseLeaderBoard object.
+    """
+    cache.set(leaderboard_ranking_cache_key(lb.phase_id), (lb.version, ranking), settings.LEADERBOARD_CACHE_TIMEOUT)
+
+
+class LeaderboardData(object):
+    """
+    The rows a phase's leaderboard is built from. They are read in a fixed number of queries,
+    whatever the number of submissions on the leaderboard.
+
+    submissions: A list of (submission id, result file name, user id, username, team name) tuples.
+    groups: The SubmissionResultGroup objects of the phase, in display order.
+    scoresets: A map from the id of a group to its SubmissionScoreSet objects, in tree order.
+    scoredefs: A map from the id of a non-computed SubmissionScoreDef to the object.
+    operations: A map from the id of a computed score definition to its operation.
+    computed_deps: A map from the id of a computed score definition to the list of
+        SubmissionScoreDef objects which are input to the computation.
+    values: A map from the id of a non-computed score definition to a map of submission id to value.
+    """
+    SUBMISSION_FIELDS = ('file', 'participant__user__id', 'participant__user__username', 'participant__user__team_name')
+
+    def __init__(self, submissions, groups, scoresets, scoredefs, operations, computed_deps, values):
+        self.submissions = submissions
+        self.groups = groups
+        self.scoresets = scoresets
+        self.scoredefs = scoredefs
+        self.operations = operations
+        self.computed_deps = computed_deps
+        self.values = values
+
+    @classmethod
+    def load(cls, phase, board, include_scores_not_on_leaderboard=False, **kwargs):
+        """
+        Reads the leaderboard rows of a phase.
+
+        phase: The CompetitionPhase object.
+        board: The PhaseLeaderBoard of the phase, or None when it was just created.
+        include_scores_not_on_leaderboard: True to list every finished submission of the phase
+            instead of the submissions on the leaderboard.
+        kwargs: Additional filters on the SubmissionScoreSet objects.
+        """
+        submissions = []
+        if board is not None:
+            if include_scores_not_on_leaderboard:
+                submission_filters = {'phase': phase, 'status__codename': CompetitionSubmissionStatus.FINISHED}
+                submissions = list(CompetitionSubmission.objects.filter(**submission_filters)
+                                   .values_list('pk', *cls.SUBMISSION_FIELDS))
+                score_filters = dict(('result__%s' % k, v) for (k, v) in submission_filters.iteritems())
+            else:
+                submissions = list(PhaseLeaderBoardEntry.objects.filter(board=board)
+                                   .values_list('result', *['result__%s' % f for f in cls.SUBMISSION_FIELDS]))
+                score_filters = {'result__leaderboard_entry_result__board': board}
+
+        groups = list(SubmissionResultGroup.objects.filter(phases__in=[phase]).order_by('ordering'))
+        scoresets = dict((g.id, []) for g in groups)
+        if len(groups) > 0:
+            group_ids_by_scoredef = {}
+            for (sdef_id, group_id) in SubmissionScoreDefGroup.objects.filter(group__in=groups).values_list('scoredef', 'group'):
+                group_ids_by_scoredef.setdefault(sdef_id, []).append(group_id)
+            qs = SubmissionScoreSet.objects.order_by('tree_id','lft').filter(scoredef__isnull=False,
+                                                                           scoredef__groups__in=groups,
+                                                                           **kwargs).select_related('scoredef', 'parent').distinct()
+            for x in qs:
+                for group_id in group_ids_by_scoredef.get(x.scoredef_id, []):
+                    scoresets[group_id].append(x)
+
+        scoredefs = {}
+        operations = {}
+        computed_deps = {}
+        computed_scoredef_ids = []
+        for group_scoresets in scoresets.itervalues():
+            for x in group_scoresets:
+                if x.scoredef.computed is True:
+                    computed_scoredef_ids.append(x.scoredef_id)
+                else:
+                    scoredefs[x.scoredef_id] = x.scoredef
+        if len(submissions) > 0 and len(computed_scoredef_ids) > 0:
+            fields = SubmissionComputedScoreField.objects.filter(computed__scoredef__in=computed_scoredef_ids).select_related('scoredef', 'computed')
+            for field in fields:
+                if not field.scoredef.computed:
+                    scoredefs[field.scoredef.id] = field.scoredef
+                operations[field.computed.scoredef_id] = field.computed.operation
+                computed_deps.setdefault(field.computed.scoredef_id, []).append(field.scoredef)
+
+        values = {}
+        if len(submissions) > 0 and len(scoredefs) > 0:
+            scores = SubmissionScore.objects.filter(scoredef__in=scoredefs.keys(), **score_filters)
+            for (result_id, sdef_id, value) in scores.values_list('result', 'scoredef', 'value'):
+                values.setdefault(sdef_id, {})[result_id] = value
+
+        return cls(submissions, groups, scoresets, scoredefs, operations, computed_deps, values)
+
+
+def leaderboard_cache_key(phase_pk, version, include_scores_not_on_leaderboard=False):
+    """
+    Returns the cache key of a leaderboard snapshot.
+
+    phase_pk: The ID of the CompetitionPhase object.
+    version: The version of the phase's PhaseLeaderBoard.
+    include_scores_not_on_leaderboard: True for the snapshot listing all finished submissions.
+    """
+    return "leaderboard:%s:%s:%s" % (phase_pk, version, 'all' if include_scores_not_on_leaderboard else 'board')
+
+
+def invalidate_leaderboard(phase):
+    """
+    Marks the cached leaderboard snapshots of the given phase as stale by giving its
+    leaderboard a new version. Snapshots for the previous version simply expire.
+
+    phase: A CompetitionPhase object or its ID.
+    """
+    PhaseLeaderBoard.objects.filter(phase=phase).update(version=str(uuid.uuid4()))
+
+
+def invalidate_competition_leaderboards(competition):
+    """
+    Marks the cached leaderboard snapshots of every phase of the given competition as stale.
+
+    competition: A Competition object or its ID.
+    """
+    PhaseLeaderBoard.objects.filter(phase__competition=competition).update(version=str(uuid.uuid4()))
+
+
+def scoredefs_cache_key(competition_pk):
+    """
+    Returns the cache key of the score definitions lookup of a competition.
+    """
+    return "scoredefs:%s" % competition_pk
+
+
+def get_scoredefs_by_key(competition):
+    """
+    Returns a map from the key of each score definition of a competition to a (id, computed)
+    tuple. The map is kept in the cache backend until the score definitions change.
+
+    competition: A Competition object or its ID.
+    """
+    competition_pk = getattr(competition, 'pk', competition)
+    cache_key = scoredefs_cache_key(competition_pk)
+    scoredefs = cache.get(cache_key)
+    if scoredefs is None:
+        qs = SubmissionScoreDef.objects.filter(competition=competition_pk).values_list('key', 'id', 'computed')
+        scoredefs = dict((key, (sdef_id, computed)) for (key, sdef_id, computed) in qs)
+        cache.set(cache_key, scoredefs, settings.LEADERBOARD_CACHE_TIMEOUT)
+    return scoredefs
+
+
+def _leaderboard_entry_changed(sender, instance, **kwargs):
+    """Invalidates the leaderboard snapshots when an entry is added to or removed from a leaderboard."""
+    PhaseLeaderBoard.objects.filter(pk=instance.board_id).update(version=str(uuid.uuid4()))
+
+
+def _submission_deleted(sender, instance, **kwargs):
+    """Invalidates the leaderboard snapshots listing every scored submission when one is deleted."""
+    invalidate_leaderboard(instance.phase_id)
+
+
+def _user_loaded(sender, instance, **kwargs):
+    """Remembers the username and team name a user was loaded with (see _user_names_changed)."""
+    instance._leaderboard_names = (instance.username, instance.team_name)
+
+
+def _user_names_changed(sender, instance, created, **kwargs):
+    """
+    Invalidates the leaderboard snapshots of the phases a user submitted to when the username
+    or team name shown on them changes.
+    """
+    names = (instance.username, instance.team_name)
+    if created or names == instance._leaderboard_names:
+        return
+    instance._leaderboard_names = names
+    phase_ids = CompetitionSubmission.objects.filter(participant__user=instance).values_list('phase', flat=True)
+    for phase_id in set(phase_ids):
+        invalidate_leaderboard(phase_id)
+
+
+def _coopetition_changed(sender, instance, **kwargs):
+    """Bumps the coopetition version of a competition when a like, dislike or download of one of its submissions changes."""
+    competitions = CompetitionSubmission.objects.filter(pk=instance.submission_id).values_list('phase__competition', flat=True)
+    Competition.objects.filter(pk__in=list(competitions)).update(coopetition_version=F('coopetition_version') + 1)
+
+
+def _score_definition_changed(sender, instance, **kwargs):
+    """Invalidates the leaderboard snapshots of a competition when its score definitions are edited."""
+    if sender in (SubmissionComputedScore, SubmissionComputedScoreField):
+        # The score definition may already be gone when it is deleted along with its computed score.
+        competitions = SubmissionScoreDef.objects.filter(pk=instance.scoredef_id).values_list('competition', flat=True)
+    elif sender in (SubmissionScoreDefGroup, SubmissionResultGroupPhase):
+        competitions = SubmissionResultGroup.objects.filter(pk=instance.group_id).values_list('competition', flat=True)
+    else:
+        competitions = [instance.competition_id]
+    for competition_id in competitions:
+        invalidate_competition_leaderboards(competition_id)
+        if sender is SubmissionScoreDef:
+            cache.delete(scoredefs_cache_key(competition_id))
+
+
+post_save.connect(_leaderboard_entry_changed, sender=PhaseLeaderBoardEntry)
+post_delete.connect(_leaderboard_entry_changed, sender=PhaseLeaderBoardEntry)
+post_delete.connect(_submission_deleted, sender=CompetitionSubmission)
+post_init.connect(_user_loaded, sender=ClUser)
+
+for _sender in (Like, Dislike, DownloadRecord):
+    post_save.connect(_coopetition_changed, sender=_sender)
+    post_delete.connect(_coopetition_changed, sender=_sender)
+post_save.connect(_user_names_changed, sender=ClUser)
+
+for _sender in (SubmissionScoreDef, SubmissionScoreSet, SubmissionScoreDefGroup, SubmissionResultGroup,
+                SubmissionResultGroupPhase, SubmissionComputedScore, SubmissionComputedScoreField):
+    post_save.connect(_score_definition_changed, sender=_sender)
+    post_delete.connect(_score_definition_changed, sender=_sender)
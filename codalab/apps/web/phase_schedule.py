@@ -0,0 +1,115 @@
+"""
+Defines when the site worker checks the automatic phase migrations of the competitions.
+"""
+import datetime
+import heapq
+import logging
+
+from django.db.models import F
+from django.utils.timezone import now
+
+from apps.web.models import Competition, CompetitionPhase, PhaseLeaderBoardEntry, PhaseMigration
+
+logger = logging.getLogger(__name__)
+
+
+def get_pending_competition_ids():
+    """
+    Returns the IDs of the competitions having a phase with automatic migration which was not
+    migrated yet, i.e. the competitions whose migrations may still have to be checked.
+    """
+    phases = CompetitionPhase.objects.filter(auto_migration=True,
+                                             phasenumber__gt=F('competition__last_phase_migration'))
+    return set(phases.values_list('competition', flat=True))
+
+
+def get_ready_competition_ids(current_time):
+    """
+    Returns the IDs of the competitions whose active phase, i.e. the last one which started, is
+    followed by a phase with automatic migration which was not migrated yet, and has submissions
+    on its leaderboard which were not migrated yet: the competitions whose migration is started
+    by Competition.check_future_phase_sumbmissions.
+    """
+    phases = CompetitionPhase.objects.filter(competition__in=get_pending_competition_ids(),
+                                             competition__is_migrating=False).order_by('competition', 'phasenumber')
+    source_phase_ids = set()
+    active = {}
+    for phase_id, competition_id, phasenumber, start_date, auto_migration, last_phase_migration in phases.values_list(
+            'pk', 'competition', 'phasenumber', 'start_date', 'auto_migration', 'competition__last_phase_migration'):
+        if active.get(competition_id) and auto_migration and phasenumber > last_phase_migration:
+            source_phase_ids.add(active[competition_id])
+        active[competition_id] = phase_id if start_date <= current_time else None
+    # The migration moves the submissions which were not moved by an earlier one
+    entries = PhaseLeaderBoardEntry.objects.filter(board__phase__in=source_phase_ids, result__is_migrated=False)
+    return set(entries.values_list('board__phase__competition', flat=True))
+
+
+class PhaseMigrationSchedule(object):
+    """
+    Keeps an index of the start dates of the upcoming phases of the competitions with a pending
+    automatic migration, and reports a competition as due when one of those dates is crossed,
+    so its migration is checked right when its active phase changes.
+
+    The index is reloaded every refresh_interval to pick up edited phases and new competitions.
+    Every retry_interval, the competitions whose active phase has submissions waiting for the
+    automatic migration of the next phase are due again (e.g. submissions added to the leaderboard
+    after the last migration, or a start date moved into the past), along with the competitions
+    whose migration was delayed by running submissions, and stalled migrations are reported for
+    resuming. The first call to get_due does the same, to catch up with the boundaries
+    crossed while no schedule was running.
+    """
+
+    def __init__(self, refresh_interval=300, retry_interval=60):
+        """
+        refresh_interval: Seconds between two reloads of the index.
+        retry_interval: Seconds between two retries of the delayed and stalled migrations.
+        """
+        self.refresh_interval = datetime.timedelta(seconds=refresh_interval)
+        self.retry_interval = datetime.timedelta(seconds=retry_interval)
+        # Heap of (start date, competition ID) of the phases starting after checked_until
+        self.boundaries = []
+        self.checked_until = None
+        self.refreshed_at = None
+        self.retried_at = None
+
+    def refresh(self, current_time):
+        """Reloads the start dates of the upcoming phases."""
+        after = self.checked_until or current_time
+        phases = CompetitionPhase.objects.filter(competition__in=get_pending_competition_ids(),
+                                                 start_date__gt=after)
+        self.boundaries = list(phases.values_list('start_date', 'competition'))
+        heapq.heapify(self.boundaries)
+        self.refreshed_at = current_time
+        logger.debug("Scheduled %s phase boundaries after %s", len(self.boundaries), after)
+
+    def get_due(self, current_time=None):
+        """
+        Returns the IDs of the competitions whose migrations must be checked, and True if
+        stalled migrations must be resumed.
+        """
+        current_time = current_time or now()
+        due = set()
+        if self.refreshed_at is None or current_time - self.refreshed_at >= self.refresh_interval:
+            self.refresh(current_time)
+        while self.boundaries and self.boundaries[0][0] <= current_time:
+            due.add(heapq.heappop(self.boundaries)[1])
+        self.checked_until = current_time
+
+        resume_stalled = False
+        if self.retried_at is None or current_time - self.retried_at >= self.retry_interval:
+            self.retried_at = current_time
+            due.update(get_ready_competition_ids(current_time))
+            due.update(Competition.objects.filter(is_migrating_delayed=True, is_migrating=False)
+                                          .values_list('pk', flat=True))
+            stalled_before = current_time - PhaseMigration.stall_timeout
+            resume_stalled = PhaseMigration.objects.filter(completed_at__isnull=True,
+                                                           updated_at__lt=stalled_before).exists()
+        return due, resume_stalled
+
+    def get_delay(self, current_time=None):
+        """Returns the number of seconds until get_due must be called again."""
+        current_time = current_time or now()
+        wakeups = [self.refreshed_at + self.refresh_interval, self.retried_at + self.retry_interval]
+        if self.boundaries:
+            wakeups.append(self.boundaries[0][0])
+        return max(0, (min(wakeups) - current_time).total_seconds())
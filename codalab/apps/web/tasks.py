@@ -2,6 +2,7 @@
 Defines background tasks needed by the web site.
 """
 import csv
+import hashlib
 import io
 import json
 import logging
@@ -12,22 +13,31 @@ from urllib import pathname2url
 from zipfile import ZipFile
 from django.conf import settings
 from django.contrib.sites.models import get_current_site
+from django.core.cache import cache
 from django.core.files.base import ContentFile
 from django.core.mail import get_connection, EmailMultiAlternatives, send_mail
-from django.db import transaction
-from django.db.models import Count
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Sum
 from django.template import Context
 from django.template.loader import render_to_string
 from django.contrib.sites.models import Site
 from apps.jobs.models import (Job,
                               run_job_task,
                               JobTaskResult,
-                              getQueue)
+                              getQueue,
+                              getTaskQueueName)
 from apps.web.models import (add_submission_to_leaderboard,
                              Competition,
+                             CompetitionPhase,
                              CompetitionSubmission,
                              CompetitionDefBundle,
                              CompetitionSubmissionStatus,
+                             FileContentHash,
+                             get_scoredefs_by_key,
+                             invalidate_leaderboard,
+                             PhaseLeaderBoard,
+                             PhaseMigration,
+                             ScoringArtifact,
                              submission_prediction_output_filename,
                              submission_output_filename,
                              submission_detailed_results_filename,
@@ -35,14 +45,11 @@ from apps.web.models import (add_submission_to_leaderboard,
                              submission_stdout_filename,
                              submission_stderr_filename,
                              submission_history_file_name,
-                             submission_scores_file_name,
-                             submission_coopetition_file_name,
                              predict_submission_stdout_filename,
                              predict_submission_stderr_filename,
                              SubmissionScore,
-                             SubmissionScoreDef,
                              CompetitionSubmissionMetadata)
-from apps.coopetitions.models import DownloadRecord
+from apps.coopetitions.models import DownloadRecord, Like, Dislike
 
 logger = logging.getLogger(__name__)
 
@@ -139,6 +146,30 @@ def _set_submission_status(submission_id, status_codename):
             logger.info("Skipping update of submission status: invalid transition %s -> %s  (id=%s).",
                         status_codename, old_status_codename, submission_id)
 
+def _get_run_limits(phase):
+    """
+    Returns the limits of the programs run for a submission to the phase, and the compression
+    level of their outputs, as task arguments for the compute workers. Memory and disk are sent
+    in bytes, missing limits as None.
+    """
+    def to_bytes(megabytes):
+        return megabytes * 1024 * 1024 if megabytes else None
+    return {
+        "execution_time_limit": phase.execution_time_limit,
+        "memory_limit": to_bytes(phase.memory_limit),
+        "cpu_limit": phase.cpu_limit or None,
+        "process_limit": phase.process_limit or None,
+        "disk_limit": to_bytes(phase.disk_limit),
+        "output_compression_level": phase.output_compression_level,
+    }
+
+def _get_compute_queue(phase):
+    """
+    Returns the queue of the compute workers running the submissions to the phase: its own
+    queue when it has one, so its runs go to the workers holding its bundles.
+    """
+    return getQueue(settings.SBS_PHASE_COMPUTE_QUEUES.get(phase.pk, settings.SBS_COMPUTE_QUEUE))
+
 def predict(submission, job_id):
     """
     Dispatches the prediction taks for the given submission to an appropriate compute worker.
@@ -176,70 +207,67 @@ def predict(submission, job_id):
     submission.execution_key = json.dumps({'predict' : job_id})
     submission.save()
     # Submit the request to the computation service
+    task_args = {
+        "bundle_id": submission.prediction_runfile.name,
+        "container_name": settings.BUNDLE_AZURE_CONTAINER,
+        "reply_to": getTaskQueueName('run_update'),
+        "predict": True,
+        # Bundles shared by the runs of the phase, which compute workers may keep staged
+        "phase_id": submission.phase.pk,
+        "phase_bundles": [submission.phase.input_data.name] if submission.phase.input_data.name else [],
+    }
+    task_args.update(_get_run_limits(submission.phase))
     body = json.dumps({
         "id" : job_id,
         "task_type": "run",
-        "task_args": {
-            "bundle_id": submission.prediction_runfile.name,
-            "container_name": settings.BUNDLE_AZURE_CONTAINER,
-            "reply_to": settings.SBS_RESPONSE_QUEUE,
-            "execution_time_limit": submission.phase.execution_time_limit,
-            "predict": True,
-        }
+        "task_args": task_args
     })
 
-    getQueue(settings.SBS_COMPUTE_QUEUE).send_message(body)
+    _get_compute_queue(submission.phase).send_message(body)
     # Update the submission object
     _set_submission_status(submission.id, CompetitionSubmissionStatus.SUBMITTED)
 
-def score(submission, job_id):
+def get_scores_artifact(phase):
     """
-    Dispatches the scoring task for the given submission to an appropriate compute worker.
+    Returns the ScoringArtifact holding the scores.txt of the given phase, i.e. the results CSV
+    of its leaderboard. It is generated when the leaderboard has changed since it was last built.
 
-    submission: The CompetitionSubmission object.
-    job_id: The job ID used to track the progress of the evaluation.
+    phase: The CompetitionPhase object.
     """
-    # Loads the computation state.
-    state = {}
-    if len(submission.execution_key) > 0:
-        state = json.loads(submission.execution_key)
-    has_generated_predictions = 'predict' in state
-
-    #generate metadata-only bundle describing the history of submissions and phases
-    last_submissions = CompetitionSubmission.objects.filter(
-        participant=submission.participant,
-        status__codename=CompetitionSubmissionStatus.FINISHED
-    ).order_by('-submitted_at')
-
-
-    lines = []
-    lines.append("description: history of all previous successful runs output files")
+    lb, _ = PhaseLeaderBoard.objects.get_or_create(phase=phase)
+    artifact = ScoringArtifact.get_current(phase.competition, phase, ScoringArtifact.SCORES, lb.version)
+    if artifact is None:
+        logger.debug("Generating scores.txt (phase_id=%s, version=%s)", phase.pk, lb.version)
+        score_csv = phase.competition.get_results_csv(phase.pk)
+        artifact = ScoringArtifact.store(phase.competition, phase, ScoringArtifact.SCORES, lb.version,
+                                         'scores.txt', score_csv.encode('utf-8'))
+    return artifact
 
-    if last_submissions:
-        for past_submission in last_submissions:
-            if past_submission.pk != submission.pk:
-                #pad folder numbers for sorting os side, 001, 002, 003,... 010, etc...
-                past_submission_phasenumber = '%03d' % past_submission.phase.phasenumber
-                past_submission_number = '%03d' % past_submission.submission_number
-                lines.append('%s/%s/output/: %s' % (
-                        past_submission_phasenumber,
-                        past_submission_number,
-                        submission_private_output_filename(past_submission),
-                    )
-                )
-    else:
-        pass
 
-    submission.history_file.save('history.txt', ContentFile('\n'.join(lines)))
+def _coopetition_version(competition):
+    """
+    Returns a fingerprint of the data in the coopetition files of a competition: the versions
+    of its leaderboards, the version of its likes, dislikes and downloads (bumped whenever
+    one of them changes), and the publication of its submissions. It only takes a few queries.
+    """
+    submissions = CompetitionSubmission.objects.filter(phase__competition=competition)
+    fingerprint = [
+        list(PhaseLeaderBoard.objects.filter(phase__competition=competition).order_by('phase').values_list('phase', 'version')),
+        list(Competition.objects.filter(pk=competition.pk).values_list('coopetition_version', flat=True)),
+        sorted(submissions.aggregate(Max('when_made_public'), Max('when_unmade_public'), Sum('download_count')).items()),
+    ]
+    return hashlib.sha1(repr(fingerprint)).hexdigest()
 
-    score_csv = submission.phase.competition.get_results_csv(submission.phase.pk)
-    submission.scores_file.save('scores.txt', ContentFile(score_csv))
 
-    # Extra submission info
+def _build_coopetition_zip(competition):
+    """
+    Returns the content of the coopetition zip file of a competition, without the file naming
+    the current user which is added for each submission.
+    """
     coopetition_zip_buffer = StringIO.StringIO()
     coopetition_zip_file = zipfile.ZipFile(coopetition_zip_buffer, "w")
 
-    for phase in submission.phase.competition.phases.all():
+    for phase in competition.phases.all():
         coopetition_field_names = (
             "participant__user__username",
             "pk",
@@ -266,7 +294,7 @@ def score(submission, job_id):
         coopetition_zip_file.writestr('coopetition_phase_%s.txt' % phase.phasenumber, coopetition_csv.getvalue().encode('utf-8'))
 
     # Scores metadata
-    for phase in submission.phase.competition.phases.all():
+    for phase in competition.phases.all():
         coopetition_zip_file.writestr(
             'coopetition_scores_phase_%s.txt' % phase.phasenumber,
             phase.competition.get_results_csv(phase.pk, include_scores_not_on_leaderboard=True).encode('utf-8')
@@ -281,7 +309,10 @@ def score(submission, job_id):
         "downloaded_by",
         "time_of_download",
     ))
-    for download in DownloadRecord.objects.filter(submission__phase__competition=submission.phase.competition):
+    downloads = DownloadRecord.objects.filter(submission__phase__competition=competition).select_related(
+        'submission__participant__user', 'user'
+    )
+    for download in downloads:
         writer.writerow((
             download.submission.pk,
             download.submission.participant.user.username,
@@ -290,13 +321,124 @@ def score(submission, job_id):
         ))
 
     coopetition_zip_file.writestr('coopetition_downloads.txt', coopetition_downloads_csv.getvalue().encode('utf-8'))
-
-    # Current user
-    coopetition_zip_file.writestr('current_user.txt', submission.participant.user.username.encode('utf-8'))
     coopetition_zip_file.close()
+    return coopetition_zip_buffer.getvalue()
+
+
+def get_coopetition_artifact(competition):
+    """
+    Returns the ScoringArtifact holding the coopetition zip file of the given competition. It is
+    generated when the competition's leaderboards or submissions have changed since it was last built.
+
+    competition: The Competition object.
+    """
+    version = _coopetition_version(competition)
+    artifact = ScoringArtifact.get_current(competition, None, ScoringArtifact.COOPETITION, version)
+    if artifact is None:
+        logger.debug("Generating coopetition.zip (competition_id=%s, version=%s)", competition.pk, version)
+        artifact = ScoringArtifact.store(competition, None, ScoringArtifact.COOPETITION, version,
+                                         'coopetition.zip', _build_coopetition_zip(competition))
+    return artifact
+
 
-    # Save them all
-    submission.coopetition_file.save('coopetition.zip', ContentFile(coopetition_zip_buffer.getvalue()))
+# Seconds a pending precompute job of a competition keeps others from being started, in
+# case it is lost
+_PRECOMPUTE_PENDING_TIMEOUT = 10 * 60
+
+
+def _precompute_pending_cache_key(competition_pk):
+    return "scoring_artifacts:pending:%s" % competition_pk
+
+
+def precompute_scoring_artifacts_task(job_id, args):
+    """
+    Generates the scoring artifacts of the phases of a competition ahead of their next
+    scoring runs.
+
+    job_id: The ID of the job.
+    args: A dictionary with the arguments for the task. Expected items are:
+        args['competition_id']: The ID of the Competition object.
+        args['phase_id']: The ID of a CompetitionPhase object, used by the jobs started
+            before the artifacts were generated per competition.
+    """
+    def precompute_it(job):
+        if 'competition_id' in args:
+            competition = Competition.objects.get(pk=args['competition_id'])
+        else:
+            competition = CompetitionPhase.objects.select_related('competition').get(pk=args['phase_id']).competition
+        # Changes made from now on need another job
+        cache.delete(_precompute_pending_cache_key(competition.pk))
+        for phase in competition.phases.all():
+            get_scores_artifact(phase)
+        get_coopetition_artifact(competition)
+        return JobTaskResult(status=Job.FINISHED)
+    return run_job_task(job_id, precompute_it)
+
+
+def precompute_scoring_artifacts(competition):
+    """
+    Starts a job generating the scoring artifacts of the given competition in the background,
+    unless one is already waiting to run.
+
+    competition: The Competition object.
+
+    Returns the Job object, or None if a job was already pending.
+    """
+    if not cache.add(_precompute_pending_cache_key(competition.pk), True, _PRECOMPUTE_PENDING_TIMEOUT):
+        return None
+    try:
+        return Job.objects.create_and_dispatch_job('precompute_scoring_artifacts', {'competition_id': competition.pk})
+    except:
+        cache.delete(_precompute_pending_cache_key(competition.pk))
+        raise
+
+
+def score(submission, job_id):
+    """
+    Dispatches the scoring task for the given submission to an appropriate compute worker.
+
+    submission: The CompetitionSubmission object.
+    job_id: The job ID used to track the progress of the evaluation.
+    """
+    # Loads the computation state.
+    state = {}
+    if len(submission.execution_key) > 0:
+        state = json.loads(submission.execution_key)
+    has_generated_predictions = 'predict' in state
+
+    #generate metadata-only bundle describing the history of submissions and phases
+    last_submissions = CompetitionSubmission.objects.filter(
+        participant=submission.participant,
+        status__codename=CompetitionSubmissionStatus.FINISHED
+    ).order_by('-submitted_at')
+
+
+    lines = []
+    lines.append("description: history of all previous successful runs output files")
+
+    if last_submissions:
+        for past_submission in last_submissions:
+            if past_submission.pk != submission.pk:
+                #pad folder numbers for sorting os side, 001, 002, 003,... 010, etc...
+                past_submission_phasenumber = '%03d' % past_submission.phase.phasenumber
+                past_submission_number = '%03d' % past_submission.submission_number
+                lines.append('%s/%s/output/: %s' % (
+                        past_submission_phasenumber,
+                        past_submission_number,
+                        submission_private_output_filename(past_submission),
+                    )
+                )
+    else:
+        pass
+
+    submission.history_file.save('history.txt', ContentFile('\n'.join(lines)))
+
+    # scores.txt is shared by the scoring runs of the phase until its leaderboard changes
+    submission.scores_file.name = get_scores_artifact(submission.phase).file.name
+
+    # coopetition.zip is shared by the scoring runs of the competition until its data changes;
+    # the compute worker adds current_user.txt from the current-user line of input.txt
+    submission.coopetition_file.name = get_coopetition_artifact(submission.phase.competition).file.name
 
     # Generate metadata-only bundle describing the inputs. Reference data is an optional
     # dataset provided by the competition organizer. Results are provided by the participant
@@ -313,8 +455,9 @@ def score(submission, job_id):
         raise ValueError("Results are missing.")
 
     lines.append("history: %s" % submission_history_file_name(submission))
-    lines.append("scores: %s" % submission_scores_file_name(submission))
-    lines.append("coopetition: %s" % submission_coopetition_file_name(submission))
+    lines.append("scores: %s" % submission.scores_file.name)
+    lines.append("coopetition: %s" % submission.coopetition_file.name)
+    lines.append("current-user: %s" % json.dumps(submission.participant.user.username))
     lines.append("submitted-by: %s" % submission.participant.user.username)
     lines.append("submitted-at: %s" % submission.submitted_at.replace(microsecond=0).isoformat())
     lines.append("competition-submission: %s" % submission.submission_number)
@@ -356,21 +499,187 @@ def score(submission, job_id):
     submission.execution_key = json.dumps(state)
     submission.save()
     # Submit the request to the computation service
+    task_args = {
+        "bundle_id" : submission.runfile.name,
+        "container_name" : settings.BUNDLE_AZURE_CONTAINER,
+        "reply_to" : getTaskQueueName('run_update'),
+        "predict": False,
+        # Bundles shared by the runs of the phase, which compute workers may keep staged
+        "phase_id": submission.phase.pk,
+        "phase_bundles": [name for name in (program_value, ref_value) if name],
+    }
+    task_args.update(_get_run_limits(submission.phase))
     body = json.dumps({
         "id" : job_id,
         "task_type": "run",
-        "task_args": {
-            "bundle_id" : submission.runfile.name,
-            "container_name" : settings.BUNDLE_AZURE_CONTAINER,
-            "reply_to" : settings.SBS_RESPONSE_QUEUE,
-            "execution_time_limit": submission.phase.execution_time_limit,
-            "predict": False,
-        }
+        "task_args": task_args
     })
-    getQueue(settings.SBS_COMPUTE_QUEUE).send_message(body)
+    _get_compute_queue(submission.phase).send_message(body)
     if has_generated_predictions == False:
         _set_submission_status(submission.id, CompetitionSubmissionStatus.SUBMITTED)
 
+def ingest_scores(submission, scores):
+    """
+    Stores the scores listed in the content of a scores.txt file, one "key: value" per line.
+    The score definitions are resolved from the cached lookup of the competition and the
+    scores are written with a single insert, in the transaction which deletes the scores of an
+    earlier attempt. Keys which match no score definition are skipped and reported together.
+
+    submission: The CompetitionSubmission object the scores belong to.
+    scores: The content of the scores.txt file.
+    """
+    scoredefs = get_scoredefs_by_key(submission.phase.competition_id)
+    new_scores = []
+    unknown_keys = []
+    for line in scores.split("\n"):
+        if len(line) > 0:
+            label, value = line.split(":")
+            key = label.strip()
+            if key not in scoredefs:
+                unknown_keys.append(key)
+                continue
+            scoredef_id, computed = scoredefs[key]
+            value = float(value)
+            if computed is True and value:
+                raise IntegrityError("Score is computed. Cannot assign a value")
+            new_scores.append(SubmissionScore(result=submission, scoredef_id=scoredef_id, value=value))
+    if len(unknown_keys) > 0:
+        logger.warning("Scores %s do not exist (submission_id=%s)", ", ".join(unknown_keys), submission.id)
+    with transaction.commit_on_success():
+        # Scores of an earlier attempt which failed before the submission was finished
+        SubmissionScore.objects.filter(result=submission).delete()
+        SubmissionScore.objects.bulk_create(new_scores)
+    return new_scores
+
+
+def _finish_submission(submission):
+    """
+    Marks a submission whose scores are stored as finished, adds it to the leaderboard when
+    its phase or competition does so automatically and notifies the participant.
+
+    submission: The CompetitionSubmission object.
+    """
+    _set_submission_status(submission.id, CompetitionSubmissionStatus.FINISHED)
+    # bulk_create sends no signals, the new scores must invalidate the leaderboard here
+    invalidate_leaderboard(submission.phase)
+    # Automatically submit to the leaderboard?
+    if submission.phase.is_blind:
+        logger.debug("Adding to leaderboard... (submission_id=%s)", submission.id)
+        add_submission_to_leaderboard(submission)
+        logger.debug("Leaderboard updated with latest submission (submission_id=%s)", submission.id)
+
+    if submission.phase.competition.force_submission_to_leaderboard:
+        add_submission_to_leaderboard(submission)
+        logger.debug("Force submission added submission to leaderboard (submission_id=%s)", submission.id)
+
+    try:
+        precompute_scoring_artifacts(submission.phase.competition)
+    except Exception:
+        # Scoring runs generate missing artifacts themselves
+        logger.exception("Failed to start precomputing scoring artifacts (submission_id=%s)", submission.id)
+
+    if submission.participant.user.email_on_submission_finished_successfully:
+        email = submission.participant.user.email
+        site_url = "https://%s%s" % (Site.objects.get_current().domain, submission.phase.competition.get_absolute_url())
+        send_mail(
+            'Submission has finished successfully!',
+            'Your submission to the competition "%s" has finished successfully! View it here: %s' %
+            (submission.phase.competition.title, site_url),
+            settings.DEFAULT_FROM_EMAIL,
+            [email],
+            fail_silently=False
+        )
+
+# Files holding the result of an evaluation, shared by the submissions reusing it
+_RESULT_FILE_FIELDS = (
+    'output_file',
+    'private_output_file',
+    'detailed_results_file',
+    'stdout_file',
+    'stderr_file',
+    'prediction_output_file',
+    'prediction_stdout_file',
+    'prediction_stderr_file',
+)
+
+def _get_evaluation_key(submission, predict):
+    """
+    Returns the key identifying the evaluation of a submission: a hash of the content of the
+    submitted file and of the bundles of the phase the programs run with. Returns None when
+    the phase does not reuse results or the files cannot be read.
+
+    submission: The CompetitionSubmission object.
+    predict: True if the submission is a program generating predictions before scoring.
+    """
+    phase = submission.phase
+    if not phase.reuse_identical_results:
+        return None
+    files = [submission.file, phase.scoring_program, phase.reference_data]
+    if predict:
+        files.append(phase.input_data)
+    try:
+        hashes = [FileContentHash.get_hash(f) if f.name else '' for f in files]
+    except Exception:
+        logger.exception("Unable to hash the files of the evaluation (submission_id=%s)", submission.id)
+        return None
+    return hashlib.sha256(json.dumps(['predict' if predict else 'score'] + hashes)).hexdigest()
+
+def _find_identical_result(submission):
+    """
+    Returns the latest finished submission of the same participant evaluated with the same
+    key as the given submission, or None.
+    """
+    if not submission.evaluation_key:
+        return None
+    submissions = CompetitionSubmission.objects.filter(
+        participant=submission.participant,
+        evaluation_key=submission.evaluation_key,
+        status__codename=CompetitionSubmissionStatus.FINISHED
+    ).exclude(pk=submission.pk).order_by('-pk')
+    return submissions[0] if submissions else None
+
+def _reuse_identical_result(submission, predict, job_id):
+    """
+    Completes the evaluation of a submission with the result of an identical evaluation, when
+    there is one: the output files are shared and the scores copied, and no compute job is
+    dispatched. The evaluation key of the submission is recorded either way, so later
+    identical submissions can reuse its result.
+
+    submission: The CompetitionSubmission object.
+    predict: True if the submission is a program generating predictions before scoring.
+    job_id: The job ID used to track the progress of the evaluation.
+
+    Returns True if a result was reused.
+    """
+    submission.evaluation_key = _get_evaluation_key(submission, predict)
+    if submission.evaluation_key is None:
+        return False
+    CompetitionSubmission.objects.filter(pk=submission.pk).update(evaluation_key=submission.evaluation_key)
+    source = _find_identical_result(submission)
+    if source is None:
+        return False
+    logger.info("Reusing the result of submission %s (submission_id=%s)", source.pk, submission.id)
+
+    def reuse_it(job):
+        for field_name in _RESULT_FILE_FIELDS:
+            getattr(submission, field_name).name = getattr(source, field_name).name
+        submission.execution_key = json.dumps({'reused': source.pk})
+        submission.save()
+        scores = [SubmissionScore(result=submission, scoredef_id=scoredef_id, value=value)
+                  for scoredef_id, value in source.scores.values_list('scoredef_id', 'value')]
+        with transaction.commit_on_success():
+            SubmissionScore.objects.filter(result=submission).delete()
+            SubmissionScore.objects.bulk_create(scores)
+        _finish_submission(submission)
+        return JobTaskResult(status=Job.FINISHED)
+
+    def handle_reuse_exception(job, ex):
+        _set_submission_status(submission.id, CompetitionSubmissionStatus.FAILED)
+        return JobTaskResult(status=Job.FAILED)
+
+    run_job_task(job_id, reuse_it, handle_reuse_exception)
+    return True
+
 class SubmissionUpdateException(Exception):
     """Defines an exception that occurs during the update of a CompetitionSubmission object."""
     def __init__(self, submission, inner_exception):
@@ -429,48 +738,17 @@ def update_submission_task(job_id, args):
                 ozip = ZipFile(io.BytesIO(submission.output_file.read()))
                 scores = None
                 try:
-                    scores = open(ozip.extract('scores.txt'), 'r').read()
+                    scores = ozip.read('scores.txt')
                 except Exception:
                     logger.error("Scores.txt not found, unable to process submission: %s (submission_id=%s)", status, submission.id)
                     _set_submission_status(submission.id, CompetitionSubmissionStatus.FAILED)
                     return Job.FAILED
 
                 logger.debug("Processing scores... (submission_id=%s)", submission.id)
-                for line in scores.split("\n"):
-                    if len(line) > 0:
-                        label, value = line.split(":")
-                        logger.debug("Attempting to submit score %s:%s" % (label, value))
-                        try:
-                            scoredef = SubmissionScoreDef.objects.get(competition=submission.phase.competition,
-                                                                      key=label.strip())
-                            SubmissionScore.objects.create(result=submission, scoredef=scoredef, value=float(value))
-                        except SubmissionScoreDef.DoesNotExist:
-                            logger.warning("Score %s does not exist (submission_id=%s)", label, submission.id)
+                ingest_scores(submission, scores)
                 logger.debug("Done processing scores... (submission_id=%s)", submission.id)
-                _set_submission_status(submission.id, CompetitionSubmissionStatus.FINISHED)
-                # Automatically submit to the leaderboard?
-                if submission.phase.is_blind:
-                    logger.debug("Adding to leaderboard... (submission_id=%s)", submission.id)
-                    add_submission_to_leaderboard(submission)
-                    logger.debug("Leaderboard updated with latest submission (submission_id=%s)", submission.id)
-
-                if submission.phase.competition.force_submission_to_leaderboard:
-                    add_submission_to_leaderboard(submission)
-                    logger.debug("Force submission added submission to leaderboard (submission_id=%s)", submission.id)
-
+                _finish_submission(submission)
                 result = Job.FINISHED
-
-                if submission.participant.user.email_on_submission_finished_successfully:
-                    email = submission.participant.user.email
-                    site_url = "https://%s%s" % (Site.objects.get_current().domain, submission.phase.competition.get_absolute_url())
-                    send_mail(
-                        'Submission has finished successfully!',
-                        'Your submission to the competition "%s" has finished successfully! View it here: %s' %
-                        (submission.phase.competition.title, site_url),
-                        settings.DEFAULT_FROM_EMAIL,
-                        [email],
-                        fail_silently=False
-                    )
             else:
                 logger.debug("update_submission_task entering scoring phase (pk=%s)", submission.pk)
                 url_name = pathname2url(submission_prediction_output_filename(submission))
@@ -520,6 +798,16 @@ def update_submission_task(job_id, args):
         logger.debug("Looking for submission (job_id=%s, submission_id=%s)", job.id, submission_id)
         submission = CompetitionSubmission.objects.get(pk=submission_id)
         status = args['status']
+        # Compute workers may run a task again when they lose it, so updates can be received
+        # twice or arrive after the evaluation moved on: those are ignored.
+        if submission.status.codename in _FINAL_STATES:
+            logger.info("Ignoring update of a completed submission (job_id=%s, submission_id=%s, status=%s)",
+                        job.id, submission_id, status)
+            return JobTaskResult()
+        if args.get('predict') and 'score' in json.loads(submission.execution_key or '{}'):
+            logger.info("Ignoring update of a completed prediction (job_id=%s, submission_id=%s, status=%s)",
+                        job.id, submission_id, status)
+            return JobTaskResult()
         logger.debug("Ready to update submission status (job_id=%s, submission_id=%s, status=%s)",
                      job.id, submission_id, status)
         result = None
@@ -563,6 +851,24 @@ def evaluate_submission_task(job_id, args):
         predict_and_score = args['predict'] == True
         logger.debug("evaluate_submission_task predict_and_score=%s (job_id=%s)", predict_and_score, job_id)
         submission = CompetitionSubmission.objects.get(pk=submission_id)
+        # Claims the submission, so a message of the job delivered twice, e.g. sent again by a
+        # resumed phase migration, does not start a second evaluation. The claim is kept in the
+        # object as well, so the saves made while dispatching do not release it.
+        claim = json.dumps({'evaluate': job_id})
+        claimed = CompetitionSubmission.objects.filter(pk=submission_id, execution_key='').update(execution_key=claim)
+        if claimed == 0:
+            logger.info("evaluate_submission_task skips a submission already being evaluated (submission_id=%s, job_id=%s)",
+                        submission_id, job_id)
+            state = json.loads(CompetitionSubmission.objects.get(pk=submission_id).execution_key)
+            if job_id not in (state.get('evaluate'), state.get('predict'), state.get('score')):
+                # Nothing else reports the status of this job
+                run_job_task(job_id, lambda job: JobTaskResult(status=Job.FINISHED))
+            return
+        submission.execution_key = claim
+        if _reuse_identical_result(submission, predict_and_score, job_id):
+            logger.debug("evaluate_submission_task reused an identical result (submission_id=%s, job_id=%s)",
+                         submission_id, job_id)
+            return
 
         task_name, task_func = ('prediction', predict) if predict_and_score else ('scoring', score)
         try:
@@ -591,6 +897,54 @@ def evaluate_submission(submission_id, is_scoring_only):
     task_args = {'submission_id': submission_id, 'predict': (not is_scoring_only)}
     return Job.objects.create_and_dispatch_job('evaluate_submission', task_args)
 
+def create_evaluation_jobs(submission_ids, is_scoring_only):
+    """
+    Creates the jobs evaluating several submissions at once, e.g. those moved by a phase
+    migration, within the caller's transaction. The caller dispatches them with
+    Job.objects.dispatch_jobs once the transaction is committed.
+
+    submission_ids: The IDs of the CompetitionSubmission objects.
+    is_scoring_only: True to skip the prediction step.
+
+    Returns the list of Job objects.
+    """
+    task_args_list = [{'submission_id': submission_id, 'predict': (not is_scoring_only)}
+                      for submission_id in submission_ids]
+    return Job.objects.create_jobs('evaluate_submission', task_args_list)
+
+
+def check_phase_migrations_task(job_id, args):
+    """
+    Checks the automatic phase migrations of some competitions, and resumes the stalled ones.
+
+    job_id: The ID of the job.
+    args: A dictionary with the arguments for the task. Expected items are:
+        args['competition_ids']: The IDs of the Competition objects to check.
+        args['resume_stalled']: True to resume the migrations which stopped making progress.
+    """
+    def check_it(job):
+        if args.get('resume_stalled'):
+            PhaseMigration.resume_stalled()
+        for competition in Competition.objects.filter(pk__in=args.get('competition_ids', []), is_migrating=False):
+            try:
+                competition.check_future_phase_sumbmissions()
+            except Exception:
+                # A failed migration stalls and is resumed later, the others go on
+                logger.exception("Failed to check the phase migrations (competition pk=%s)", competition.pk)
+        return JobTaskResult(status=Job.FINISHED)
+    return run_job_task(job_id, check_it)
+
+
+def check_phase_migrations(competition_ids, resume_stalled=False):
+    """
+    Starts a job checking the automatic phase migrations of the given competitions.
+
+    competition_ids: The IDs of the Competition objects.
+    resume_stalled: True to also resume the migrations which stopped making progress.
+    """
+    task_args = {'competition_ids': sorted(competition_ids), 'resume_stalled': resume_stalled}
+    return Job.objects.create_and_dispatch_job('check_phase_migrations', task_args)
+
 
 def _send_mass_html_mail(datatuple, fail_silently=False, user=None, password=None,
                         connection=None):
@@ -1,5 +1,6 @@
 import mock
 import datetime
+import zlib
 
 from django.conf import settings
 from django.core.urlresolvers import reverse
@@ -7,6 +8,8 @@ from django.test import TestCase
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
 
+from apps.web.views import CompetitionCompleteResultsDownload
+
 from apps.web.models import (Competition,
                              CompetitionParticipant,
                              CompetitionPhase,
@@ -94,3 +97,46 @@ class CompetitionDownloadCSVTests(TestCase):
         '''Unicode set in setUp method'''
         resp = self.client.get(self.url)
         self.assertEquals(resp.status_code, 200)
+
+    def test_download_competition_csv_is_streamed(self):
+        CompetitionSubmission.objects.filter(pk=self.submission_1.pk).update(
+            status=CompetitionSubmissionStatus.objects.get(codename="finished")
+        )
+        resp = self.client.get(self.url)
+        self.assertTrue(resp.streaming)
+        lines = ''.join(resp.streaming_content).splitlines()
+        self.assertEquals(lines[0], u"Test \u2020".encode("utf-8"))
+        row = lines[4].split(',')
+        self.assertEquals(row[0], u"testuser\u2020".encode("utf-8"))
+        self.assertEquals(row[2], u"Some description with unicode \u2020".encode("utf-8"))
+        self.assertEquals(row[-1], "True")
+
+    def test_deleted_submissions_are_skipped(self):
+        view = CompetitionCompleteResultsDownload()
+        groups = self.phase_1.scores(include_scores_not_on_leaderboard=True)
+        CompetitionSubmission.objects.filter(pk=self.submission_1.pk).delete()
+
+        with mock.patch('apps.web.models.CompetitionPhase.scores', return_value=groups):
+            rows = list(view.get_rows(self.phase_1))
+        self.assertEqual([u"Test \u2020".encode("utf-8")], rows[0])
+        self.assertFalse(any(row and row[0] == u"testuser\u2020".encode("utf-8") for row in rows))
+
+    def test_download_competition_csv_gzip(self):
+        content = ''.join(self.client.get(self.url).streaming_content)
+        resp = self.client.get(self.url, {'gzip': 1})
+        self.assertEquals(resp['Content-Type'], "application/x-gzip")
+        self.assertEquals(zlib.decompress(''.join(resp.streaming_content), 16 + zlib.MAX_WBITS), content)
+
+    def test_leaderboard_errors_are_raised_before_streaming(self):
+        with mock.patch('apps.web.models.CompetitionPhase.scores', side_effect=ValueError("Broken leaderboard")):
+            self.assertRaises(ValueError, self.client.get, self.url)
+            results_url = reverse("competitions:competition_results_download",
+                                  kwargs={"id": self.competition.pk, "phase": self.phase_1.pk})
+            self.assertRaises(ValueError, self.client.get, results_url)
+
+    def test_rows_which_cannot_be_written_are_reported(self):
+        results_url = reverse("competitions:competition_results_download",
+                              kwargs={"id": self.competition.pk, "phase": self.phase_1.pk})
+        lines = ''.join(self.client.get(results_url).streaming_content).splitlines()
+        # The unicode username does not encode in the results CSV
+        self.assertIn("Exception parsing scores!", lines)
@@ -105,7 +105,7 @@ class CompetitionPhaseToPhase(TestCase):
         self.assertTrue(do_migration_mock.called)
 
     def test_check_trailing_phase_submissions_migrates_trailing_submissions_properly(self):
-        with mock.patch('apps.web.tasks.evaluate_submission') as evaluate_mock:
+        with mock.patch('apps.web.tasks.create_evaluation_jobs') as evaluate_mock:
             self.competition.check_trailing_phase_submissions()
 
         self.assertTrue(evaluate_mock.called)
@@ -154,7 +154,7 @@ class CompetitionPhaseToPhase(TestCase):
         self.phase_2.max_submissions_per_day = 1
         self.phase_2.save()
 
-        with mock.patch('apps.web.tasks.evaluate_submission') as evaluate_mock:
+        with mock.patch('apps.web.tasks.create_evaluation_jobs') as evaluate_mock:
             self.competition.check_trailing_phase_submissions()
 
         # The submissions still made it
@@ -169,7 +169,7 @@ class CompetitionPhaseToPhase(TestCase):
     def test_phase_migrations_delayed_until_submissions_not_marked_running(self):
         self.submission_1.status = CompetitionSubmissionStatus.objects.get_or_create(name="running", codename="running")[0]
         self.submission_1.save()
-        with mock.patch('apps.web.tasks.evaluate_submission') as evaluate_mock:
+        with mock.patch('apps.web.tasks.create_evaluation_jobs') as evaluate_mock:
             self.competition.check_trailing_phase_submissions()
         self.assertFalse(evaluate_mock.called)
 
@@ -179,20 +179,20 @@ class CompetitionPhaseToPhase(TestCase):
             board=self.leader_board,
             result=self.submission_1
         )
-        with mock.patch('apps.web.tasks.evaluate_submission') as evaluate_mock:
+        with mock.patch('apps.web.tasks.create_evaluation_jobs') as evaluate_mock:
             self.competition.check_trailing_phase_submissions()
         self.assertTrue(evaluate_mock.called)
 
     def test_phase_migrations_handles_delay_with_failed_submissions(self):
         self.submission_1.status = CompetitionSubmissionStatus.objects.get_or_create(name="running", codename="running")[0]
         self.submission_1.save()
-        with mock.patch('apps.web.tasks.evaluate_submission') as evaluate_mock:
+        with mock.patch('apps.web.tasks.create_evaluation_jobs') as evaluate_mock:
             self.competition.check_trailing_phase_submissions()
         self.assertFalse(evaluate_mock.called)
 
         self.submission_1.status = CompetitionSubmissionStatus.objects.get_or_create(name="failed", codename="failed")[0]
         self.submission_1.save()
-        with mock.patch('apps.web.tasks.evaluate_submission') as evaluate_mock:
+        with mock.patch('apps.web.tasks.create_evaluation_jobs') as evaluate_mock:
             self.competition.check_trailing_phase_submissions()
         self.assertTrue(evaluate_mock.called)
 
@@ -200,7 +200,7 @@ class CompetitionPhaseToPhase(TestCase):
         self.submission_1.status = CompetitionSubmissionStatus.objects.get_or_create(name="running", codename="running")[0]
         self.submission_1.save()
         self.assertFalse(self.competition.is_migrating_delayed)
-        with mock.patch('apps.web.tasks.evaluate_submission') as evaluate_mock:
+        with mock.patch('apps.web.tasks.create_evaluation_jobs') as evaluate_mock:
             self.competition.check_trailing_phase_submissions()
         self.assertTrue(self.competition.is_migrating_delayed)
 
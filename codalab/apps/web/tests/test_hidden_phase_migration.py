@@ -12,7 +12,8 @@ from apps.web.models import (Competition,
                              CompetitionSubmissionStatus,
                              ParticipantStatus,
                              PhaseLeaderBoard,
-                             PhaseLeaderBoardEntry)
+                             PhaseLeaderBoardEntry,
+                             PhaseMigration)
 
 User = get_user_model()
 
@@ -104,12 +105,6 @@ class CompetitionHiddenPhaseMigration(TestCase):
 
         self.client = Client()
 
-    def test_scheduler_url_call_competition_phase_migration(self):
-        with mock.patch('apps.web.models.Competition.check_future_phase_sumbmissions') as check_future_migrations_mock:
-            resp = self.client.get('/competitions/check_phase_migrations')
-
-        self.assertTrue(check_future_migrations_mock.called)
-
     def test_phase_to_phase_migrations_only_when_auto_migration_flag_is_true(self):
         '''
         Will only migrate when phase 2 auto_migration = True
@@ -158,7 +153,7 @@ class CompetitionHiddenPhaseMigration(TestCase):
         Will perform migrations when submission auto_migrated = False
         1. We need a few submissions to test this behavior
         '''
-        with mock.patch('apps.web.tasks.evaluate_submission') as perform_migration:
+        with mock.patch('apps.web.tasks.create_evaluation_jobs') as perform_migration:
             self.submission_1.is_migrated = False
             self.submission_2.is_migrated = False
             self.submission_1.save()
@@ -181,23 +176,35 @@ class CompetitionHiddenPhaseMigration(TestCase):
         self.submission_1.status = CompetitionSubmissionStatus.objects.get_or_create(name="running", codename="running")[0]
         self.submission_1.save()
 
-        with mock.patch('apps.web.tasks.evaluate_submission') as evaluate_mock:
+        with mock.patch('apps.web.tasks.create_evaluation_jobs') as evaluate_mock:
             self.competition.check_future_phase_sumbmissions()
         self.assertFalse(evaluate_mock.called)
 
         self.submission_1.status = CompetitionSubmissionStatus.objects.get_or_create(name="finished", codename="finished")[0]
         self.submission_1.is_migrated = False
         self.submission_1.save()
-        with mock.patch('apps.web.tasks.evaluate_submission') as evaluate_mock:
+        with mock.patch('apps.web.tasks.create_evaluation_jobs') as evaluate_mock:
             self.competition.check_future_phase_sumbmissions()
         self.assertTrue(evaluate_mock.called)
 
+    def test_no_migration_is_recorded_without_submissions_to_move(self):
+        CompetitionSubmission.objects.filter(phase=self.phase_1).update(is_migrated=True)
+        Competition.objects.filter(pk=self.competition.pk).update(is_migrating_delayed=True)
+        competition = Competition.objects.get(pk=self.competition.pk)
+
+        with mock.patch('apps.web.tasks.create_evaluation_jobs') as evaluate_mock:
+            competition.check_future_phase_sumbmissions()
+        self.assertFalse(evaluate_mock.called)
+        self.assertFalse(PhaseMigration.objects.exists())
+        self.assertFalse(CompetitionPhase.objects.get(pk=self.phase_2.pk).is_migrated)
+        self.assertFalse(Competition.objects.get(pk=self.competition.pk).is_migrating_delayed)
+
     def test_phase_migrations_delayed_marks_competition(self):
         self.submission_1.status = CompetitionSubmissionStatus.objects.get_or_create(name="running", codename="running")[0]
         self.submission_1.save()
         self.assertFalse(self.competition.is_migrating_delayed)
 
-        with mock.patch('apps.web.tasks.evaluate_submission') as evaluate_mock:
+        with mock.patch('apps.web.tasks.create_evaluation_jobs') as evaluate_mock:
             self.competition.check_future_phase_sumbmissions()
         self.assertTrue(self.competition.is_migrating_delayed)
 
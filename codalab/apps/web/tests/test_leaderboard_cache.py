@@ -0,0 +1,230 @@
+import datetime
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+
+from apps.web.models import (Competition,
+                             CompetitionParticipant,
+                             CompetitionPhase,
+                             CompetitionSubmission,
+                             CompetitionSubmissionStatus,
+                             ParticipantStatus,
+                             PhaseLeaderBoard,
+                             PhaseLeaderBoardEntry,
+                             SubmissionComputedScore,
+                             SubmissionComputedScoreField,
+                             SubmissionResultGroup,
+                             SubmissionResultGroupPhase,
+                             SubmissionScore,
+                             SubmissionScoreDef,
+                             SubmissionScoreDefGroup,
+                             SubmissionScoreSet,
+                             add_submission_to_leaderboard,
+                             invalidate_leaderboard)
+
+User = get_user_model()
+
+
+class LeaderboardTestCase(TestCase):
+    """Sets up a phase with two finished submissions scored on a single column."""
+    def setUp(self):
+        self.organizer = User.objects.create_user(username="organizer", password="pass")
+        self.participant_user = User.objects.create_user(username="participant", password="pass")
+        self.competition = Competition.objects.create(creator=self.organizer, modified_by=self.organizer)
+        approved = ParticipantStatus.objects.get_or_create(name='approved', codename=ParticipantStatus.APPROVED)[0]
+        self.participant_1 = CompetitionParticipant.objects.create(
+            user=self.organizer,
+            competition=self.competition,
+            status=approved
+        )
+        self.participant_2 = CompetitionParticipant.objects.create(
+            user=self.participant_user,
+            competition=self.competition,
+            status=approved
+        )
+        self.phase_1 = CompetitionPhase.objects.create(
+            competition=self.competition,
+            phasenumber=1,
+            start_date=datetime.datetime.now() - datetime.timedelta(days=30),
+        )
+        submission_finished = CompetitionSubmissionStatus.objects.create(name="finished", codename="finished")
+        self.submission_1 = CompetitionSubmission.objects.create(
+            participant=self.participant_1,
+            phase=self.phase_1,
+            status=submission_finished,
+        )
+        self.submission_2 = CompetitionSubmission.objects.create(
+            participant=self.participant_2,
+            phase=self.phase_1,
+            status=submission_finished,
+        )
+        self.leader_board = PhaseLeaderBoard.objects.create(phase=self.phase_1)
+
+        result_group = SubmissionResultGroup.objects.create(
+            competition=self.competition,
+            key="Key",
+            label="Results",
+            ordering=1
+        )
+        SubmissionResultGroupPhase.objects.create(phase=self.phase_1, group=result_group)
+        self.score_def = SubmissionScoreDef.objects.create(
+            competition=self.competition,
+            key="Key",
+            label="Score",
+            sorting='desc',
+        )
+        SubmissionScoreDefGroup.objects.create(scoredef=self.score_def, group=result_group)
+        SubmissionScoreSet.objects.create(
+            competition=self.competition,
+            key="Key",
+            label="Score",
+            scoredef=self.score_def,
+        )
+        SubmissionScore.objects.create(result=self.submission_1, scoredef=self.score_def, value=0.5)
+        SubmissionScore.objects.create(result=self.submission_2, scoredef=self.score_def, value=0.9)
+
+
+class LeaderboardCacheTests(LeaderboardTestCase):
+    def _board_version(self):
+        return PhaseLeaderBoard.objects.get(pk=self.leader_board.pk).version
+
+    def test_scores_are_served_from_snapshot(self):
+        PhaseLeaderBoardEntry.objects.create(board=self.leader_board, result=self.submission_1)
+        self.phase_1.scores()
+
+        with self.assertNumQueries(1):
+            groups = self.phase_1.scores()
+        self.assertEqual(len(groups[0]['scores']), 1)
+
+    def test_adding_submission_to_leaderboard_invalidates_snapshot(self):
+        add_submission_to_leaderboard(self.submission_1)
+        self.assertEqual(len(self.phase_1.scores()[0]['scores']), 1)
+        version = self._board_version()
+
+        add_submission_to_leaderboard(self.submission_2)
+
+        self.assertNotEqual(version, self._board_version())
+        ranked = self.phase_1.scores()[0]['scores']
+        self.assertEqual([scores['id'] for rank, scores in ranked], [self.submission_2.pk, self.submission_1.pk])
+
+    def test_removing_submission_from_leaderboard_invalidates_snapshot(self):
+        add_submission_to_leaderboard(self.submission_1)
+        add_submission_to_leaderboard(self.submission_2)
+        self.assertEqual(len(self.phase_1.scores()[0]['scores']), 2)
+
+        PhaseLeaderBoardEntry.objects.get(result=self.submission_2).delete()
+
+        self.assertEqual(len(self.phase_1.scores()[0]['scores']), 1)
+
+    def test_editing_score_definition_invalidates_snapshot(self):
+        add_submission_to_leaderboard(self.submission_1)
+        add_submission_to_leaderboard(self.submission_2)
+        self.assertEqual(self.phase_1.scores()[0]['scores'][0][1]['id'], self.submission_2.pk)
+
+        self.score_def.sorting = 'asc'
+        self.score_def.save()
+
+        self.assertEqual(self.phase_1.scores()[0]['scores'][0][1]['id'], self.submission_1.pk)
+
+    def test_renaming_participant_invalidates_snapshot(self):
+        add_submission_to_leaderboard(self.submission_2)
+        self.assertEqual(self.phase_1.scores()[0]['scores'][0][1]['username'], "participant")
+        version = self._board_version()
+
+        self.participant_user.last_login = datetime.datetime.now()
+        self.participant_user.save()
+        self.assertEqual(version, self._board_version())
+
+        self.participant_user.username = "renamed"
+        self.participant_user.team_name = "Team"
+        self.participant_user.save()
+
+        scores = self.phase_1.scores()[0]['scores'][0][1]
+        self.assertEqual(("renamed", "Team"), (scores['username'], scores['team_name']))
+
+    def test_deleting_submission_invalidates_snapshot(self):
+        CompetitionSubmission.objects.filter(phase=self.phase_1).update(
+            status=CompetitionSubmissionStatus.objects.get(codename="finished"))
+        add_submission_to_leaderboard(self.submission_2)
+        self.assertEqual(2, len(self.phase_1.scores(include_scores_not_on_leaderboard=True)[0]['scores']))
+
+        # Not on the leaderboard, so only the snapshot of all the scores lists it
+        self.submission_1.delete()
+        self.assertEqual(1, len(self.phase_1.scores(include_scores_not_on_leaderboard=True)[0]['scores']))
+
+    def test_invalidate_leaderboard_changes_version(self):
+        version = self._board_version()
+        invalidate_leaderboard(self.phase_1)
+        self.assertNotEqual(version, self._board_version())
+
+
+class LeaderboardQueryCountTests(LeaderboardTestCase):
+    def setUp(self):
+        super(LeaderboardQueryCountTests, self).setUp()
+        self.second_def = SubmissionScoreDef.objects.create(
+            competition=self.competition,
+            key="Second",
+            label="Second",
+            sorting='asc',
+        )
+        SubmissionScoreDefGroup.objects.create(scoredef=self.second_def, group=SubmissionResultGroup.objects.get(key="Key"))
+        SubmissionScoreSet.objects.create(
+            competition=self.competition,
+            key="Second",
+            label="Second",
+            scoredef=self.second_def,
+        )
+        self.average_def = SubmissionScoreDef.objects.create(
+            competition=self.competition,
+            key="Average",
+            label="Average",
+            sorting='asc',
+            computed=True,
+        )
+        SubmissionScoreDefGroup.objects.create(scoredef=self.average_def, group=SubmissionResultGroup.objects.get(key="Key"))
+        SubmissionScoreSet.objects.create(
+            competition=self.competition,
+            key="Average",
+            label="Average",
+            scoredef=self.average_def,
+        )
+        computed = SubmissionComputedScore.objects.create(scoredef=self.average_def, operation='Avg')
+        SubmissionComputedScoreField.objects.create(computed=computed, scoredef=self.score_def)
+        SubmissionComputedScoreField.objects.create(computed=computed, scoredef=self.second_def)
+        self.status = CompetitionSubmissionStatus.objects.get(codename="finished")
+        self.participant_count = 0
+
+    def _add_submissions(self, count):
+        approved = ParticipantStatus.objects.get(codename=ParticipantStatus.APPROVED)
+        for i in range(count):
+            self.participant_count += 1
+            user = User.objects.create_user(username="user%d" % self.participant_count, password="pass")
+            participant = CompetitionParticipant.objects.create(user=user, competition=self.competition, status=approved)
+            submission = CompetitionSubmission.objects.create(participant=participant, phase=self.phase_1, status=self.status)
+            # New submissions are saved as submitting
+            CompetitionSubmission.objects.filter(pk=submission.pk).update(status=self.status)
+            SubmissionScore.objects.create(result=submission, scoredef=self.score_def, value=i)
+            SubmissionScore.objects.create(result=submission, scoredef=self.second_def, value=count - i)
+            PhaseLeaderBoardEntry.objects.create(board=self.leader_board, result=submission)
+
+    def _assert_scores_queries(self, num, include_scores_not_on_leaderboard=False):
+        cache.clear()
+        with self.assertNumQueries(num):
+            groups = self.phase_1.scores(include_scores_not_on_leaderboard=include_scores_not_on_leaderboard)
+        return groups
+
+    def test_number_of_queries_does_not_depend_on_leaderboard_size(self):
+        self._add_submissions(2)
+        self._assert_scores_queries(7)
+        self._add_submissions(20)
+        groups = self._assert_scores_queries(7)
+        self.assertEqual(22, len(groups[0]['scores']))
+        self.assertEqual(3, len(groups[0]['scores'][0][1]['values']))
+
+    def test_number_of_queries_including_scores_not_on_leaderboard(self):
+        self._add_submissions(2)
+        self._assert_scores_queries(7, include_scores_not_on_leaderboard=True)
+        self._add_submissions(20)
+        groups = self._assert_scores_queries(7, include_scores_not_on_leaderboard=True)
+        self.assertEqual(22, len(groups[0]['scores']))
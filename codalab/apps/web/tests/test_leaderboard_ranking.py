@@ -0,0 +1,123 @@
+import random
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from apps.web.leaderboard import LeaderboardRanking, ScoreIndex, rank_values
+from apps.web.models import (PhaseLeaderBoard,
+                             PhaseLeaderBoardEntry,
+                             add_submission_to_leaderboard,
+                             get_leaderboard_ranking,
+                             leaderboard_ranking_cache_key,
+                             remove_submission_from_leaderboard)
+from apps.web.tests.test_leaderboard_cache import LeaderboardTestCase
+
+
+class ScoreIndexTests(TestCase):
+    def _assert_matches_rank_values(self, index, values, sort_ascending, eps=1.0e-12):
+        expected = rank_values(range(60), values, sort_ascending=sort_ascending, eps=eps)
+        self.assertEqual(expected, dict((i, index.rank(i)) for i in range(60)))
+
+    def test_ranks_match_rank_values(self):
+        rand = random.Random(0)
+        values = dict((i, rand.choice([0.1, 0.2, 0.25, 0.5, 0.9])) for i in range(50))
+        for sort_ascending in (True, False):
+            index = ScoreIndex(sort_ascending)
+            for submission_id, value in values.iteritems():
+                index.add(submission_id, value)
+            self._assert_matches_rank_values(index, values, sort_ascending)
+
+    def test_values_spaced_closer_than_eps_match_rank_values(self):
+        rand = random.Random(3)
+        for sort_ascending in (True, False):
+            index = ScoreIndex(sort_ascending, eps=0.1)
+            values = {}
+            for _ in range(400):
+                submission_id = rand.randint(0, 49)
+                if submission_id in values and rand.random() < 0.4:
+                    index.remove(submission_id)
+                    del values[submission_id]
+                else:
+                    values[submission_id] = rand.randint(0, 40) * 0.03
+                    index.add(submission_id, values[submission_id])
+                self._assert_matches_rank_values(index, values, sort_ascending, eps=0.1)
+
+    def test_remove_keeps_ranks_dense(self):
+        index = ScoreIndex(sort_ascending=False)
+        index.add(1, 0.9)
+        index.add(2, 0.5)
+        index.add(3, 0.1)
+        index.remove(2)
+        self.assertEqual(1, index.rank(1))
+        self.assertEqual(2, index.rank(3))
+        self.assertEqual(3, index.rank(2))
+
+
+class LeaderboardRankingTests(TestCase):
+    def test_incremental_updates_match_rebuild(self):
+        rand = random.Random(1)
+        sort_orders = {1: True, 2: False}
+        values = {1: {}, 2: {}}
+        ranking = LeaderboardRanking(sort_orders)
+        for submission_id in range(100):
+            submission_values = {1: rand.randint(0, 20)}
+            if submission_id % 5:
+                submission_values[2] = rand.randint(0, 20)
+            ranking.add(submission_id, submission_values)
+            for sdef_id, value in submission_values.iteritems():
+                values[sdef_id][submission_id] = value
+        for submission_id in range(0, 100, 3):
+            ranking.remove(submission_id)
+            for sdef_values in values.itervalues():
+                sdef_values.pop(submission_id, None)
+
+        submission_ids = values[1].keys()
+        rebuilt = LeaderboardRanking.build(sort_orders, submission_ids, values)
+        self.assertEqual(set(submission_ids), ranking.submission_ids)
+        for sdef_id in sort_orders:
+            self.assertEqual(rebuilt.ranks(sdef_id, submission_ids), ranking.ranks(sdef_id, submission_ids))
+
+
+class LeaderboardRankingCacheTests(LeaderboardTestCase):
+    def _ranking(self):
+        return get_leaderboard_ranking(PhaseLeaderBoard.objects.get(phase=self.phase_1))
+
+    def test_ranking_is_updated_under_the_leaderboard_lock(self):
+        add_submission_to_leaderboard(self.submission_1)
+        self.assertIsNone(self._ranking())
+        self.phase_1.scores()
+        self.assertEqual(set([self.submission_1.pk]), self._ranking().submission_ids)
+
+        add_submission_to_leaderboard(self.submission_2)
+        ranking = self._ranking()
+        self.assertEqual(set([self.submission_1.pk, self.submission_2.pk]), ranking.submission_ids)
+        self.assertEqual({self.submission_1.pk: 2, self.submission_2.pk: 1},
+                         ranking.ranks(self.score_def.pk, [self.submission_1.pk, self.submission_2.pk]))
+
+        remove_submission_from_leaderboard(self.submission_2)
+        self.assertEqual(set([self.submission_1.pk]), self._ranking().submission_ids)
+        self.assertFalse(PhaseLeaderBoardEntry.objects.filter(result=self.submission_2).exists())
+        self.assertEqual(1, len(self.phase_1.scores()[0]['scores']))
+
+    def test_ranking_of_another_version_is_not_used(self):
+        add_submission_to_leaderboard(self.submission_1)
+        self.phase_1.scores()
+        # A change made without updating the ranking, e.g. a score definition edited
+        PhaseLeaderBoard.objects.filter(phase=self.phase_1).update(version='other')
+        self.assertIsNone(self._ranking())
+
+        add_submission_to_leaderboard(self.submission_2)
+        self.assertIsNone(self._ranking())
+        self.assertEqual(2, len(self.phase_1.scores()[0]['scores']))
+        self.assertEqual(set([self.submission_1.pk, self.submission_2.pk]),
+                         cache.get(leaderboard_ranking_cache_key(self.phase_1.pk))[1].submission_ids)
+
+    def test_scores_from_the_updated_ranking_match_a_rebuild(self):
+        add_submission_to_leaderboard(self.submission_1)
+        self.phase_1.scores()
+        add_submission_to_leaderboard(self.submission_2)
+        self.assertIsNotNone(self._ranking())
+        scores = self.phase_1.scores()
+
+        cache.clear()
+        self.assertEqual(scores, self.phase_1.scores())
@@ -0,0 +1,113 @@
+import datetime
+import mock
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+
+from apps.jobs.models import Job
+
+from apps.web.models import (Competition,
+                             CompetitionParticipant,
+                             CompetitionPhase,
+                             CompetitionSubmission,
+                             CompetitionSubmissionStatus,
+                             ParticipantStatus,
+                             PhaseLeaderBoard,
+                             PhaseLeaderBoardEntry,
+                             PhaseMigration)
+
+User = get_user_model()
+
+
+class PhaseMigrationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='test@user.com', username='testuser')
+        self.competition = Competition.objects.create(creator=self.user, modified_by=self.user)
+        approved = ParticipantStatus.objects.get_or_create(name='approved', codename=ParticipantStatus.APPROVED)[0]
+        self.phase_1 = CompetitionPhase.objects.create(
+            competition=self.competition,
+            phasenumber=1,
+            start_date=datetime.datetime.now() - datetime.timedelta(days=30),
+        )
+        self.phase_2 = CompetitionPhase.objects.create(
+            competition=self.competition,
+            phasenumber=2,
+            start_date=datetime.datetime.now() - datetime.timedelta(days=15),
+            auto_migration=True
+        )
+        finished = CompetitionSubmissionStatus.objects.create(name="finished", codename="finished")
+        leader_board = PhaseLeaderBoard.objects.create(phase=self.phase_1)
+        self.participants = []
+        for i in range(3):
+            user = User.objects.create(email='user%s@user.com' % i, username='user%s' % i)
+            participant = CompetitionParticipant.objects.create(user=user, competition=self.competition, status=approved)
+            submission = CompetitionSubmission(participant=participant, phase=self.phase_1, status=finished)
+            submission.file.name = 'submission_%s.zip' % i
+            submission.save()
+            PhaseLeaderBoardEntry.objects.create(board=leader_board, result=submission)
+            self.participants.append(participant)
+        # The first participant already made a submission to the second phase
+        CompetitionSubmission.objects.create(participant=self.participants[0], phase=self.phase_2)
+
+    def _migrated(self):
+        return CompetitionSubmission.objects.filter(phase=self.phase_2, phase_migration__isnull=False).order_by('pk')
+
+    def test_submissions_are_created_and_dispatched_in_batches(self):
+        with mock.patch.object(PhaseMigration, 'batch_size', 2):
+            with mock.patch('apps.web.tasks.create_evaluation_jobs') as evaluate_mock:
+                self.competition.do_phase_migration(self.phase_2, self.phase_1)
+
+        submissions = list(self._migrated())
+        self.assertEqual([p.pk for p in self.participants], [s.participant_id for s in submissions])
+        self.assertEqual([2, 1, 1], [s.submission_number for s in submissions])
+        self.assertEqual(['submission_0.zip', 'submission_1.zip', 'submission_2.zip'],
+                         [s.readable_filename for s in submissions])
+        self.assertTrue(all(s.status.codename == CompetitionSubmissionStatus.SUBMITTING for s in submissions))
+        self.assertEqual([mock.call([submissions[0].pk, submissions[1].pk], True), mock.call([submissions[2].pk], True)],
+                         evaluate_mock.call_args_list)
+        self.assertIsNotNone(PhaseMigration.objects.get(competition=self.competition).completed_at)
+        self.assertFalse(Competition.objects.get(pk=self.competition.pk).is_migrating)
+
+    def test_stopped_migration_is_resumed_where_it_stopped(self):
+        with mock.patch.object(PhaseMigration, 'batch_size', 1):
+            with mock.patch('apps.web.tasks.create_evaluation_jobs', side_effect=[[], Exception("Lost")]):
+                self.assertRaises(Exception, self.competition.do_phase_migration, self.phase_2, self.phase_1)
+            self.assertTrue(Competition.objects.get(pk=self.competition.pk).is_migrating)
+
+            # Not resumed while it may still be running
+            with mock.patch('apps.web.tasks.create_evaluation_jobs') as evaluate_mock:
+                PhaseMigration.resume_stalled()
+            self.assertFalse(evaluate_mock.called)
+
+            PhaseMigration.objects.update(updated_at=datetime.datetime.now() - datetime.timedelta(hours=1))
+            with mock.patch('apps.web.tasks.create_evaluation_jobs') as evaluate_mock:
+                PhaseMigration.resume_stalled()
+
+        submissions = list(self._migrated())
+        self.assertEqual(3, len(submissions))
+        self.assertEqual([mock.call([submissions[1].pk], True), mock.call([submissions[2].pk], True)],
+                         evaluate_mock.call_args_list)
+        competition = Competition.objects.get(pk=self.competition.pk)
+        self.assertFalse(competition.is_migrating)
+        self.assertEqual(2, competition.last_phase_migration)
+        self.assertTrue(CompetitionPhase.objects.get(pk=self.phase_2.pk).is_migrated)
+
+    def test_jobs_of_an_unsent_batch_are_sent_once_on_resume(self):
+        with mock.patch.object(PhaseMigration, 'batch_size', 2):
+            with mock.patch.object(Job.objects, 'dispatch_jobs', side_effect=Exception("Lost")):
+                self.assertRaises(Exception, self.competition.do_phase_migration, self.phase_2, self.phase_1)
+            jobs = list(Job.objects.order_by('pk'))
+            self.assertEqual(2, len(jobs))
+            # The first job was started from a message which was sent after all
+            Job.objects.filter(pk=jobs[0].pk).update(status=Job.RUNNING)
+
+            PhaseMigration.objects.update(updated_at=datetime.datetime.now() - datetime.timedelta(hours=1))
+            with mock.patch.object(Job.objects, 'dispatch_jobs') as dispatch_mock:
+                PhaseMigration.resume_stalled()
+
+        submissions = list(self._migrated())
+        self.assertEqual([[jobs[1].pk], [Job.objects.order_by('pk')[2].pk]],
+                         [[job.pk for job in call[0][0]] for call in dispatch_mock.call_args_list])
+        self.assertEqual([{'submission_id': submission.pk, 'predict': False} for submission in submissions],
+                         [job.get_task_args() for job in Job.objects.order_by('pk')])
+        self.assertEqual('', PhaseMigration.objects.get(competition=self.competition).pending_job_ids)
@@ -0,0 +1,129 @@
+import datetime
+import mock
+
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.utils.timezone import now
+
+from apps.jobs.models import Job
+from apps.web.models import (Competition,
+                             CompetitionParticipant,
+                             CompetitionPhase,
+                             CompetitionSubmission,
+                             ParticipantStatus,
+                             PhaseLeaderBoard,
+                             PhaseLeaderBoardEntry,
+                             PhaseMigration)
+from apps.web.phase_schedule import PhaseMigrationSchedule
+from apps.web.tasks import check_phase_migrations_task
+
+User = get_user_model()
+
+
+class PhaseMigrationScheduleTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='test@user.com', username='testuser')
+        self.now = now()
+        # Its second phase, starting in an hour, migrates automatically
+        self.competition = self._create_competition([True], datetime.timedelta(hours=1))
+        self.submission = self._add_leaderboard_entry(self.competition.phases.get(phasenumber=1))
+        # No phase migrates automatically
+        self.manual_competition = self._create_competition([False], datetime.timedelta(minutes=30))
+        # Its second phase was migrated already
+        self.migrated_competition = self._create_competition([True], datetime.timedelta(minutes=20))
+        self.migrated_competition.last_phase_migration = 2
+        self.migrated_competition.save()
+
+    def _create_competition(self, auto_migrations, next_phase_start):
+        competition = Competition.objects.create(creator=self.user, modified_by=self.user)
+        CompetitionPhase.objects.create(competition=competition, phasenumber=1,
+                                        start_date=self.now - datetime.timedelta(days=10))
+        for index, auto_migration in enumerate(auto_migrations):
+            CompetitionPhase.objects.create(competition=competition, phasenumber=index + 2,
+                                            start_date=self.now + next_phase_start * (index + 1),
+                                            auto_migration=auto_migration)
+        return competition
+
+    def _add_leaderboard_entry(self, phase):
+        participant = CompetitionParticipant.objects.get_or_create(
+            user=self.user,
+            competition=phase.competition,
+            defaults={'status': ParticipantStatus.objects.get_or_create(name='approved',
+                                                                        codename=ParticipantStatus.APPROVED)[0]}
+        )[0]
+        submission = CompetitionSubmission.objects.create(participant=participant, phase=phase)
+        PhaseLeaderBoardEntry.objects.create(board=PhaseLeaderBoard.objects.get_or_create(phase=phase)[0],
+                                             result=submission)
+        return submission
+
+    def test_competitions_are_due_when_a_phase_starts(self):
+        schedule = PhaseMigrationSchedule(refresh_interval=3600, retry_interval=3600)
+
+        # The first call catches up with the competitions having a pending migration
+        self.assertEqual(({self.competition.pk}, False), schedule.get_due(self.now))
+        self.assertEqual((set(), False), schedule.get_due(self.now + datetime.timedelta(minutes=10)))
+        self.assertEqual(50 * 60, schedule.get_delay(self.now + datetime.timedelta(minutes=10)))
+
+        self.assertEqual(({self.competition.pk}, False), schedule.get_due(self.now + datetime.timedelta(hours=1)))
+        self.assertEqual((set(), False), schedule.get_due(self.now + datetime.timedelta(minutes=61)))
+
+    def test_phases_added_later_are_scheduled_on_refresh(self):
+        schedule = PhaseMigrationSchedule(refresh_interval=60, retry_interval=3600)
+        schedule.get_due(self.now)
+        CompetitionPhase.objects.create(competition=self.competition, phasenumber=3,
+                                        start_date=self.now + datetime.timedelta(minutes=2), auto_migration=True)
+
+        self.assertEqual(60, schedule.get_delay(self.now))
+        self.assertEqual((set(), False), schedule.get_due(self.now + datetime.timedelta(minutes=1)))
+        self.assertEqual(({self.competition.pk}, False), schedule.get_due(self.now + datetime.timedelta(minutes=2)))
+
+    def test_delayed_and_stalled_migrations_are_retried(self):
+        schedule = PhaseMigrationSchedule(refresh_interval=3600, retry_interval=60)
+        schedule.get_due(self.now)
+        Competition.objects.filter(pk=self.manual_competition.pk).update(is_migrating_delayed=True)
+        migration = PhaseMigration.objects.create(competition=self.competition,
+                                                  source_phase=self.competition.phases.all()[0],
+                                                  target_phase=self.competition.phases.all()[1])
+        PhaseMigration.objects.filter(pk=migration.pk).update(updated_at=self.now - datetime.timedelta(hours=1))
+
+        self.assertEqual((set(), False), schedule.get_due(self.now + datetime.timedelta(seconds=30)))
+        # The first competition is still waiting for its migration too
+        self.assertEqual(({self.competition.pk, self.manual_competition.pk}, True),
+                         schedule.get_due(self.now + datetime.timedelta(minutes=1)))
+
+    def test_migrated_competitions_are_due_again_for_new_submissions_only(self):
+        schedule = PhaseMigrationSchedule(refresh_interval=3600, retry_interval=60)
+        self.assertEqual(({self.competition.pk}, False), schedule.get_due(self.now))
+        CompetitionSubmission.objects.filter(pk=self.submission.pk).update(is_migrated=True)
+
+        self.assertEqual((set(), False), schedule.get_due(self.now + datetime.timedelta(minutes=1)))
+        self.assertEqual((set(), False), schedule.get_due(self.now + datetime.timedelta(minutes=2)))
+
+        self._add_leaderboard_entry(self.competition.phases.get(phasenumber=1))
+        self.assertEqual(({self.competition.pk}, False), schedule.get_due(self.now + datetime.timedelta(minutes=3)))
+
+    def test_phase_moved_into_the_past_is_due_on_retry(self):
+        schedule = PhaseMigrationSchedule(refresh_interval=3600, retry_interval=60)
+        schedule.get_due(self.now)
+        phase = self.manual_competition.phases.get(phasenumber=2)
+        phase.start_date = self.now - datetime.timedelta(days=1)
+        phase.save()
+        CompetitionPhase.objects.create(competition=self.manual_competition, phasenumber=3,
+                                        start_date=self.now + datetime.timedelta(days=1), auto_migration=True)
+        self._add_leaderboard_entry(phase)
+
+        # No boundary is crossed, the next retry finds the new active phase
+        self.assertEqual((set(), False), schedule.get_due(self.now + datetime.timedelta(seconds=30)))
+        self.assertEqual(({self.competition.pk, self.manual_competition.pk}, False),
+                         schedule.get_due(self.now + datetime.timedelta(minutes=1)))
+
+    def test_task_checks_the_given_competitions(self):
+        job = Job.objects.create(task_type='check_phase_migrations')
+        with mock.patch.object(Competition, 'check_future_phase_sumbmissions', autospec=True) as check_mock:
+            with mock.patch.object(PhaseMigration, 'resume_stalled') as resume_mock:
+                check_phase_migrations_task(job.pk, {'competition_ids': [self.competition.pk],
+                                                     'resume_stalled': True})
+
+        self.assertEqual([self.competition.pk], [call[0][0].pk for call in check_mock.call_args_list])
+        self.assertTrue(resume_mock.called)
+        self.assertEqual(Job.FINISHED, Job.objects.get(pk=job.pk).status)
@@ -0,0 +1,55 @@
+import mock
+
+from django.db import IntegrityError
+
+from apps.web.models import (CompetitionSubmission,
+                             SubmissionScore,
+                             SubmissionScoreDef,
+                             get_scoredefs_by_key)
+from apps.web.tasks import ingest_scores
+from apps.web.tests.test_leaderboard_cache import LeaderboardTestCase
+
+
+class ScoreIngestionTests(LeaderboardTestCase):
+    def setUp(self):
+        super(ScoreIngestionTests, self).setUp()
+        self.submission_3 = CompetitionSubmission.objects.create(
+            participant=self.participant_1,
+            phase=self.phase_1,
+            status=self.submission_1.status,
+        )
+        self.other_def = SubmissionScoreDef.objects.create(
+            competition=self.competition,
+            key="Other",
+            label="Other",
+        )
+
+    def test_scores_are_inserted_in_one_query(self):
+        get_scoredefs_by_key(self.competition)
+        submission = CompetitionSubmission.objects.get(pk=self.submission_3.pk)
+
+        with mock.patch('apps.web.tasks.logger') as logger_mock:
+            # The phase, the delete of earlier scores and the insert
+            with self.assertNumQueries(3):
+                ingest_scores(submission, "Key: 0.25\nOther:3\nMissing: 1\nGone: 2\n")
+
+        scores = dict(SubmissionScore.objects.filter(result=self.submission_3).values_list('scoredef__key', 'value'))
+        self.assertEqual({"Key": 0.25, "Other": 3}, scores)
+        self.assertEqual(1, logger_mock.warning.call_count)
+        self.assertEqual("Missing, Gone", logger_mock.warning.call_args[0][1])
+
+    def test_scores_of_an_earlier_attempt_are_replaced(self):
+        ingest_scores(self.submission_3, "Key: 1\nOther: 2\n")
+        ingest_scores(self.submission_3, "Key: 0.5\n")
+        scores = dict(SubmissionScore.objects.filter(result=self.submission_3).values_list('scoredef__key', 'value'))
+        self.assertEqual({"Key": 0.5}, scores)
+
+    def test_computed_scores_cannot_be_assigned(self):
+        SubmissionScoreDef.objects.create(competition=self.competition, key="Avg", label="Avg", computed=True)
+        with self.assertRaises(IntegrityError):
+            ingest_scores(self.submission_3, "Avg: 1")
+
+    def test_scoredef_lookup_is_refreshed_when_definitions_change(self):
+        self.assertNotIn("New", get_scoredefs_by_key(self.competition))
+        new_def = SubmissionScoreDef.objects.create(competition=self.competition, key="New", label="New")
+        self.assertEqual((new_def.pk, False), get_scoredefs_by_key(self.competition)["New"])
@@ -0,0 +1,90 @@
+import datetime
+import mock
+import zipfile
+
+from django.core.cache import cache
+
+from apps.coopetitions.models import DownloadRecord, Like
+from apps.web.models import (BundleStorage,
+                             ScoringArtifact,
+                             add_submission_to_leaderboard,
+                             invalidate_leaderboard,
+                             remove_submission_from_leaderboard)
+from apps.web.tasks import get_coopetition_artifact, get_scores_artifact, precompute_scoring_artifacts
+from apps.web.tests.test_leaderboard_cache import LeaderboardTestCase
+
+
+class ScoringArtifactTests(LeaderboardTestCase):
+    def test_scores_artifact_is_reused_until_leaderboard_changes(self):
+        add_submission_to_leaderboard(self.submission_1)
+        artifact = get_scores_artifact(self.phase_1)
+        self.assertEqual(artifact.pk, get_scores_artifact(self.phase_1).pk)
+
+        add_submission_to_leaderboard(self.submission_2)
+        updated = get_scores_artifact(self.phase_1)
+        self.assertNotEqual(artifact.pk, updated.pk)
+        self.assertNotEqual(artifact.content_hash, updated.content_hash)
+        self.assertIn(str(self.submission_2.pk), updated.file.read())
+
+    def test_identical_content_shares_blob(self):
+        artifact = get_scores_artifact(self.phase_1)
+        invalidate_leaderboard(self.phase_1)
+        rebuilt = get_scores_artifact(self.phase_1)
+        self.assertNotEqual(artifact.version, rebuilt.version)
+        self.assertEqual(artifact.file.name, rebuilt.file.name)
+
+    def test_coopetition_artifact_tracks_downloads(self):
+        artifact = get_coopetition_artifact(self.competition)
+        self.assertEqual(artifact.pk, get_coopetition_artifact(self.competition).pk)
+        self.assertEqual(ScoringArtifact.COOPETITION, artifact.kind)
+        names = zipfile.ZipFile(artifact.file).namelist()
+        self.assertIn('coopetition_downloads.txt', names)
+        self.assertNotIn('current_user.txt', names)
+
+        DownloadRecord.objects.create(submission=self.submission_1, user=self.participant_user)
+        self.assertNotEqual(artifact.pk, get_coopetition_artifact(self.competition).pk)
+
+    def test_coopetition_artifact_tracks_moved_likes(self):
+        like = Like.objects.create(submission=self.submission_1, user=self.participant_user)
+        artifact = get_coopetition_artifact(self.competition)
+
+        like.submission = self.submission_2
+        like.save()
+        self.assertNotEqual(artifact.pk, get_coopetition_artifact(self.competition).pk)
+
+    def test_superseded_artifacts_are_deleted(self):
+        def age_artifacts():
+            ScoringArtifact.objects.update(created_at=datetime.datetime.now() - datetime.timedelta(hours=1))
+
+        add_submission_to_leaderboard(self.submission_1)
+        scored_with = get_scores_artifact(self.phase_1)
+        self.submission_2.scores_file.name = scored_with.file.name
+        self.submission_2.save()
+        age_artifacts()
+
+        add_submission_to_leaderboard(self.submission_2)
+        unreferenced = get_scores_artifact(self.phase_1)
+        self.assertFalse(ScoringArtifact.objects.filter(pk=scored_with.pk).exists())
+        # The submission keeps the file it was scored with
+        self.assertTrue(BundleStorage.exists(scored_with.file.name))
+
+        age_artifacts()
+        remove_submission_from_leaderboard(self.submission_2)
+        latest = get_scores_artifact(self.phase_1)
+
+        self.assertEqual([latest.pk], list(ScoringArtifact.objects.values_list('pk', flat=True)))
+        self.assertFalse(BundleStorage.exists(unreferenced.file.name))
+        self.assertTrue(BundleStorage.exists(latest.file.name))
+
+    def test_coopetition_version_is_bumped_by_likes_and_downloads(self):
+        like = Like.objects.create(submission=self.submission_1, user=self.participant_user)
+        DownloadRecord.objects.create(submission=self.submission_1, user=self.participant_user)
+        like.delete()
+        self.assertEqual(3, type(self.competition).objects.get(pk=self.competition.pk).coopetition_version)
+
+    def test_precompute_jobs_are_started_once_per_competition(self):
+        cache.clear()
+        with mock.patch('apps.web.tasks.Job.objects.create_and_dispatch_job') as dispatch_mock:
+            precompute_scoring_artifacts(self.competition)
+            precompute_scoring_artifacts(self.competition)
+        dispatch_mock.assert_called_once_with('precompute_scoring_artifacts', {'competition_id': self.competition.pk})
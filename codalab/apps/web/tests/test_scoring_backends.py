@@ -0,0 +1,63 @@
+import random
+import unittest
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from apps.web import leaderboard
+from apps.web.models import add_submission_to_leaderboard
+from apps.web.tests.test_leaderboard_cache import LeaderboardTestCase
+
+
+class ScoringBackendTests(TestCase):
+    def _rank(self, backend):
+        rand = random.Random(2)
+        submission_ids = range(1, 301)
+        sort_orders = {1: True, 2: False, 3: True}
+        values = {
+            1: dict((id, rand.choice([0.1, 0.2, 0.25])) for id in submission_ids),
+            2: dict((id, rand.randint(0, 50)) for id in submission_ids if id % 7),
+            3: {},
+        }
+        computed_columns = [(4, True, [1, 2]), (5, False, [1, 4])]
+        ranks = backend.rank(submission_ids, sort_orders, computed_columns, values)
+        return ranks, values, backend.order(submission_ids, ranks[4])
+
+    @unittest.skipIf(leaderboard.numpy is None, "numpy is not installed")
+    def test_numpy_backend_matches_python_backend(self):
+        expected = self._rank(leaderboard.PythonScoringBackend())
+        self.assertEqual(expected, self._rank(leaderboard.NumpyScoringBackend()))
+
+    @unittest.skipIf(leaderboard.numpy is None, "numpy is not installed")
+    def test_values_spaced_closer_than_eps_tie_as_in_python_backend(self):
+        submission_ids = range(1, 41)
+        values = {1: dict((id, (id % 20) * 0.03) for id in submission_ids if id % 9)}
+        for sort_ascending in (True, False):
+            ranks = [backend.rank(submission_ids, {1: sort_ascending}, [], dict(values))
+                     for backend in (leaderboard.PythonScoringBackend(eps=0.1), leaderboard.NumpyScoringBackend(eps=0.1))]
+            self.assertEqual(ranks[0], ranks[1])
+            # Consecutive values are 0.03 apart, yet only those within 0.1 of the first of their
+            # group tie: five groups, then the submissions without a value
+            self.assertEqual(6, max(ranks[0][1].values()))
+
+    def test_numpy_backend_falls_back_without_numpy(self):
+        numpy = leaderboard.numpy
+        leaderboard.numpy = None
+        try:
+            backend = leaderboard.get_scoring_backend('numpy')
+        finally:
+            leaderboard.numpy = numpy
+        self.assertEqual('python', backend.name)
+
+
+class ScoringBackendScoresTests(LeaderboardTestCase):
+    @unittest.skipIf(leaderboard.numpy is None, "numpy is not installed")
+    def test_scores_are_identical_with_numpy_backend(self):
+        add_submission_to_leaderboard(self.submission_1)
+        phase_scores = []
+        for name in ('python', 'numpy'):
+            with override_settings(LEADERBOARD_SCORING_BACKEND=name):
+                cache.clear()
+                phase_scores.append((self.phase_1.scores(), self.phase_1.scores(include_scores_not_on_leaderboard=True)))
+        self.assertEqual(phase_scores[0], phase_scores[1])
@@ -0,0 +1,106 @@
+import datetime
+import json
+
+from django.core.files.base import ContentFile
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.client import Client
+from django.contrib.auth import get_user_model
+
+from apps.web.models import (BundleStorage,
+                             Competition,
+                             CompetitionParticipant,
+                             CompetitionPhase,
+                             CompetitionSubmission,
+                             CompetitionSubmissionStatus,
+                             ParticipantStatus,
+                             submission_stdout_filename)
+
+User = get_user_model()
+
+
+class CompetitionSubmissionLogTailTests(TestCase):
+    def setUp(self):
+        self.organizer = User.objects.create_user(username="organizer", password="pass")
+        self.participant_user = User.objects.create_user(username="participant", password="pass")
+        self.other_user = User.objects.create_user(username="other", password="pass")
+        self.competition = Competition.objects.create(creator=self.organizer, modified_by=self.organizer, published=True)
+        self.participant_1 = CompetitionParticipant.objects.create(
+            user=self.participant_user,
+            competition=self.competition,
+            status=ParticipantStatus.objects.get_or_create(name='approved', codename=ParticipantStatus.APPROVED)[0]
+        )
+        self.phase_1 = CompetitionPhase.objects.create(
+            competition=self.competition,
+            phasenumber=1,
+            start_date=datetime.datetime.now() - datetime.timedelta(days=30),
+        )
+        self.running_status = CompetitionSubmissionStatus.objects.create(name="running", codename="running")
+        self.submission_1 = CompetitionSubmission.objects.create(
+            participant=self.participant_1,
+            phase=self.phase_1,
+            is_public=False,
+            submitted_at=datetime.datetime.now() - datetime.timedelta(days=1),
+        )
+        CompetitionSubmission.objects.filter(pk=self.submission_1.pk).update(status=self.running_status)
+
+        # Output written so far by the compute worker
+        self.log_name = BundleStorage.save(submission_stdout_filename(self.submission_1), ContentFile("line 1\nline 2\n"))
+
+        self.url = reverse("my_competition_log_tail", kwargs={"submission_id": self.submission_1.pk,
+                                                              "filetype": "stdout.txt"})
+        self.client = Client()
+
+    def tearDown(self):
+        BundleStorage.delete(self.log_name)
+
+    def test_log_is_read_from_the_offset(self):
+        self.client.login(username="participant", password="pass")
+        resp = self.client.get(self.url, {'offset': 7})
+        self.assertEquals(resp.status_code, 200)
+        content = json.loads(resp.content)
+        self.assertEquals("line 2\n", content['data'])
+        self.assertEquals(14, content['offset'])
+        self.assertEquals("running", content['status'])
+
+    def test_nothing_is_returned_past_the_end_of_the_log(self):
+        self.client.login(username="participant", password="pass")
+        content = json.loads(self.client.get(self.url, {'offset': 14}).content)
+        self.assertEquals("", content['data'])
+        self.assertEquals(14, content['offset'])
+
+    def test_characters_split_by_the_read_are_returned_whole(self):
+        BundleStorage.delete(self.log_name)
+        # The last character was only partly uploaded
+        log = u"\u00e9t\u00e9 \u20ac\U0001f600".encode('utf-8')
+        self.log_name = BundleStorage.save(submission_stdout_filename(self.submission_1), ContentFile(log[:-2]))
+        self.client.login(username="participant", password="pass")
+
+        content = json.loads(self.client.get(self.url, {'offset': 0}).content)
+        self.assertEquals(u"\u00e9t\u00e9 \u20ac", content['data'])
+        self.assertEquals(len(log) - 4, content['offset'])
+
+        BundleStorage.delete(self.log_name)
+        self.log_name = BundleStorage.save(submission_stdout_filename(self.submission_1), ContentFile(log))
+        content = json.loads(self.client.get(self.url, {'offset': content['offset']}).content)
+        self.assertEquals(u"\U0001f600", content['data'])
+        self.assertEquals(len(log), content['offset'])
+
+    def test_log_of_other_participant_returns_404(self):
+        self.client.login(username="other", password="pass")
+        resp = self.client.get(self.url)
+        self.assertEquals(resp.status_code, 404)
+
+    def test_unknown_submission_returns_404(self):
+        self.client.login(username="participant", password="pass")
+        url = reverse("my_competition_log_tail", kwargs={"submission_id": self.submission_1.pk + 100,
+                                                         "filetype": "stdout.txt"})
+        self.assertEquals(self.client.get(url).status_code, 404)
+
+    def test_public_log_needs_registration(self):
+        CompetitionSubmission.objects.filter(pk=self.submission_1.pk).update(is_public=True)
+        Competition.objects.filter(pk=self.competition.pk).update(has_registration=True)
+        self.client.login(username="other", password="pass")
+        self.assertEquals(self.client.get(self.url).status_code, 404)
+        self.client.login(username="participant", password="pass")
+        self.assertEquals(self.client.get(self.url).status_code, 200)
@@ -0,0 +1,135 @@
+import json
+import mock
+
+from django.core.files.base import ContentFile
+
+from apps.jobs.models import Job
+from apps.web.models import (BundleStorage,
+                             CompetitionSubmission,
+                             CompetitionSubmissionStatus,
+                             FileContentHash,
+                             SubmissionScore,
+                             phase_reference_data_file,
+                             phase_scoring_program_file,
+                             submission_file_name,
+                             submission_output_filename)
+from apps.web.tasks import _get_evaluation_key, evaluate_submission_task
+from apps.web.tests.test_leaderboard_cache import LeaderboardTestCase
+
+
+class SubmissionReuseTests(LeaderboardTestCase):
+    """Identical submissions reuse the result of an earlier evaluation instead of running again."""
+    def setUp(self):
+        super(SubmissionReuseTests, self).setUp()
+        self.names = []
+        self.phase_1.scoring_program.name = self._store(phase_scoring_program_file(self.phase_1), 'program')
+        self.phase_1.reference_data.name = self._store(phase_reference_data_file(self.phase_1), 'reference')
+        self.phase_1.save()
+
+        # submission_1 was evaluated and scored 0.5
+        self.submission_1.file.name = self._store(submission_file_name(self.submission_1), 'predictions')
+        self.submission_1.output_file.name = submission_output_filename(self.submission_1)
+        self.submission_1.save()
+        CompetitionSubmission.objects.filter(pk=self.submission_1.pk).update(
+            evaluation_key=_get_evaluation_key(self.submission_1, False),
+            status=CompetitionSubmissionStatus.objects.get(codename="finished"))
+
+        self.submission_3 = CompetitionSubmission.objects.create(participant=self.participant_1, phase=self.phase_1)
+        self.job = Job.objects.create(task_type='evaluate_submission',
+                                      task_args_json=json.dumps({'submission_id': self.submission_3.pk}))
+
+    def tearDown(self):
+        for name in self.names:
+            BundleStorage.delete(name)
+
+    def _store(self, name, content):
+        name = BundleStorage.save(name, ContentFile(content))
+        self.names.append(name)
+        return name
+
+    def _evaluate(self, content):
+        self.submission_3.file.name = self._store(submission_file_name(self.submission_3), content)
+        self.submission_3.save()
+        with mock.patch('apps.web.tasks.score') as score_mock:
+            with mock.patch('apps.web.tasks.precompute_scoring_artifacts'):
+                evaluate_submission_task(self.job.pk, {'submission_id': self.submission_3.pk, 'predict': False})
+        return score_mock.called, CompetitionSubmission.objects.get(pk=self.submission_3.pk)
+
+    def test_identical_submission_reuses_the_result(self):
+        scored, submission = self._evaluate('predictions')
+
+        self.assertFalse(scored)
+        self.assertEqual("finished", submission.status.codename)
+        self.assertEqual(self.submission_1.output_file.name, submission.output_file.name)
+        self.assertEqual([0.5], [float(score.value) for score in SubmissionScore.objects.filter(result=submission)])
+        self.assertEqual(Job.FINISHED, Job.objects.get(pk=self.job.pk).status)
+
+    def test_different_submission_is_evaluated(self):
+        scored, submission = self._evaluate('other predictions')
+
+        self.assertTrue(scored)
+        self.assertIsNotNone(submission.evaluation_key)
+        self.assertNotEqual(CompetitionSubmission.objects.get(pk=self.submission_1.pk).evaluation_key,
+                            submission.evaluation_key)
+        self.assertFalse(SubmissionScore.objects.filter(result=submission).exists())
+
+    def test_submission_is_evaluated_when_the_phase_changed(self):
+        self.phase_1.scoring_program.name = self._store(phase_scoring_program_file(self.phase_1), 'program 2')
+        self.phase_1.save()
+
+        scored, _ = self._evaluate('predictions')
+        self.assertTrue(scored)
+
+    def test_phase_may_opt_out(self):
+        self.phase_1.reuse_identical_results = False
+        self.phase_1.save()
+
+        scored, submission = self._evaluate('predictions')
+        self.assertTrue(scored)
+        self.assertIsNone(submission.evaluation_key)
+
+    def test_submission_already_being_evaluated_is_skipped(self):
+        other_job = Job.objects.create(task_type='evaluate_submission', task_args_json=self.job.task_args_json)
+        self.submission_3.execution_key = json.dumps({'score': other_job.pk})
+
+        scored, submission = self._evaluate('other predictions')
+        self.assertFalse(scored)
+        self.assertIsNone(submission.evaluation_key)
+        self.assertEqual(Job.FINISHED, Job.objects.get(pk=self.job.pk).status)
+        self.assertEqual(Job.PENDING, Job.objects.get(pk=other_job.pk).status)
+
+    def test_message_delivered_twice_evaluates_once(self):
+        scored, submission = self._evaluate('other predictions')
+        self.assertTrue(scored)
+        self.assertEqual({'evaluate': self.job.pk}, json.loads(submission.execution_key))
+
+        with mock.patch('apps.web.tasks.score') as score_mock:
+            evaluate_submission_task(self.job.pk, {'submission_id': self.submission_3.pk, 'predict': False})
+        self.assertFalse(score_mock.called)
+        # The job still tracks the first evaluation
+        self.assertEqual(Job.PENDING, Job.objects.get(pk=self.job.pk).status)
+
+    def test_files_are_hashed_once(self):
+        self._evaluate('predictions')
+        _get_evaluation_key(self.submission_3, False)
+        self.assertEqual(4, FileContentHash.objects.count())
+
+    def test_recorded_md5_is_used_without_reading_the_file(self):
+        field_file = mock.Mock()
+        field_file.storage.properties.return_value = {'etag': '0x1', 'content-md5': 'abc=='}
+
+        self.assertEqual('md5:abc==', FileContentHash.get_hash(field_file))
+        self.assertFalse(field_file.open.called)
+
+    def test_overwritten_file_is_hashed_again(self):
+        field_file = mock.Mock()
+        field_file.name = 'submission.zip'
+        field_file.chunks.return_value = ['content']
+        field_file.storage.properties.return_value = {'etag': '0x1'}
+        first_hash = FileContentHash.get_hash(field_file)
+        field_file.chunks.return_value = ['new content']
+        self.assertEqual(first_hash, FileContentHash.get_hash(field_file))
+
+        field_file.storage.properties.return_value = {'etag': '0x2'}
+        self.assertNotEqual(first_hash, FileContentHash.get_hash(field_file))
+        self.assertEqual(2, field_file.open.call_count)
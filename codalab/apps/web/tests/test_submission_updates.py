@@ -0,0 +1,103 @@
+import json
+import mock
+
+from apps.jobs.models import Job
+from apps.web.models import CompetitionSubmission, CompetitionSubmissionMetadata, CompetitionSubmissionStatus
+from apps.web.tasks import _get_compute_queue, _get_run_limits, update_submission_task
+from apps.web.tests.test_leaderboard_cache import LeaderboardTestCase
+
+
+class SubmissionUpdateTests(LeaderboardTestCase):
+    """Compute workers may send an update more than once: updates must be idempotent."""
+    def setUp(self):
+        super(SubmissionUpdateTests, self).setUp()
+        self.running = CompetitionSubmissionStatus.objects.create(name="running", codename="running")
+        CompetitionSubmissionStatus.objects.create(name="failed", codename="failed")
+        self.job = Job.objects.create(task_type='evaluate_submission',
+                                      task_args_json=json.dumps({'submission_id': self.submission_1.pk}))
+
+    def _status(self):
+        return CompetitionSubmission.objects.get(pk=self.submission_1.pk).status.codename
+
+    def test_update_of_completed_submission_is_ignored(self):
+        CompetitionSubmission.objects.filter(pk=self.submission_1.pk).update(
+            status=CompetitionSubmissionStatus.objects.get(codename="finished"))
+        update_submission_task(self.job.pk, {'status': 'failed', 'extra': {'traceback': 'lost'}})
+        submission = CompetitionSubmission.objects.get(pk=self.submission_1.pk)
+        self.assertEqual("finished", submission.status.codename)
+        self.assertNotEqual('lost', submission.exception_details)
+
+    def test_prediction_update_after_scoring_started_is_ignored(self):
+        CompetitionSubmission.objects.filter(pk=self.submission_1.pk).update(
+            status=self.running,
+            execution_key=json.dumps({'predict': self.job.pk, 'score': self.job.pk}))
+
+        with mock.patch('apps.web.tasks.score') as score_mock:
+            update_submission_task(self.job.pk, {'status': 'finished', 'predict': True})
+        self.assertFalse(score_mock.called)
+        self.assertEqual("running", self._status())
+
+    def test_scoring_update_is_applied(self):
+        CompetitionSubmission.objects.filter(pk=self.submission_1.pk).update(
+            status=self.running,
+            execution_key=json.dumps({'predict': self.job.pk, 'score': self.job.pk}))
+
+        update_submission_task(self.job.pk, {'status': 'failed', 'predict': False})
+        self.assertEqual("failed", self._status())
+
+    def test_resource_usage_is_stored_with_the_metadata(self):
+        CompetitionSubmission.objects.filter(pk=self.submission_1.pk).update(
+            status=self.running,
+            execution_key=json.dumps({'predict': self.job.pk, 'score': self.job.pk}))
+        usage = [{'exit_code': 0, 'elapsed_time': 2.0, 'user_time': 1.5, 'system_time': 0.5,
+                  'max_rss': 1024, 'read_bytes': 4096, 'write_bytes': 512}]
+        update_submission_task(self.job.pk, {'status': 'failed', 'predict': False, 'extra': {'metadata': {
+            'hostname': 'worker-1',
+            'elapsed_time': 2.0,
+            'cpu_user_time': 1.5,
+            'cpu_system_time': 0.5,
+            'peak_memory': 1024 * 1024,
+            'io_read_bytes': 4096,
+            'io_write_bytes': 512,
+            'command_usage': json.dumps(usage),
+        }}})
+
+        metadata = CompetitionSubmissionMetadata.objects.get(submission=self.submission_1, is_scoring=True)
+        self.assertEqual(2.0, metadata.elapsed_time)
+        self.assertEqual(1.5, metadata.cpu_user_time)
+        self.assertEqual(1024 * 1024, metadata.peak_memory)
+        self.assertEqual(4096, metadata.io_read_bytes)
+        self.assertEqual(usage, json.loads(metadata.command_usage))
+
+
+class RunLimitsTests(LeaderboardTestCase):
+    """The limits of a phase are sent to the compute workers with each run."""
+    def test_missing_limits_are_sent_as_none(self):
+        limits = _get_run_limits(self.phase_1)
+        self.assertEqual(self.phase_1.execution_time_limit, limits['execution_time_limit'])
+        self.assertEqual(None, limits['memory_limit'])
+        self.assertEqual(None, limits['disk_limit'])
+
+    def test_limits_are_sent_in_bytes(self):
+        self.phase_1.memory_limit = 512
+        self.phase_1.cpu_limit = 2
+        self.phase_1.process_limit = 64
+        self.phase_1.disk_limit = 100
+        limits = _get_run_limits(self.phase_1)
+        self.assertEqual(512 * 1024 * 1024, limits['memory_limit'])
+        self.assertEqual(2, limits['cpu_limit'])
+        self.assertEqual(64, limits['process_limit'])
+        self.assertEqual(100 * 1024 * 1024, limits['disk_limit'])
+
+    def test_compression_level_of_the_outputs_is_sent(self):
+        self.phase_1.output_compression_level = 1
+        self.assertEqual(1, _get_run_limits(self.phase_1)['output_compression_level'])
+
+    def test_runs_of_a_phase_with_a_queue_are_sent_to_it(self):
+        with self.settings(SBS_COMPUTE_QUEUE='compute', SBS_PHASE_COMPUTE_QUEUES={self.phase_1.pk: 'warm'}):
+            with mock.patch('apps.web.tasks.getQueue') as get_queue_mock:
+                _get_compute_queue(self.phase_1)
+                get_queue_mock.assert_called_with('warm')
+                self.phase_1.pk += 1
+                _get_compute_queue(self.phase_1)
+                get_queue_mock.assert_called_with('compute')
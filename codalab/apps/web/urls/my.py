@@ -28,6 +28,9 @@ urlpatterns = patterns(
     url(r'^competition/submission/(?P<submission_id>\d+)/(?P<filetype>stdout.txt|stderr.txt|input.zip|prediction-output.zip|output.zip|private_output.zip|detailed_results.html|predict_stdout.txt|predict_stderr.txt)$',
         views.MyCompetitionSubmissionOutput.as_view(),
         name='my_competition_output'),
+    url(r'^competition/submission/(?P<submission_id>\d+)/(?P<filetype>stdout.txt|stderr.txt|predict_stdout.txt|predict_stderr.txt)/tail$',
+        views.MyCompetitionSubmissionLogTail.as_view(),
+        name='my_competition_log_tail'),
     url(r'^competition/submission/(?P<submission_id>\d+)/toggle_make_public',
         views.MyCompetitionSubmissionToggleMakePublic.as_view(),
         name='my_competition_toggle_make_public'),
@@ -1,6 +1,5 @@
 import datetime
 import StringIO
-import csv
 import json
 import zipfile
 import os
@@ -24,7 +23,7 @@ from django.forms.formsets import formset_factory
 from django.http import Http404
 from django.http import HttpResponse, HttpResponseRedirect, HttpResponseBadRequest
 from django.http import StreamingHttpResponse
-from django.shortcuts import render_to_response, render
+from django.shortcuts import get_object_or_404, render_to_response, render
 from django.template import RequestContext, loader
 from django.utils.decorators import method_decorator
 from django.utils.html import strip_tags
@@ -35,6 +34,7 @@ from django.core.servers.basehttp import FileWrapper
 
 from mimetypes import MimeTypes
 
+from apps.web import export
 from apps.web import forms
 from apps.web import models
 from apps.web import tasks
@@ -540,16 +540,6 @@ class CompetitionResultsPage(TemplateView):
             context['error'] = traceback.format_exc()
             return context
 
-class CompetitionCheckMigrations(View):
-    def get(self, request, *args, **kwargs):
-        competitions = models.Competition.objects.filter(is_migrating=False)
-
-        for c in competitions:
-            c.check_future_phase_sumbmissions()
-
-        return HttpResponse()
-
-
 class CompetitionResultsDownload(View):
 
     def get(self, request, *args, **kwargs):
@@ -557,9 +547,10 @@ class CompetitionResultsDownload(View):
         phase = competition.phases.get(pk=self.kwargs['phase'])
         if phase.is_blind:
             return HttpResponse(status=403)
-        response = HttpResponse(competition.get_results_csv(phase.pk), status=200, content_type="text/csv")
-        response["Content-Disposition"] = "attachment; filename=%s results.csv" % phase.competition.title
-        return response
+        return export.csv_response(competition.get_results_rows(phase),
+                                   "%s results.csv" % phase.competition.title,
+                                   compress='gzip' in request.GET,
+                                   error_row=competition.RESULTS_ERROR_ROW)
 
 
 class CompetitionCompleteResultsDownload(View):
@@ -569,15 +560,33 @@ class CompetitionCompleteResultsDownload(View):
         phase = competition.phases.get(pk=self.kwargs['phase'])
         if phase.is_blind:
             return HttpResponse(status=403)
+        return export.csv_response(self.get_rows(phase), "competition_results.csv", compress='gzip' in request.GET)
+
+    def get_rows(self, phase):
+        """
+        Returns an iterator over the rows of the complete results CSV of the given phase. The
+        leaderboard is read before returning, so its errors are raised here rather than while
+        the rows are sent.
+        """
         groups = phase.scores(include_scores_not_on_leaderboard=True)
-        leader_board = models.PhaseLeaderBoard.objects.get(phase=phase)
-
-        csvfile = StringIO.StringIO()
-        csvwriter = csv.writer(csvfile)
-
+        leader_board_entries = set(models.PhaseLeaderBoardEntry.objects.filter(board__phase=phase).values_list('result__id', flat=True))
+        # The submission details of every row, read in a single query
+        submissions = {}
+        if any(len(group['scores']) > 0 for group in groups):
+            qs = models.CompetitionSubmission.objects.filter(phase=phase, status__codename=models.CompetitionSubmissionStatus.FINISHED)
+            for submission in qs.iterator():
+                submissions[submission.pk] = (submission.description, submission.submitted_at, submission.get_filename())
+            # The cached scores may list a submission whose status changed since
+            missing = set(scores['id'] for group in groups for _, scores in group['scores']) - set(submissions)
+            for submission in models.CompetitionSubmission.objects.filter(pk__in=missing).iterator():
+                submissions[submission.pk] = (submission.description, submission.submitted_at, submission.get_filename())
+        return self._rows(groups, leader_board_entries, submissions)
+
+    def _rows(self, groups, leader_board_entries, submissions):
+        """Yields the rows of the complete results CSV of the given leaderboard groups."""
         for group in groups:
-            csvwriter.writerow([group['label'].encode("utf-8")])
-            csvwriter.writerow([])
+            yield [group['label'].encode("utf-8")]
+            yield []
 
             headers = ["User"]
             sub_headers = [""]
@@ -593,16 +602,16 @@ class CompetitionCompleteResultsDownload(View):
             headers.append('Date')
             headers.append('Filename')
             headers.append('Is on leaderboard?')
-            csvwriter.writerow(headers)
-            csvwriter.writerow(sub_headers)
+            yield headers
+            yield sub_headers
 
             if len(group['scores']) <= 0:
-                csvwriter.writerow(["No data available"])
+                yield ["No data available"]
             else:
-                leader_board_entries = models.PhaseLeaderBoardEntry.objects.filter(board=leader_board).values_list('result__id', flat=True)
-
                 for pk, scores in group['scores']:
-                    submission = models.CompetitionSubmission.objects.get(pk=scores['id'])
+                    if scores['id'] not in submissions:
+                        # Deleted since the scores were cached
+                        continue
                     row = [scores['username']]
                     for v in scores['values']:
                         if 'rnk' in v:
@@ -610,22 +619,16 @@ class CompetitionCompleteResultsDownload(View):
                         else:
                             row.append("%s (%s)" % (v['val'], v['hidden_rnk']))
 
-                    row.append(submission.description)
-                    row.append(submission.submitted_at)
-                    row.append(submission.get_filename())
+                    row.extend(submissions[scores['id']])
 
-                    is_on_leaderboard = submission.pk in leader_board_entries
+                    is_on_leaderboard = scores['id'] in leader_board_entries
                     row.append(is_on_leaderboard)
 
                     row = [unicode(r).encode("utf-8") for r in row]
-                    csvwriter.writerow(row)
+                    yield row
 
-            csvwriter.writerow([])
-            csvwriter.writerow([])
-
-        response = HttpResponse(csvfile.getvalue(), status=200, content_type="text/csv")
-        response["Content-Disposition"] = "attachment; filename=competition_results.csv"
-        return response
+            yield []
+            yield []
 
 ### Views for My Codalab
 
@@ -819,6 +822,30 @@ class MyCompetitionSubmissionOutput(LoginRequiredMixin, View):
                 msg = "There was an error retrieving file '%s'. Please try again later or report the issue."
                 return HttpResponse(msg % filetype, status=200, content_type='text/plain')
 
+class MyCompetitionSubmissionLogTail(LoginRequiredMixin, View):
+    """
+    This view serves the output of a submission while it runs: each request returns the bytes
+    written after the offset given in the query string, as JSON with the next offset and the
+    status of the submission.
+    """
+    def get(self, request, *args, **kwargs):
+        submission = get_object_or_404(models.CompetitionSubmission, pk=kwargs.get('submission_id'))
+        try:
+            offset = max(0, int(request.GET.get('offset', 0)))
+            # Checks the permissions of the user
+            data, offset = submission.read_log(kwargs.get('filetype'), request.user, offset)
+        except PermissionDenied:
+            # Does not reveal the submissions the user may not see
+            raise Http404()
+        except ValueError:
+            return HttpResponse(status=400)
+        content = json.dumps({
+            'data': data.decode('utf-8', 'replace'),
+            'offset': offset,
+            'status': submission.status.codename,
+        })
+        return HttpResponse(content, status=200, content_type='application/json')
+
 class MyCompetitionSubmissionDetailedResults(TemplateView):
     """
     This view serves the files associated with a submission.
@@ -1295,6 +1322,7 @@ def submission_mark_as_failed(request, submission_pk):
                 raise Http404()
             submission.status = models.CompetitionSubmissionStatus.objects.get(codename="failed")
             submission.save()
+            models.invalidate_leaderboard(submission.phase)
             return HttpResponse()
         except models.CompetitionSubmission.DoesNotExist:
             raise Http404()
@@ -1319,12 +1347,7 @@ def submission_toggle_leaderboard(request, submission_pk):
             if not is_on_leaderboard:
                 models.add_submission_to_leaderboard(submission)
             else:
-                entries = models.PhaseLeaderBoardEntry.objects.filter(
-                    board__phase=submission.phase,
-                    result__participant=submission.participant
-                )
-                for entry in entries:
-                    entry.delete()
+                models.remove_submission_from_leaderboard(submission)
 
             return HttpResponse()
         except models.CompetitionSubmission.DoesNotExist:
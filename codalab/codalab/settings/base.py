@@ -319,6 +319,42 @@ class Base(Settings):
     # Currently the search bar is hidden using this flag
     SHOW_BETA_FEATURES = False
 
+    # Leaderboard snapshots are versioned and invalidated explicitly, the timeout only
+    # bounds how long stale versions linger in the cache backend.
+    LEADERBOARD_CACHE_TIMEOUT = 60 * 60 * 24
+    # Ranks leaderboard columns with 'python' dictionaries or, when numpy is
+    # installed, 'numpy' arrays (faster on phases with many submissions).
+    LEADERBOARD_SCORING_BACKEND = 'python'
+
+    # Backend of the job queues: 'azure' for the Service Bus, or 'local' for a SQLite
+    # database shared by the processes of one machine (development and load tests).
+    QUEUE_BACKEND = 'azure'
+    LOCAL_QUEUE_PATH = os.path.join(PROJECT_DIR, 'local_queues.sqlite')
+
+    # Compute queues dedicated to phases, {phase_id: queue name}. The runs of such a phase are
+    # sent to its queue instead of SBS_COMPUTE_QUEUE, so the compute workers listening to it
+    # keep the scoring program and reference data of the phase staged (see warm-phases).
+    SBS_PHASE_COMPUTE_QUEUES = {}
+
+    # Site worker lanes (codalab/worker.py): the Service Bus queue of each lane, None to use
+    # SBS_RESPONSE_QUEUE, and the number of processes, or threads, handling its messages.
+    SITE_JOB_LANES = {
+        'updates': {'queue': None, 'concurrency': 1},
+        'bulk': {'queue': None, 'concurrency': 1},
+        'scheduled': {'queue': None, 'concurrency': 1},
+    }
+    SITE_WORKER_USE_THREADS = False
+    # The site worker serving the scheduled lane checks the automatic phase migrations when a
+    # phase starts. Seconds between two reloads of the start dates of the upcoming phases, and
+    # between two retries of the migrations delayed by running submissions or stalled.
+    PHASE_MIGRATION_REFRESH_INTERVAL = 300
+    PHASE_MIGRATION_RETRY_INTERVAL = 60
+    # Maximum number of tasks of a type running at once in each site worker.
+    SITE_WORKER_TASK_LIMITS = {
+        'create_competition': 1,
+        'send_mass_email': 1,
+    }
+
     # A sample logging configuration. The only tangible logging
     # performed by this configuration is to send an email to
     # the site admins on every HTTP 500 error when DEBUG=False.
@@ -31,6 +31,18 @@ class Dev(DevBase):
     SBS_ACCOUNT_KEY = '<enter key>'
     SBS_RESPONSE_QUEUE = '<enter queue name>' # incoming queue for site worker
     SBS_COMPUTE_QUEUE = '<enter queue name>'  # incoming queue for Windows compute worker
+    # Optional queues of phases with many submissions, served by compute workers keeping them warm
+    # SBS_PHASE_COMPUTE_QUEUES = {<phase id>: '<enter queue name>'}
+    # Uncomment to run the queues from a local SQLite database instead of the Service Bus. Point
+    # the 'local-queue' section of the compute worker configuration at the same file.
+    # QUEUE_BACKEND = 'local'
+    # LOCAL_QUEUE_PATH = '/var/tmp/codalab-queues.sqlite'
+    # Optional queues of the site worker lanes, run with: python worker.py worker [lane...]
+    # SITE_JOB_LANES = {
+    #     'updates': {'queue': SBS_RESPONSE_QUEUE, 'concurrency': 2},  # status and score updates
+    #     'bulk': {'queue': '<enter queue name>', 'concurrency': 1},  # emails, competition unpacking
+    #     'scheduled': {'queue': '<enter queue name>', 'concurrency': 1},  # phase migrations
+    # }
 
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
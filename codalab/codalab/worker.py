@@ -3,9 +3,12 @@
 Defines the worker process which handles background tasks for the web site.
 """
 import logging
+import multiprocessing
 import os
+import signal
 import sys
 import time
+from collections import OrderedDict
 from os.path import dirname, abspath, basename
 
 # Add codalab site directory to the module search path
@@ -17,35 +20,115 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "codalab.settings")
 from configurations import importer
 importer.install()
 
+from django.conf import settings
+from django.utils.timezone import now
 from codalabtools import BaseWorker
 from apps.jobs.models import (update_job_status_task,
+                              getLaneQueueName,
                               getQueue,
-                              Job)
+                              Job,
+                              LANE_SCHEDULED)
+from apps.web.phase_schedule import PhaseMigrationSchedule
 from apps.web.tasks import (echo_task,
                             create_competition_task,
                             evaluate_submission_task,
                             update_submission_task,
-                            send_mass_email_task)
+                            send_mass_email_task,
+                            precompute_scoring_artifacts_task,
+                            check_phase_migrations,
+                            check_phase_migrations_task)
 
 logger = logging.getLogger('codalab')
 
-def start_worker():
+# Maps a task type to the function running it. The lane of the site worker its jobs are
+# dispatched to is set by TASK_LANES in apps/jobs/models.py.
+TASKS = {
+    'status_update': update_job_status_task,
+    'echo': echo_task,
+    'create_competition': create_competition_task,
+    'evaluate_submission': evaluate_submission_task,
+    'run_update': update_submission_task,
+    'send_mass_email': send_mass_email_task,
+    'precompute_scoring_artifacts': precompute_scoring_artifacts_task,
+    'check_phase_migrations': check_phase_migrations_task,
+}
+
+def _run_worker(queue_name, concurrency):
     """
-    Setup the worker and start it.
+    Runs a site worker listening to the given queue.
     """
-    queue = getQueue()
-    vtable = {
-        'status_update': update_job_status_task,
-        'echo': echo_task,
-        'create_competition': create_competition_task,
-        'evaluate_submission': evaluate_submission_task,
-        'run_update': update_submission_task,
-        'send_mass_email': send_mass_email_task
-    }
-    worker = BaseWorker(queue, vtable, logger)
-    logger.info("Starting site worker.")
+    # Every worker can run any task, in case a job was dispatched before the routes changed.
+    worker = BaseWorker(getQueue(queue_name), TASKS, logger,
+                        concurrency=concurrency,
+                        task_limits=settings.SITE_WORKER_TASK_LIMITS,
+                        use_threads=settings.SITE_WORKER_USE_THREADS)
+    logger.info("Starting site worker (queue=%s, concurrency=%s).", queue_name, concurrency)
     worker.start()
 
+def _run_phase_migration_scheduler():
+    """
+    Runs the scheduler of the phase migrations: it sleeps until the next phase boundary (see
+    PhaseMigrationSchedule) and dispatches the check of the competitions due to the scheduled lane.
+    """
+    def new_schedule():
+        return PhaseMigrationSchedule(refresh_interval=settings.PHASE_MIGRATION_REFRESH_INTERVAL,
+                                      retry_interval=settings.PHASE_MIGRATION_RETRY_INTERVAL)
+    schedule = new_schedule()
+    logger.info("Starting the phase migration scheduler.")
+    while True:
+        try:
+            competition_ids, resume_stalled = schedule.get_due(now())
+            if competition_ids or resume_stalled:
+                logger.info("Checking the phase migrations of competitions %s.", sorted(competition_ids))
+                check_phase_migrations(competition_ids, resume_stalled)
+            delay = schedule.get_delay(now())
+        except Exception:
+            logger.exception("Failed to schedule the phase migrations.")
+            # Starts over, the new schedule catches up with the boundaries which were missed
+            schedule = new_schedule()
+            delay = settings.PHASE_MIGRATION_RETRY_INTERVAL
+        time.sleep(delay)
+
+def start_worker(lanes=None):
+    """
+    Setup the worker and start it.
+
+    lanes: The names of the lanes to serve, all of them by default. Lanes sharing a queue are
+        served by the same worker, with the largest concurrency among them, and the others by
+        a worker process each. Serving the scheduled lane also runs the scheduler of the phase
+        migrations in a process of its own, so a single site worker should serve it.
+    """
+    if not lanes:
+        lanes = sorted(settings.SITE_JOB_LANES)
+    concurrency_by_queue = OrderedDict()
+    for lane in lanes:
+        queue_name = getLaneQueueName(lane)
+        concurrency = settings.SITE_JOB_LANES[lane].get('concurrency', 1)
+        concurrency_by_queue[queue_name] = max(concurrency_by_queue.get(queue_name, 0), concurrency)
+
+    run_scheduler = LANE_SCHEDULED in lanes
+    if len(concurrency_by_queue) == 1 and not run_scheduler:
+        _run_worker(*concurrency_by_queue.items()[0])
+        return
+
+    processes = [multiprocessing.Process(target=_run_worker, args=item) for item in concurrency_by_queue.iteritems()]
+    if run_scheduler:
+        processes.append(multiprocessing.Process(target=_run_phase_migration_scheduler))
+    for process in processes:
+        process.start()
+
+    def stop(signum, frame):
+        logger.info("Received signal %s, stopping the site workers.", signum)
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for process in processes:
+        while process.is_alive():
+            process.join(1)
+
 def start_producer():
     """
     Start a sample task producer.
@@ -64,10 +147,10 @@ def start_producer():
 if __name__ == "__main__":
 
     usage = """
-Usage: %s [command]
+Usage: %s [command] [lane...]
 
 command:
-    worker (default): starts the site background worker.
+    worker (default): starts the site background worker, serving the given lanes or all of them.
     producer: starts a sample producer of tasks directed at the site background worker.
 """ % basename(sys.argv[0])
 
@@ -76,7 +159,7 @@ command:
         command = sys.argv[1]
 
     if command == "worker":
-        start_worker()
+        start_worker(sys.argv[2:])
     if command == "producer":
         start_producer()
     else:
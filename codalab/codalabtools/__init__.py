@@ -2,14 +2,17 @@
 Package containing the CodaLab client tools.
 """
 
+import errno
 import json
 import logging
 import multiprocessing
 import os
+import signal
+import threading
 import yaml
 import time
 
-from Queue import Empty
+from Queue import Empty, Queue as ThreadQueue
 
 class BaseConfig(object):
     """
@@ -61,6 +64,16 @@ class Queue(object):
         """
         raise NotImplementedError()
 
+    def send_messages(self, bodies):
+        """
+        Sends several messages to the queue, in order. Queues which can send a batch of
+        messages at once override this method.
+
+        bodies: A list of strings representing the bodies of the messages.
+        """
+        for body in bodies:
+            self.send_message(body)
+
 class QueueMessage(object):
     """
     Provides an abstract definition for a message exchanged through a queue.
@@ -71,6 +84,21 @@ class QueueMessage(object):
     def get_queue(self):
         """Gets the Queue instance from which the message was retrieved."""
         raise NotImplementedError()
+    def get_delivery_count(self):
+        """Gets the number of times the message has been received, this time included."""
+        return 1
+    def complete(self):
+        """
+        Removes the message from the queue once its task is done. Messages received without a
+        lock are removed when they are received, so this does nothing by default.
+        """
+        pass
+    def abandon(self):
+        """Releases the lock on the message so that it can be received again."""
+        pass
+    def renew_lock(self):
+        """Extends the lock on the message while its task is running."""
+        pass
 
 class QueueMessageError(Exception):
     """Indicates that the body of a queue message cannot be decoded or is invalid."""
@@ -100,24 +128,144 @@ def decode_message_body(message):
         raise QueueMessageError("Missing key: task_type.")
     return data
 
+class LockRenewal(object):
+    """
+    Renews the lock on a message periodically, from a background thread, while its task runs.
+    """
+    def __init__(self, msg, interval, logger):
+        self.msg = msg
+        self.interval = interval
+        self.logger = logger
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.msg.renew_lock()
+            except Exception:
+                self.logger.exception("Failed to renew the lock on message: %s", self.msg.get_body())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._stopped.set()
+        self._thread.join()
+
 class BaseWorker(object):
     """
     Defines the base implementation for a worker process which listens to a queue for
     messages. Each message defines a task. When the worker receives a message, it performs
     the task then goes back to listening mode.
+
+    By default a single child process handles the messages one at a time. In pool mode
+    (concurrency > 1) several lanes, processes or threads, pull messages from the same queue
+    so that a slow task does not hold back the others. The number of tasks of a given type
+    running at once can be capped with task_limits. On SIGTERM or SIGINT the pool stops
+    receiving messages and lets the running tasks finish.
+
+    Messages received with a lock (see QueueMessage) are completed once their task is done and
+    abandoned when it raises, so that another worker can pick them up. The lock is renewed every
+    lock_renewal_interval seconds while the task runs. A message received more than
+    max_delivery_count times is handed to dead_letter instead of running its task again.
     """
 
-    def __init__(self, queue, vtable, logger):
+    # Seconds without news from a lane waiting for a message before it is restarted
+    WATCHDOG_TIMEOUT = 120
+
+    def __init__(self, queue, vtable, logger, concurrency=1, task_limits=None, use_threads=False,
+                 limit_wait=5, drain_timeout=None, lock_renewal_interval=None, max_delivery_count=None,
+                 dead_letter=None, lane_init=None):
         """
         queue: The Queue object to listen to.
         vtable: A map from a task type to a function which contructs a runnable task. Given a
             message with an identifier I, a task type T and task arguments A, the function
             constructed to run the task is: F = vtable[T](I, A). And F() runs the task.
         logger: The logging.Logger object to use.
+        concurrency: The number of lanes handling messages in parallel.
+        task_limits: A map from a task type to the maximum number of tasks of that type which
+            may run at once in pool mode.
+        use_threads: True to run the lanes of the pool as threads instead of processes.
+        limit_wait: Seconds a lane waits for a task type to get under its limit. After that
+            the message is sent back to the queue and the lane moves on.
+        drain_timeout: Seconds to wait for running tasks on shutdown, None to wait until they
+            finish. Lanes still running after the timeout are terminated (processes only).
+        lock_renewal_interval: Seconds between two renewals of the lock on the message of a
+            running task, None to never renew it.
+        max_delivery_count: The number of times a message may be received before it is dead
+            lettered, None for no limit.
+        dead_letter: A function invoked with the task ID, type and arguments of a message which
+            is dead lettered: dead_letter(task_id, task_type, task_args). The message is then
+            completed.
+        lane_init: A function invoked with its index when a lane of the pool starts, in the
+            process or thread of the lane: lane_init(lane).
         """
         self.queue = queue
         self.logger = logger
         self.vtable = vtable
+        self.concurrency = concurrency
+        self.task_limits = task_limits or {}
+        self.use_threads = use_threads
+        self.limit_wait = limit_wait
+        self.drain_timeout = drain_timeout
+        self.lock_renewal_interval = lock_renewal_interval
+        self.max_delivery_count = max_delivery_count
+        self.dead_letter = dead_letter
+        self.lane_init = lane_init
+
+    def _run_message(self, msg, semaphores=None):
+        """
+        Runs the task defined by a message.
+
+        semaphores: A map from a task type to the semaphore enforcing its limit.
+        """
+        self.logger.debug("Received message: %s", msg.get_body())
+        try:
+            data = decode_message_body(msg)
+        except QueueMessageError:
+            # Receiving the message again would not make it valid
+            msg.complete()
+            raise
+        task_id = data['id']
+        task_type = data['task_type']
+        task_args = data['task_args'] if 'task_args' in data else None
+        if task_type not in self.vtable:
+            self.logger.warning("Unknown task_type=%s for task with id=%s", task_type, task_id)
+            msg.complete()
+            return
+        delivery_count = msg.get_delivery_count()
+        if self.max_delivery_count is not None and delivery_count > self.max_delivery_count:
+            self.logger.error("Dead lettering task: id=%s task_type=%s received %s times",
+                              task_id, task_type, delivery_count)
+            if self.dead_letter is not None:
+                self.dead_letter(task_id, task_type, task_args)
+            msg.complete()
+            return
+        semaphore = semaphores.get(task_type) if semaphores else None
+        if semaphore is not None and not semaphore.acquire(True, self.limit_wait):
+            self.logger.info("Too many tasks running for task_type=%s, requeueing task with id=%s", task_type, task_id)
+            self.queue.send_message(msg.get_body())
+            msg.complete()
+            return
+        try:
+            self.logger.info("Running task: id=%s task_type=%s", task_id, task_type)
+            if self.lock_renewal_interval:
+                with LockRenewal(msg, self.lock_renewal_interval, self.logger):
+                    self.vtable[task_type](task_id, task_args)
+            else:
+                self.vtable[task_type](task_id, task_args)
+            self.logger.info("Task complete: id=%s task_type=%s", task_id, task_type)
+        except Exception:
+            msg.abandon()
+            raise
+        else:
+            msg.complete()
+        finally:
+            if semaphore is not None:
+                semaphore.release()
 
     def _message_receive_listen(self, queue):
         while True:
@@ -127,25 +275,123 @@ class BaseWorker(object):
                 msg = self.queue.receive_message()
                 queue.put('received message')
                 if msg is not None:
-                    self.logger.debug("Received message: %s", msg.get_body())
-                    data = decode_message_body(msg)
-                    task_id = data['id']
-                    task_type = data['task_type']
-                    task_args = data['task_args'] if 'task_args' in data else None
-                    if task_type in self.vtable:
-                        self.logger.info("Running task: id=%s task_type=%s", task_id, task_type)
-                        self.vtable[task_type](task_id, task_args)
-                        self.logger.info("Task complete: id=%s task_type=%s", task_id, task_type)
-                    else:
-                        self.logger.warning("Unknown task_type=%s for task with id=%s", task_type, task_id)
+                    self._run_message(msg)
+            # catch all non-"system exiting" exceptions
+            except Exception:
+                self.logger.exception("An error has occurred.")
+
+    def _pool_lane(self, lane, status_queue, stop_event, semaphores):
+        """
+        Handles messages until the pool is stopped.
+
+        lane: The index of the lane in the pool.
+        status_queue: The queue on which the lane reports (lane, status) to the pool.
+        stop_event: The event set when the pool drains.
+        semaphores: A map from a task type to the semaphore enforcing its limit.
+        """
+        if not self.use_threads:
+            # Shutdown signals are handled by the pool, which lets the running task finish
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        if self.lane_init is not None:
+            self.lane_init(lane)
+        while not stop_event.is_set():
+            try:
+                status_queue.put((lane, 'waiting for message'))
+                msg = self.queue.receive_message()
+                status_queue.put((lane, 'received message'))
+                if msg is not None:
+                    self._run_message(msg, semaphores)
             # catch all non-"system exiting" exceptions
             except Exception:
                 self.logger.exception("An error has occurred.")
+        status_queue.put((lane, 'stopped'))
+
+    def _start_pool(self):
+        """
+        Runs the lanes of the pool until the worker receives SIGTERM or SIGINT, then drains them.
+        """
+        self.logger.debug("BaseWorker starting a pool of %s %s.", self.concurrency,
+                          "threads" if self.use_threads else "processes")
+        if self.use_threads:
+            status_queue = ThreadQueue()
+            stop_event = threading.Event()
+        else:
+            status_queue = multiprocessing.Queue()
+            stop_event = multiprocessing.Event()
+        # multiprocessing semaphores are shared with forked lanes and support acquire timeouts
+        semaphores = dict((task_type, multiprocessing.BoundedSemaphore(limit))
+                          for task_type, limit in self.task_limits.iteritems())
+
+        def start_lane(lane):
+            args = (lane, status_queue, stop_event, semaphores)
+            if self.use_threads:
+                worker = threading.Thread(target=self._pool_lane, args=args)
+                worker.daemon = True
+            else:
+                worker = multiprocessing.Process(target=self._pool_lane, args=args)
+            worker.start()
+            return worker
+
+        def stop(signum, frame):
+            self.logger.info("Received signal %s, draining the worker pool.", signum)
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        lanes = [start_lane(lane) for lane in range(self.concurrency)]
+        last_status = {}
+        last_seen = dict((lane, time.time()) for lane in range(self.concurrency))
+        while not stop_event.is_set():
+            try:
+                lane, status = status_queue.get(True, 1)
+                last_status[lane] = status
+                last_seen[lane] = time.time()
+            except Empty:
+                pass
+            except (IOError, OSError) as e:
+                # Interrupted by the shutdown signal
+                if e.errno != errno.EINTR:
+                    raise
+            if stop_event.is_set():
+                break
+            for lane, worker in enumerate(lanes):
+                stuck = (not self.use_threads and last_status.get(lane) == 'waiting for message' and
+                         time.time() - last_seen[lane] > self.WATCHDOG_TIMEOUT)
+                if stuck or not worker.is_alive():
+                    self.logger.debug("Restarting worker lane %s", lane)
+                    if worker.is_alive():
+                        worker.terminate()
+                    last_status.pop(lane, None)
+                    last_seen[lane] = time.time()
+                    lanes[lane] = start_lane(lane)
+
+        self._drain(lanes)
+
+    def _drain(self, lanes):
+        """
+        Waits for the lanes to finish their current task.
+        """
+        deadline = None if self.drain_timeout is None else time.time() + self.drain_timeout
+        for worker in lanes:
+            while worker.is_alive() and (deadline is None or time.time() < deadline):
+                worker.join(1)
+            if worker.is_alive():
+                if self.use_threads:
+                    self.logger.warning("Worker lane did not finish within the drain timeout.")
+                else:
+                    self.logger.warning("Terminating worker lane which did not finish within the drain timeout.")
+                    worker.terminate()
+        self.logger.info("Worker pool drained.")
 
     def start(self):
         """
         Starts the worker loop on the current thread.
         """
+        if self.concurrency > 1:
+            return self._start_pool()
+
         self.logger.debug("BaseWorker entering worker loop.")
 
         last_message = None
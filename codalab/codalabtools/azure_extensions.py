@@ -1,14 +1,18 @@
 """
 This module defines Windows Azure extensions for CodaLab.
 """
+import json
 import logging
 from time import sleep
 
 from azure import (
     WindowsAzureData,
-    WindowsAzureError
+    WindowsAzureError,
+    _update_request_uri_query
 )
 
+from azure.http import HTTPRequest
+
 from azure.storage import (
     _sign_storage_blob_request,
     BlobService,
@@ -34,7 +38,20 @@ class AzureServiceBusQueueMessage(QueueMessage):
     def get_body(self):
         return self.message.body
     def get_queue(self):
-        raise self.queue
+        return self.queue
+    def get_delivery_count(self):
+        if self.message.broker_properties is None:
+            return 1
+        return self.message.broker_properties.get('DeliveryCount', 1)
+    def complete(self):
+        if self.queue.peek_lock:
+            self.queue._try_request(self.message.delete)
+    def abandon(self):
+        if self.queue.peek_lock:
+            self.queue._try_request(self.message.unlock)
+    def renew_lock(self):
+        if self.queue.peek_lock:
+            self.queue._try_request(lambda: self.queue._renew_lock(self.message))
 
 class AzureServiceBusQueue(Queue):
     """
@@ -45,9 +62,20 @@ class AzureServiceBusQueue(Queue):
     # conditions occurs: a message is received or the timeout period has elapsed.
     polling_timeout = 60
 
-    def __init__(self, namespace, key, issuer, name):
+    # Maximum size in bytes of a batch of messages sent in one request. Service Bus accepts
+    # requests of up to 256 KB.
+    max_batch_size = 192 * 1024
+
+    def __init__(self, namespace, key, issuer, name, peek_lock=False):
+        """
+        namespace, key, issuer: The Service Bus credentials.
+        name: Name of the queue.
+        peek_lock: True to lock received messages, which must then be completed, instead of
+            deleting them as they are received.
+        """
         self.service = ServiceBusService(service_namespace=namespace, account_key=key, issuer=issuer)
         self.name = name
+        self.peek_lock = peek_lock
         self.max_retries = 3
         self.wait = lambda count: 1.0*(2**count)
 
@@ -70,16 +98,56 @@ class AzureServiceBusQueue(Queue):
 
     def receive_message(self):
         op = lambda: self.service.receive_queue_message(self.name,
-                                                        peek_lock=False,
+                                                        peek_lock=self.peek_lock,
                                                         timeout=self.polling_timeout)
         msg = self._try_request(op)
         return None if msg.body is None else AzureServiceBusQueueMessage(self, msg)
 
+    def _renew_lock(self, msg):
+        # The Service Bus REST API renews a lock with a POST on the locked message, which
+        # ServiceBusService does not expose.
+        request = HTTPRequest()
+        request.method = 'POST'
+        request.host = self.service._get_host()
+        request.path = '/%s/messages/%s/%s' % (self.name,
+                                               msg.broker_properties['SequenceNumber'],
+                                               msg.broker_properties['LockToken'])
+        request.path, request.query = _update_request_uri_query(request)
+        request.headers = self.service._update_service_bus_header(request)
+        self.service._perform_request(request)
+
     def send_message(self, body):
         op = lambda: self.service.send_queue_message(self.name, Message(body))
         fail = lambda: logger.error("Failed to send message. Message body is:\n%s", body)
         self._try_request(op, fail=fail)
 
+    def _send_batch(self, bodies):
+        # The Service Bus REST API sends a batch of messages given as a JSON array, which
+        # ServiceBusService does not expose.
+        request = HTTPRequest()
+        request.method = 'POST'
+        request.host = self.service._get_host()
+        request.path = '/%s/messages' % self.name
+        request.headers = [('Content-Type', 'application/vnd.microsoft.servicebus.json')]
+        request.body = json.dumps([{'Body': body} for body in bodies])
+        request.path, request.query = _update_request_uri_query(request)
+        request.headers = self.service._update_service_bus_header(request)
+        self.service._perform_request(request)
+
+    def send_messages(self, bodies):
+        batch, batch_size = [], 0
+        batches = [batch]
+        for body in bodies:
+            if batch and batch_size + len(body) > self.max_batch_size:
+                batch, batch_size = [], 0
+                batches.append(batch)
+            batch.append(body)
+            batch_size += len(body)
+        for batch in batches:
+            if batch:
+                fail = lambda: logger.error("Failed to send a batch of %s messages.", len(batch))
+                self._try_request(lambda: self._send_batch(batch), fail=fail)
+
 
 class CorsRule(WindowsAzureData):
     '''CORS Rule for Windows Azure storage service.'''
@@ -0,0 +1,322 @@
+"""
+Defines a cache of extracted bundles shared by the compute workers of a host, and the bundles
+of the phases a compute worker keeps warm.
+"""
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import threading
+
+from collections import OrderedDict
+from os.path import join
+
+logger = logging.getLogger('codalabtools')
+
+class BundleCache(object):
+    """
+    A size-bounded cache of extracted bundles, evicting the least recently used ones.
+
+    Entries are keyed by the name of the Blob holding the bundle and its ETag (and MD5 when
+    available), so a Blob which is overwritten is downloaded again. The files of an entry are
+    read-only and hard-linked into the run directories, so staging a cached bundle costs no copy
+    and an entry can be evicted while runs still use its files.
+
+    Several workers may share the cache: entries are added with an atomic rename, and a lock
+    file keeps evictions from running while an entry is being linked.
+
+    Layout of the cache directory:
+        entries/<key>/tree: the extracted bundle
+        entries/<key>/size: its size in bytes (the modification time records the last use)
+        tmp/: entries being added
+        stats.json: hit, miss and eviction counts
+    """
+
+    def __init__(self, root, max_size):
+        """
+        root: Path of the cache directory, created if needed.
+        max_size: The maximum number of bytes held by the cache.
+        """
+        self.root = os.path.abspath(root)
+        self.max_size = max_size
+        self.entries_dir = join(self.root, 'entries')
+        self.tmp_dir = join(self.root, 'tmp')
+        self.lock_path = join(self.root, 'lock')
+        self.stats_path = join(self.root, 'stats.json')
+        for path in (self.entries_dir, self.tmp_dir):
+            try:
+                os.makedirs(path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _lock(self, operation):
+        lock_file = open(self.lock_path, 'a')
+        fcntl.flock(lock_file, operation)
+        return lock_file
+
+    @staticmethod
+    def get_key(container, blob_name, properties):
+        """
+        Returns the key of the entry for a Blob.
+
+        properties: The properties of the Blob returned by BlobService.get_blob_properties.
+        """
+        version = "%s:%s" % (properties.get('etag', ''), properties.get('content-md5', ''))
+        return hashlib.sha1("%s/%s@%s" % (container, blob_name, version)).hexdigest()
+
+    def stage(self, blob_service, container, blob_name, bundle_path, fill):
+        """
+        Stages a bundle at bundle_path, from the cache if possible.
+
+        blob_service: Azure BlobService to access the storage account holding the bundles.
+        container: Name of the Blob container holding the bundle.
+        blob_name: Name of the Blob holding the bundle.
+        bundle_path: Path of the directory where the bundle is staged.
+        fill: The function invoked to download and extract the bundle on a miss: fill(path).
+
+        Returns True on a hit, False on a miss.
+        """
+        properties = blob_service.get_blob_properties(container, blob_name)
+        key = self.get_key(container, blob_name, properties)
+        entry_dir = join(self.entries_dir, key)
+
+        hit = self._link(entry_dir, bundle_path)
+        if not hit:
+            self._add(entry_dir, fill)
+            if not self._link(entry_dir, bundle_path):
+                # Evicted by another worker right after it was added
+                fill(bundle_path)
+            self.evict()
+
+        self._count('hits' if hit else 'misses')
+        logger.debug("Bundle cache %s for blob=%s (key=%s)", "hit" if hit else "miss", blob_name, key)
+        return hit
+
+    def _link(self, entry_dir, bundle_path):
+        """Links the files of an entry into bundle_path. Returns False if the entry does not exist."""
+        lock_file = self._lock(fcntl.LOCK_SH)
+        try:
+            if not os.path.isdir(entry_dir):
+                return False
+            os.utime(join(entry_dir, 'size'), None)
+            _link_tree(join(entry_dir, 'tree'), bundle_path)
+            return True
+        finally:
+            lock_file.close()
+
+    def _add(self, entry_dir, fill):
+        """Fills a new entry and moves it into the cache."""
+        new_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        try:
+            tree_dir = join(new_dir, 'tree')
+            fill(tree_dir)
+            size = _make_read_only(tree_dir)
+            with open(join(new_dir, 'size'), 'w') as f:
+                f.write(str(size))
+            lock_file = self._lock(fcntl.LOCK_SH)
+            try:
+                os.rename(new_dir, entry_dir)
+            except OSError as e:
+                # Another worker added the same entry first
+                if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                    raise
+            finally:
+                lock_file.close()
+        finally:
+            if os.path.exists(new_dir):
+                _remove_tree(new_dir)
+
+    def _entries(self):
+        """Returns the (last use, size, key) of the entries."""
+        entries = []
+        for key in os.listdir(self.entries_dir):
+            try:
+                size_path = join(self.entries_dir, key, 'size')
+                with open(size_path) as f:
+                    entries.append((os.path.getmtime(size_path), int(f.read()), key))
+            except (IOError, OSError, ValueError):
+                pass
+        return entries
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in max_size."""
+        lock_file = self._lock(fcntl.LOCK_EX)
+        try:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            evicted = 0
+            for _, size, key in entries:
+                if total <= self.max_size:
+                    break
+                _remove_tree(join(self.entries_dir, key))
+                total -= size
+                evicted += 1
+        finally:
+            lock_file.close()
+        if evicted > 0:
+            self._count('evictions', evicted)
+
+    def _count(self, name, count=1):
+        lock_file = self._lock(fcntl.LOCK_EX)
+        try:
+            stats = self._read_stats()
+            stats[name] = stats.get(name, 0) + count
+            with open(self.stats_path, 'w') as f:
+                json.dump(stats, f)
+        finally:
+            lock_file.close()
+
+    def _read_stats(self):
+        try:
+            with open(self.stats_path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def get_stats(self):
+        """Returns the hit, miss and eviction counts and the size in bytes of the cache."""
+        stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        stats.update(self._read_stats())
+        entries = self._entries()
+        stats['entries'] = len(entries)
+        stats['size'] = sum(size for _, size, _ in entries)
+        return stats
+
+class WarmBundles(object):
+    """
+    The bundles shared by the runs of the phases a worker ran last (scoring program, reference
+    data, input data), kept staged and read-only in a directory of its own. A run of one of
+    those phases links them into its directory without any request to the storage service.
+
+    Entries are keyed by the name of the Blob holding the bundle and checked against its ETag
+    (and MD5 when available) before each run, so a bundle the organizer updated is staged again.
+    """
+
+    def __init__(self, root, max_phases):
+        """
+        root: Path of the directory holding the bundles, emptied when created.
+        max_phases: The number of phases whose bundles are kept, the least recently run
+            phases being dropped first.
+        """
+        self.root = os.path.abspath(root)
+        self.max_phases = max(1, max_phases)
+        # phase_id -> {bundle_id: (version, directory holding the staged bundle in 'tree')}
+        self.phases = OrderedDict()
+        self.lock = threading.Lock()
+        if os.path.exists(self.root):
+            _remove_tree(self.root)
+        os.makedirs(self.root)
+
+    def get_phase(self, phase_id, bundle_ids):
+        """
+        Returns the WarmPhase staging the given bundles of a phase, and marks the phase as the
+        most recently run.
+        """
+        with self.lock:
+            self.phases[phase_id] = self.phases.pop(phase_id, {})
+            evicted = []
+            while len(self.phases) > self.max_phases:
+                evicted.append(self.phases.popitem(last=False))
+        for old_phase_id, bundles in evicted:
+            logger.debug("Dropping the warm bundles of phase %s", old_phase_id)
+            for _, entry_dir in bundles.values():
+                _remove_tree(entry_dir)
+        return WarmPhase(self, phase_id, bundle_ids)
+
+    def stage(self, phase_id, blob_service, container, bundle_id, bundle_path, fill):
+        """
+        Links a bundle of a phase into bundle_path, staging it first if it is not warm or if
+        its Blob changed since it was staged.
+
+        blob_service: Azure BlobService to access the storage account holding the bundles.
+        container: Name of the Blob container holding the bundle.
+        bundle_id: Name of the Blob holding the bundle.
+        fill: The function invoked to download and extract the bundle: fill(path).
+
+        Returns True if the bundle was warm.
+        """
+        properties = blob_service.get_blob_properties(container, bundle_id)
+        version = BundleCache.get_key(container, bundle_id, properties)
+        with self.lock:
+            bundles = self.phases.setdefault(phase_id, {})
+            entry_version, entry_dir = bundles.get(bundle_id, (None, None))
+        hit = entry_dir is not None and entry_version == version
+        if entry_dir is not None and not hit:
+            logger.debug("Warm bundle %s changed (phase_id=%s)", bundle_id, phase_id)
+            _remove_tree(entry_dir)
+        if not hit:
+            entry_dir = tempfile.mkdtemp(dir=self.root)
+            try:
+                fill(join(entry_dir, 'tree'))
+                _make_read_only(join(entry_dir, 'tree'))
+            except:
+                _remove_tree(entry_dir)
+                raise
+            with self.lock:
+                bundles[bundle_id] = (version, entry_dir)
+        _link_tree(join(entry_dir, 'tree'), bundle_path)
+        logger.debug("Warm bundle %s for blob=%s (phase_id=%s)", "hit" if hit else "miss", bundle_id, phase_id)
+        return hit
+
+class WarmPhase(object):
+    """The bundles of a phase which a run stages from WarmBundles."""
+
+    def __init__(self, warm_bundles, phase_id, bundle_ids):
+        self.warm_bundles = warm_bundles
+        self.phase_id = phase_id
+        self.bundle_ids = set(bundle_ids)
+
+    def stage(self, blob_service, container, bundle_id, bundle_path, fill):
+        """Stages a bundle of the phase. See WarmBundles.stage."""
+        return self.warm_bundles.stage(self.phase_id, blob_service, container, bundle_id, bundle_path, fill)
+
+def _link_tree(src, dst):
+    """Hard-links the files of the directory src into dst, copying them across file systems."""
+    for dirpath, dirnames, filenames in os.walk(src):
+        target_dir = join(dst, os.path.relpath(dirpath, src))
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
+        # os.walk lists links to directories with the directories but does not follow them
+        filenames += [name for name in dirnames if os.path.islink(join(dirpath, name))]
+        for filename in filenames:
+            source = join(dirpath, filename)
+            target = join(target_dir, filename)
+            if os.path.lexists(target):
+                os.remove(target)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), target)
+                continue
+            try:
+                os.link(source, target)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.copy2(source, target)
+
+def _make_read_only(path):
+    """Removes the write permissions on the files under path and returns their total size."""
+    size = 0
+    write_bits = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            file_path = join(dirpath, filename)
+            if os.path.islink(file_path):
+                continue
+            mode = os.stat(file_path).st_mode
+            os.chmod(file_path, stat.S_IMODE(mode) & ~write_bits)
+            size += os.path.getsize(file_path)
+    return size
+
+def _remove_tree(path):
+    """Removes a directory tree holding read-only files."""
+    def make_writable(func, failed_path, exc_info):
+        os.chmod(os.path.dirname(failed_path), stat.S_IRWXU)
+        os.chmod(failed_path, stat.S_IRWXU)
+        func(failed_path)
+    shutil.rmtree(path, onerror=make_writable)
@@ -0,0 +1,182 @@
+"""
+Defines a writer of zip archives to streams which cannot seek, like the blocks of a Blob being
+uploaded. The sizes and CRC of each entry follow its data (in a data descriptor), so an entry
+is written as it is compressed and never needs to be held in memory or on disk.
+"""
+import os
+import struct
+import time
+import zlib
+
+# Size of the reads from the files added to the archives
+CHUNK_SIZE = 1024 * 1024
+
+_ZIP64_LIMIT = 0xFFFFFFFF
+_ZIP64_COUNT_LIMIT = 0xFFFF
+_DEFLATED = 8
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_DATA_DESCRIPTOR = struct.Struct("<4sLLL")
+_DATA_DESCRIPTOR64 = struct.Struct("<4sLQQ")
+_CENTRAL_DIRECTORY = struct.Struct("<4s4B4HL2L5H2L")
+_END_ARCHIVE = struct.Struct("<4s4H2LH")
+_END_ARCHIVE64 = struct.Struct("<4sQ2H2L4Q")
+_END_ARCHIVE64_LOCATOR = struct.Struct("<4sLQL")
+
+def _dos_date_time(timestamp):
+    """Returns the MS-DOS date and time of a timestamp, as stored by zip archives."""
+    t = time.localtime(timestamp)
+    if t.tm_year < 1980:
+        return (1 << 5) | 1, 0
+    date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return date, dos_time
+
+class _Entry(object):
+    def __init__(self, name, flags, date, dos_time, external_attr, header_offset):
+        self.name = name
+        self.flags = flags
+        self.date = date
+        self.time = dos_time
+        self.external_attr = external_attr
+        self.header_offset = header_offset
+        self.crc = 0
+        self.compress_size = 0
+        self.file_size = 0
+
+class ZipStreamWriter(object):
+    """
+    Writes a zip archive to a file-like object which only needs a write method. The data of
+    the entries is written already compressed (raw deflate), so it can be compressed once for
+    several archives.
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+        self.entries = []
+        self._entry = None
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def begin(self, name, timestamp, mode):
+        """
+        Starts an entry.
+
+        name: The name of the entry in the archive, with '/' separators.
+        timestamp: The modification time of the entry.
+        mode: The permission bits of the entry.
+        """
+        flags = _FLAG_DATA_DESCRIPTOR
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        try:
+            name.decode('ascii')
+        except UnicodeDecodeError:
+            flags |= _FLAG_UTF8
+        date, dos_time = _dos_date_time(timestamp)
+        self._entry = _Entry(name, flags, date, dos_time, (mode & 0xFFFF) << 16, self.offset)
+        # Sizes and CRC are written in the data descriptor
+        self._write(_LOCAL_HEADER.pack("PK\003\004", 20, 0, flags, _DEFLATED, dos_time, date, 0, 0, 0, len(name), 0))
+        self._write(name)
+
+    def write(self, data):
+        """Writes compressed data of the current entry."""
+        self._write(data)
+
+    def end(self, crc, compress_size, file_size):
+        """Ends the current entry, given the CRC and sizes of its data."""
+        entry = self._entry
+        entry.crc = crc
+        entry.compress_size = compress_size
+        entry.file_size = file_size
+        if compress_size > _ZIP64_LIMIT or file_size > _ZIP64_LIMIT:
+            self._write(_DATA_DESCRIPTOR64.pack("PK\007\010", crc, compress_size, file_size))
+        else:
+            self._write(_DATA_DESCRIPTOR.pack("PK\007\010", crc, compress_size, file_size))
+        self.entries.append(entry)
+        self._entry = None
+
+    def close(self):
+        """Writes the central directory, which ends the archive."""
+        directory_offset = self.offset
+        for entry in self.entries:
+            extra = []
+            file_size, compress_size, header_offset = entry.file_size, entry.compress_size, entry.header_offset
+            if file_size >= _ZIP64_LIMIT:
+                extra.append(file_size)
+                file_size = _ZIP64_LIMIT
+            if compress_size >= _ZIP64_LIMIT:
+                extra.append(compress_size)
+                compress_size = _ZIP64_LIMIT
+            if header_offset >= _ZIP64_LIMIT:
+                extra.append(header_offset)
+                header_offset = _ZIP64_LIMIT
+            extra_data = struct.pack("<HH%dQ" % len(extra), 1, 8 * len(extra), *extra) if extra else ''
+            version = 45 if extra else 20
+            # Created on Unix (3), so the permissions are kept on extraction
+            self._write(_CENTRAL_DIRECTORY.pack(
+                "PK\001\002", version, 3, version, 0, entry.flags, _DEFLATED, entry.time, entry.date,
+                entry.crc, compress_size, file_size, len(entry.name), len(extra_data), 0, 0, 0,
+                entry.external_attr, header_offset))
+            self._write(entry.name)
+            self._write(extra_data)
+        directory_size = self.offset - directory_offset
+        count = len(self.entries)
+        if count >= _ZIP64_COUNT_LIMIT or directory_size >= _ZIP64_LIMIT or directory_offset >= _ZIP64_LIMIT:
+            end64_offset = self.offset
+            self._write(_END_ARCHIVE64.pack("PK\006\006", _END_ARCHIVE64.size - 12, 45, 45, 0, 0,
+                                            count, count, directory_size, directory_offset))
+            self._write(_END_ARCHIVE64_LOCATOR.pack("PK\006\007", 0, end64_offset, 1))
+        self._write(_END_ARCHIVE.pack("PK\005\006", 0, 0, min(count, _ZIP64_COUNT_LIMIT),
+                                      min(count, _ZIP64_COUNT_LIMIT), min(directory_size, _ZIP64_LIMIT),
+                                      min(directory_offset, _ZIP64_LIMIT), 0))
+
+def write_tree(root, archives, level=zlib.Z_DEFAULT_COMPRESSION):
+    """
+    Adds the files under a directory to several archives in a single traversal. Each file is
+    read and compressed once, then written to every archive which includes it.
+
+    root: The directory to archive. Entries are named after the paths relative to it.
+    archives: A list of (writer, include) tuples: a ZipStreamWriter and a function telling
+        whether a relative path belongs to its archive.
+    level: The compression level, from 0 (none) to 9 (best).
+
+    Returns the relative paths of the files added to at least one archive, in order.
+    """
+    added = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if not os.path.isfile(path):
+                continue
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            writers = [writer for writer, include in archives if include(name)]
+            if not writers:
+                continue
+            st = os.stat(path)
+            for writer in writers:
+                writer.begin(name, st.st_mtime, st.st_mode)
+            crc = 0
+            file_size = compress_size = 0
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+            with open(path, 'rb') as f:
+                for data in iter(lambda: f.read(CHUNK_SIZE), ''):
+                    crc = zlib.crc32(data, crc)
+                    file_size += len(data)
+                    compressed = compressor.compress(data)
+                    if compressed:
+                        compress_size += len(compressed)
+                        for writer in writers:
+                            writer.write(compressed)
+            compressed = compressor.flush()
+            compress_size += len(compressed)
+            for writer in writers:
+                writer.write(compressed)
+                writer.end(crc & 0xFFFFFFFF, compress_size, file_size)
+            added.append(name)
+    return added
@@ -0,0 +1,305 @@
+"""
+Defines how the compute worker runs the programs of a submission and waits for them.
+"""
+import errno
+import logging
+import os
+import resource
+import signal
+import threading
+import time
+
+from subprocess import Popen
+
+logger = logging.getLogger('codalabtools')
+
+# Seconds between two measures of the disk space used by a program with a disk quota
+DISK_CHECK_INTERVAL = 5
+
+# Errors printed by programs failing to allocate memory, e.g. under RLIMIT_AS
+MEMORY_ERRORS = ('MemoryError', 'std::bad_alloc', 'java.lang.OutOfMemoryError', 'Cannot allocate memory')
+# Bytes at the end of the error output of a program searched for MEMORY_ERRORS
+MEMORY_ERROR_SCAN_SIZE = 64 * 1024
+
+class Limits(object):
+    """
+    The resources a program may use, each None for no limit.
+
+    memory: The memory in bytes.
+    cpus: The number of CPU cores.
+    processes: The number of processes.
+    disk: The disk space in bytes the program may add to its directory.
+    """
+    def __init__(self, memory=None, cpus=None, processes=None, disk=None):
+        self.memory = memory
+        self.cpus = cpus
+        self.processes = processes
+        self.disk = disk
+
+    def set_rlimits(self, limit_processes=True):
+        """
+        Applies the limits to the calling process, and to the processes it starts, with rlimits.
+        This is the fallback for programs which do not run in a cgroup, and it is approximate:
+
+        - RLIMIT_AS limits the virtual address space, which is often much larger than the
+          resident memory (e.g. JVMs, numpy, CUDA), so programs may fail below the memory
+          limit. supervise reports a program failing with a memory error as 'memory'.
+        - RLIMIT_NPROC counts all the processes of the real user, so the process limit only
+          applies when limit_processes is True, i.e. the program runs as a user of its own.
+        - The disk quota is not an rlimit (RLIMIT_FSIZE caps the size of each file): supervise
+          enforces it by watching the size of the directory of the program.
+        """
+        if self.memory is not None:
+            resource.setrlimit(resource.RLIMIT_AS, (self.memory, self.memory))
+        if self.processes is not None and limit_processes:
+            resource.setrlimit(resource.RLIMIT_NPROC, (self.processes, self.processes))
+
+
+class ProcessResult(object):
+    """
+    Describes how a supervised program ended.
+
+    exit_code: The exit code of the program, or minus the number of the signal which killed it.
+    limit_exceeded: The limit which made the program fail: 'time', 'memory', 'processes' or
+        'disk', or None. Exceeding the process limit is only detected in a cgroup, and the
+        memory limit outside of one only when the program reports a memory error.
+    timed_out: True if the program was killed for exceeding its time limit.
+    elapsed_time: The wall-clock time in seconds between the start and the end of the program.
+    user_time, system_time: The CPU time in seconds used by the program and the children it waited for.
+    max_rss: The peak resident set size in kilobytes of the program or of one of those children.
+    read_bytes, write_bytes: The bytes read from and written to storage by those processes.
+
+    When the program runs in a cgroup, the figures cover all of its processes instead.
+    """
+    def __init__(self, exit_code, limit_exceeded, elapsed_time, usage, cgroup_usage=None):
+        self.exit_code = exit_code
+        self.limit_exceeded = limit_exceeded
+        self.timed_out = limit_exceeded == 'time'
+        self.elapsed_time = elapsed_time
+        self.user_time = usage.ru_utime
+        self.system_time = usage.ru_stime
+        self.max_rss = usage.ru_maxrss
+        # Blocks of 512 bytes
+        self.read_bytes = usage.ru_inblock * 512
+        self.write_bytes = usage.ru_oublock * 512
+        if cgroup_usage:
+            self.__dict__.update(cgroup_usage)
+
+    def get_usage(self):
+        """Returns the resources used by the program as a dictionary."""
+        return {
+            'exit_code': self.exit_code,
+            'elapsed_time': self.elapsed_time,
+            'user_time': self.user_time,
+            'system_time': self.system_time,
+            'max_rss': self.max_rss,
+            'read_bytes': self.read_bytes,
+            'write_bytes': self.write_bytes,
+        }
+
+class CGroup(object):
+    """
+    A cgroup (v2) accounting for the processes of a program. The parent directory must be a
+    cgroup delegated to the worker, with the cpu, memory, io and pids controllers enabled for
+    its children.
+    """
+    def __init__(self, parent):
+        self.path = os.path.join(parent, 'codalab-%s-%s' % (os.getpid(), threading.current_thread().ident))
+        os.mkdir(self.path)
+
+    def set_limits(self, limits):
+        """Applies the memory, CPU and process limits to the processes of the cgroup."""
+        values = {}
+        if limits.memory is not None:
+            values['memory.max'] = limits.memory
+            values['memory.swap.max'] = 0
+        if limits.cpus is not None:
+            values['cpu.max'] = '%d 100000' % (limits.cpus * 100000)
+        if limits.processes is not None:
+            values['pids.max'] = limits.processes
+        for name, value in values.items():
+            try:
+                with open(os.path.join(self.path, name), 'w') as f:
+                    f.write(str(value))
+            except IOError:
+                logger.warning("Unable to set %s of cgroup %s: is its controller enabled?", name, self.path)
+
+    def get_limit_exceeded(self):
+        """Returns 'memory' or 'processes' when the processes of the cgroup hit that limit, else None."""
+        for name, key, limit in (('memory.events', 'oom_kill', 'memory'), ('pids.events', 'max', 'processes')):
+            events = self._read(name)
+            if events and int(dict(line.split() for line in events.splitlines()).get(key, 0)) > 0:
+                return limit
+        return None
+
+    def join(self):
+        """Moves the calling process into the cgroup."""
+        with open(os.path.join(self.path, 'cgroup.procs'), 'w') as f:
+            f.write('0')
+
+    def _read(self, name):
+        try:
+            with open(os.path.join(self.path, name)) as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def get_usage(self):
+        """Returns the usage recorded by the controllers of the cgroup which are available."""
+        usage = {}
+        cpu = self._read('cpu.stat')
+        if cpu:
+            stat = dict(line.split() for line in cpu.splitlines())
+            usage['user_time'] = int(stat['user_usec']) / 1e6
+            usage['system_time'] = int(stat['system_usec']) / 1e6
+        peak = self._read('memory.peak')
+        if peak:
+            usage['max_rss'] = int(peak) // 1024
+        io = self._read('io.stat')
+        if io is not None:
+            usage['read_bytes'] = usage['write_bytes'] = 0
+            for line in io.splitlines():
+                stat = dict(item.split('=') for item in line.split()[1:])
+                usage['read_bytes'] += int(stat.get('rbytes', 0))
+                usage['write_bytes'] += int(stat.get('wbytes', 0))
+        return usage
+
+    def remove(self):
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            logger.warning("Unable to remove cgroup %s", self.path)
+
+def _kill_group(pgid):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+def _get_tree_size(path):
+    """Returns the size in bytes of the files under path."""
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return size
+
+def _reports_memory_error(stream, offset):
+    """Returns True if the output written to stream from offset on reports a failed allocation."""
+    path = getattr(stream, 'name', None)
+    if not isinstance(path, basestring) or not os.path.isfile(path):
+        return False
+    stream.flush()
+    with open(path, 'rb') as f:
+        f.seek(max(offset, os.path.getsize(path) - MEMORY_ERROR_SCAN_SIZE))
+        output = f.read()
+    return any(error in output for error in MEMORY_ERRORS)
+
+def supervise(args, time_limit=None, preexec_fn=None, cgroup_root=None, limits=None, disk_path=None, **kwargs):
+    """
+    Runs a program in its own process group and waits for it to exit. When the time limit or the
+    disk quota is exceeded the whole process group is killed. Processes the program leaves behind
+    in its group are killed once it exits.
+
+    The wait blocks on the exit of the program, with no polling and no signal handler, so
+    several programs can be supervised at once from different threads.
+
+    args: The command line of the program.
+    time_limit: The number of seconds the program may run, None for no limit.
+    preexec_fn: An optional function to run in the process of the program before it starts.
+    cgroup_root: An optional cgroup (v2) directory delegated to the worker. The program then runs
+        in a cgroup of its own, which accounts for all of its processes.
+    limits: Optional Limits of the program. The memory, CPU and process limits are applied to its
+        cgroup: without one, preexec_fn should apply them with Limits.set_rlimits.
+    disk_path: The directory the disk quota of limits applies to. Its size is checked every
+        DISK_CHECK_INTERVAL seconds and when the program exits.
+    kwargs: Other arguments for subprocess.Popen.
+
+    Returns a ProcessResult.
+    """
+    limits = limits or Limits()
+    cgroup = CGroup(cgroup_root) if cgroup_root is not None else None
+    if cgroup is not None:
+        cgroup.set_limits(limits)
+    watch_disk = limits.disk is not None and disk_path is not None
+    initial_disk_size = _get_tree_size(disk_path) if watch_disk else 0
+    stderr = kwargs.get('stderr')
+    stderr_offset = stderr.tell() if hasattr(stderr, 'tell') else 0
+
+    def preexec():
+        os.setsid()
+        if cgroup is not None:
+            cgroup.join()
+        if preexec_fn is not None:
+            preexec_fn()
+
+    start = time.time()
+    try:
+        process = Popen(args, preexec_fn=preexec, **kwargs)
+    except:
+        if cgroup is not None:
+            cgroup.remove()
+        raise
+    logger.debug("Started process, pid=%s", process.pid)
+
+    exceeded = []
+    def kill(limit):
+        exceeded.append(limit)
+        logger.info("Killing process group %s for exceeding its %s limit.", process.pid, limit)
+        _kill_group(process.pid)
+
+    exited = threading.Event()
+    def watch():
+        while not exited.wait(DISK_CHECK_INTERVAL):
+            if _get_tree_size(disk_path) - initial_disk_size > limits.disk:
+                kill('disk')
+                return
+
+    timer = None
+    if time_limit is not None:
+        timer = threading.Timer(max(time_limit, 0), kill, args=('time',))
+        timer.daemon = True
+        timer.start()
+    if watch_disk:
+        watcher = threading.Thread(target=watch)
+        watcher.daemon = True
+        watcher.start()
+    try:
+        while True:
+            try:
+                _, status, usage = os.wait4(process.pid, 0)
+                break
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+    finally:
+        exited.set()
+        if timer is not None:
+            timer.cancel()
+    elapsed_time = time.time() - start
+    _kill_group(process.pid)
+
+    if os.WIFSIGNALED(status):
+        exit_code = -os.WTERMSIG(status)
+    else:
+        exit_code = os.WEXITSTATUS(status)
+    # The process was reaped here: let Popen know so it does not wait for it
+    process.returncode = exit_code
+
+    limit_exceeded = exceeded[0] if exceeded else None
+    if limit_exceeded is None and cgroup is not None and exit_code != 0:
+        limit_exceeded = cgroup.get_limit_exceeded()
+    if limit_exceeded is None and watch_disk and _get_tree_size(disk_path) - initial_disk_size > limits.disk:
+        limit_exceeded = 'disk'
+    if (limit_exceeded is None and cgroup is None and limits.memory is not None and exit_code != 0
+            and _reports_memory_error(stderr, stderr_offset)):
+        limit_exceeded = 'memory'
+    cgroup_usage = None
+    if cgroup is not None:
+        cgroup_usage = cgroup.get_usage()
+        cgroup.remove()
+    return ProcessResult(exit_code, limit_exceeded, elapsed_time, usage, cgroup_usage)
@@ -1,10 +1,27 @@
 """
 Defines unit tests for this package.
 """
+import base64
+import hashlib
+import io
+import json
 import os
+import resource
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
 from unittest import TestCase
 
-from codalabtools.compute.worker import WorkerConfig
+import azure
+
+from codalabtools.compute.bundle_cache import BundleCache, WarmBundles
+from codalabtools.compute.supervisor import CGroup, Limits, supervise
+from codalabtools.compute import worker
+from codalabtools.compute.worker import Slot, WorkerConfig, getBundle
 
 class ComputeConfigTests(TestCase):
     """Tests for WorkerConfig."""
@@ -57,3 +74,558 @@ class ComputeConfigTests(TestCase):
             }
         }
         self.assertDictEqual(log_cfg_expected, cfg.getLoggerDictConfig())
+
+
+class MemoryBlobService(object):
+    """A BlobService holding its blobs in memory."""
+    def __init__(self):
+        self.blobs = {}
+        self.blocks = {}
+        self.committed = {}
+        self.downloads = []
+
+    def put(self, name, files):
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w') as z:
+            for file_name, content in files.items():
+                z.writestr(file_name, content)
+        self.blobs[name] = (data.getvalue(), str(len(self.blobs)))
+
+    def put_tar(self, name, files):
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode='w:gz') as tar:
+            for file_name, content in files.items():
+                info = tarfile.TarInfo(file_name)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        self.blobs[name] = (data.getvalue(), str(len(self.blobs)))
+
+    def put_blob(self, container, name, blob, x_ms_blob_type, x_ms_blob_content_type=None, content_md5=None):
+        assert content_md5 == base64.b64encode(hashlib.md5(blob).digest())
+        self.blobs[name] = (blob, str(len(self.blobs)))
+
+    def put_block(self, container, name, block, block_id, content_md5=None):
+        assert content_md5 == base64.b64encode(hashlib.md5(block).digest())
+        self.blocks[(name, block_id)] = block
+
+    def put_block_list(self, container, name, block_ids, x_ms_blob_content_type=None, x_ms_blob_content_md5=None):
+        # Uncommitted blocks first, then the blocks of the current blob
+        committed = self.committed.get(name, {})
+        blocks = [self.blocks.pop((name, block_id)) if (name, block_id) in self.blocks else committed[block_id]
+                  for block_id in block_ids]
+        blob = ''.join(blocks)
+        if x_ms_blob_content_md5 is not None:
+            assert x_ms_blob_content_md5 == base64.b64encode(hashlib.md5(blob).digest())
+        self.committed[name] = dict(zip(block_ids, blocks))
+        self.blobs[name] = (blob, str(len(self.blobs)))
+
+    def get_blob_properties(self, container, name):
+        if name not in self.blobs:
+            raise azure.WindowsAzureMissingResourceError("Not found")
+        return {'etag': self.blobs[name][1], 'content-length': str(len(self.blobs[name][0]))}
+
+    def get_blob(self, container, name, x_ms_range=None):
+        if name not in self.blobs:
+            raise azure.WindowsAzureMissingResourceError("Not found")
+        data = self.blobs[name][0]
+        if x_ms_range is None:
+            self.downloads.append(name)
+            return data
+        start, end = [int(bound) for bound in x_ms_range[len('bytes='):].split('-')]
+        self.downloads.append((name, start))
+        return data[start:end + 1]
+
+class BundleCacheTests(TestCase):
+    """Tests for BundleCache."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.blob_service = MemoryBlobService()
+        self.blob_service.put('run.zip', {'metadata': 'program: program.zip\ninput: input.zip\n'})
+        self.blob_service.put('program.zip', {'metadata': 'command: python score.py\n', 'score.py': 'print 1'})
+        self.cache = BundleCache(os.path.join(self.root, 'cache'), 1024 * 1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _stage(self, name):
+        run_dir = tempfile.mkdtemp(dir=self.root)
+        return run_dir, getBundle(run_dir, self.blob_service, 'bundles', name, 'run', cache=self.cache)
+
+    def test_bundles_are_downloaded_once(self):
+        first_dir, bundles = self._stage('run.zip')
+        self.assertIsNone(bundles[os.path.join('run', 'input')])
+        self.assertEqual({'command': 'python score.py'}, bundles[os.path.join('run', 'program')])
+        second_dir, bundles = self._stage('run.zip')
+
+        self.assertEqual(['run.zip', 'program.zip'], self.blob_service.downloads)
+        first = os.stat(os.path.join(first_dir, 'run', 'program', 'score.py'))
+        second = os.stat(os.path.join(second_dir, 'run', 'program', 'score.py'))
+        self.assertEqual(first.st_ino, second.st_ino)
+        stats = self.cache.get_stats()
+        self.assertEqual((2, 2, 2), (stats['hits'], stats['misses'], stats['entries']))
+
+    def test_updated_blob_is_downloaded_again(self):
+        self._stage('run.zip')
+        self.blob_service.put('program.zip', {'metadata': 'command: python new.py\n'})
+        run_dir, bundles = self._stage('run.zip')
+        self.assertEqual({'command': 'python new.py'}, bundles[os.path.join('run', 'program')])
+        self.assertEqual(['run.zip', 'program.zip', 'program.zip'], self.blob_service.downloads)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.blob_service.put('a.zip', {'data': 'a' * 600})
+        self.blob_service.put('b.zip', {'data': 'b' * 600})
+        self.cache.max_size = 1000
+        self._stage('a.zip')
+        run_dir, _ = self._stage('b.zip')
+        self._stage('a.zip')
+
+        self.assertEqual(['a.zip', 'b.zip', 'a.zip'], self.blob_service.downloads)
+        self.assertEqual(2, self.cache.get_stats()['evictions'])
+        # Files of evicted entries are still available to the runs using them
+        with open(os.path.join(run_dir, 'run', 'data')) as f:
+            self.assertEqual('b' * 600, f.read())
+
+class WarmBundlesTests(TestCase):
+    """Tests for the bundles of the phases kept warm by a worker."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.blob_service = MemoryBlobService()
+        self.blob_service.put('run1.zip', {'metadata': 'program: program.zip\ninput: input1.zip\n'})
+        self.blob_service.put('run2.zip', {'metadata': 'program: program.zip\ninput: input2.zip\n'})
+        self.blob_service.put('program.zip', {'metadata': 'command: python score.py\n', 'score.py': 'print 1'})
+        self.blob_service.put('input1.zip', {'answer.txt': '1'})
+        self.blob_service.put('input2.zip', {'answer.txt': '2'})
+        self.warm = WarmBundles(os.path.join(self.root, 'warm'), 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _stage(self, name, phase_id=1):
+        run_dir = tempfile.mkdtemp(dir=self.root)
+        warm = self.warm.get_phase(phase_id, ['program.zip'])
+        return run_dir, getBundle(run_dir, self.blob_service, 'bundles', name, 'run', warm=warm)
+
+    def test_phase_bundles_are_staged_once(self):
+        first_dir, _ = self._stage('run1.zip')
+        second_dir, bundles = self._stage('run2.zip')
+
+        self.assertEqual({'command': 'python score.py'}, bundles[os.path.join('run', 'program')])
+        self.assertEqual(['input1.zip', 'input2.zip', 'program.zip', 'run1.zip', 'run2.zip'],
+                         sorted(self.blob_service.downloads))
+        with open(os.path.join(second_dir, 'run', 'input', 'answer.txt')) as f:
+            self.assertEqual('2', f.read())
+        first = os.stat(os.path.join(first_dir, 'run', 'program', 'score.py'))
+        second = os.stat(os.path.join(second_dir, 'run', 'program', 'score.py'))
+        self.assertEqual(first.st_ino, second.st_ino)
+
+    def test_updated_phase_bundle_is_staged_again(self):
+        self._stage('run1.zip')
+        self.blob_service.put('program.zip', {'metadata': 'command: python score2.py\n'})
+        _, bundles = self._stage('run2.zip')
+
+        self.assertEqual({'command': 'python score2.py'}, bundles[os.path.join('run', 'program')])
+        self.assertEqual(2, self.blob_service.downloads.count('program.zip'))
+        self.assertEqual(1, len(os.listdir(self.warm.root)))
+
+    def test_bundles_of_the_least_recently_run_phase_are_dropped(self):
+        self._stage('run1.zip', phase_id=1)
+        self._stage('run2.zip', phase_id=2)
+        self.assertEqual([2], list(self.warm.phases))
+        self.assertEqual(1, len(os.listdir(self.warm.root)))
+        self._stage('run1.zip', phase_id=1)
+        self.assertEqual(3, self.blob_service.downloads.count('program.zip'))
+
+
+class GetBundleTests(TestCase):
+    """Tests for getBundle."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.blob_service = MemoryBlobService()
+        self.blob_service.put('run.zip', {'metadata': 'program: program.zip\ninput: input.zip\n'})
+        self.blob_service.put('program.zip', {'metadata': 'command: python score.py\nref: ref.zip\n'})
+        self.blob_service.put('input.zip', {'res/answer.txt': '42'})
+        self.blob_service.put('ref.zip', {'truth.txt': '0123456789' * 100})
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_referenced_bundles_are_staged(self):
+        bundles = getBundle(self.root, self.blob_service, 'bundles', 'run.zip', 'run')
+        self.assertEqual(set(['run', 'run/program', 'run/input', 'run/program/ref']), set(bundles.keys()))
+        with open(os.path.join(self.root, 'run', 'input', 'res', 'answer.txt')) as f:
+            self.assertEqual('42', f.read())
+        self.assertEqual('run.zip', self.blob_service.downloads[0])
+        self.assertEqual('ref.zip', self.blob_service.downloads[-1])
+
+    def test_large_bundles_are_downloaded_in_ranges(self):
+        threshold, size = worker.RANGE_THRESHOLD, worker.RANGE_SIZE
+        worker.RANGE_THRESHOLD, worker.RANGE_SIZE = 100, 64
+        try:
+            getBundle(self.root, self.blob_service, 'bundles', 'ref.zip', 'ref')
+        finally:
+            worker.RANGE_THRESHOLD, worker.RANGE_SIZE = threshold, size
+        self.assertTrue(len(self.blob_service.downloads) > 1)
+        with open(os.path.join(self.root, 'ref', 'truth.txt')) as f:
+            self.assertEqual('0123456789' * 100, f.read())
+
+    def test_bundles_are_downloaded_in_chunks(self):
+        size = worker.RANGE_SIZE
+        worker.RANGE_SIZE = 64
+        try:
+            getBundle(self.root, self.blob_service, 'bundles', 'ref.zip', 'ref', max_workers=1)
+        finally:
+            worker.RANGE_SIZE = size
+        self.assertNotIn('ref.zip', self.blob_service.downloads)
+        with open(os.path.join(self.root, 'ref', 'truth.txt')) as f:
+            self.assertEqual('0123456789' * 100, f.read())
+
+    def test_tar_bundles_are_extracted_while_downloading(self):
+        self.blob_service.put_tar('data.tar.gz', {'a/b.txt': 'x' * 5000, '../escape.txt': 'no'})
+        size = worker.RANGE_SIZE
+        worker.RANGE_SIZE = 64
+        try:
+            bundles = getBundle(self.root, self.blob_service, 'bundles', 'data.tar.gz', 'data')
+        finally:
+            worker.RANGE_SIZE = size
+        self.assertIsNone(bundles['data'])
+        self.assertTrue(all(isinstance(download, tuple) for download in self.blob_service.downloads))
+        with open(os.path.join(self.root, 'data', 'a', 'b.txt')) as f:
+            self.assertEqual('x' * 5000, f.read())
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'escape.txt')))
+
+    def test_current_user_is_written_to_the_shared_coopetition_bundle(self):
+        self.blob_service.put('run.zip', {'metadata': 'program: program.zip\ninput: input.txt\n'})
+        self.blob_service.blobs['input.txt'] = ('coopetition: coopetition.zip\ncurrent-user: "J\\u00f6rg"\n', 'input')
+        self.blob_service.put('coopetition.zip', {'submissions.csv': 'id\n1\n', 'current_user.txt': 'stale'})
+        cache = BundleCache(os.path.join(self.root, 'cache'), 1024 * 1024)
+        for name in ('a', 'b'):
+            os.mkdir(os.path.join(self.root, name))
+            bundles = getBundle(os.path.join(self.root, name), self.blob_service, 'bundles', 'run.zip', 'run', cache=cache)
+            worker._write_current_user(os.path.join(self.root, name), bundles)
+        for name in ('a', 'b'):
+            with open(os.path.join(self.root, name, 'run', 'input', 'coopetition', 'current_user.txt')) as f:
+                self.assertEqual(u'J\u00f6rg'.encode('utf-8'), f.read())
+        # The cached copy of the bundle is left as it was downloaded
+        self.assertEqual(1, self.blob_service.downloads.count('coopetition.zip'))
+        cached = [os.path.join(dirpath, 'current_user.txt') for dirpath, _, filenames in os.walk(cache.root)
+                  if 'current_user.txt' in filenames]
+        self.assertEqual(1, len(cached))
+        with open(cached[0]) as f:
+            self.assertEqual('stale', f.read())
+
+
+class UploadTests(TestCase):
+    """Tests for the upload of run outputs."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.blob_service = MemoryBlobService()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _file(self, name, content):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_large_files_are_uploaded_in_blocks(self):
+        content = os.urandom(1000)
+        small = self._file('stdout.txt', 'done')
+        large = self._file('output.zip', content)
+        block_size = worker.BLOCK_SIZE
+        worker.BLOCK_SIZE = 64
+        try:
+            worker._upload_all(self.blob_service, 'bundles', [('run/stdout.txt', small, None),
+                                                              ('run/output.zip', large, None)])
+        finally:
+            worker.BLOCK_SIZE = block_size
+        self.assertEqual('done', self.blob_service.blobs['run/stdout.txt'][0])
+        self.assertEqual(content, self.blob_service.blobs['run/output.zip'][0])
+        self.assertEqual({}, self.blob_service.blocks)
+
+
+class StreamArchiveTests(TestCase):
+    """Tests for the archives of run outputs streamed to Blob storage."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.blob_service = MemoryBlobService()
+        self.files = {
+            'scores.txt': 'score: 1.0\n',
+            'html/report.html': '<html></html>',
+            'private/answers.txt': os.urandom(5000),
+            'data.bin': os.urandom(3000) * 4,
+        }
+        for name, content in self.files.items():
+            path = os.path.join(self.root, 'output', name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _archive(self, blob_id):
+        return zipfile.ZipFile(io.BytesIO(self.blob_service.blobs[blob_id][0]))
+
+    def test_public_and_private_archives_are_written_in_one_pass(self):
+        block_size = worker.BLOCK_SIZE
+        worker.BLOCK_SIZE = 1024
+        try:
+            names = worker._stream_archives(self.blob_service, 'bundles', os.path.join(self.root, 'output'),
+                                            [('run/output.zip', worker._is_public_output),
+                                             ('run/private_output.zip', None)], level=9)
+        finally:
+            worker.BLOCK_SIZE = block_size
+        self.assertEqual(sorted(self.files), sorted(names))
+        public = self._archive('run/output.zip')
+        self.assertIsNone(public.testzip())
+        self.assertEqual(sorted(name for name in self.files if not name.startswith('private/')),
+                         sorted(public.namelist()))
+        self.assertEqual(self.files['data.bin'], public.read('data.bin'))
+        private = self._archive('run/private_output.zip')
+        self.assertEqual(sorted(self.files), sorted(private.namelist()))
+        self.assertEqual(self.files['private/answers.txt'], private.read('private/answers.txt'))
+        self.assertEqual({}, self.blob_service.blocks)
+
+    def test_archive_of_an_empty_folder_is_valid(self):
+        os.mkdir(os.path.join(self.root, 'empty'))
+        worker._stream_archives(self.blob_service, 'bundles', os.path.join(self.root, 'empty'),
+                                [('run/output.zip', None)], level=0)
+        self.assertEqual([], self._archive('run/output.zip').namelist())
+
+
+class LogStreamerTests(TestCase):
+    """Tests for the upload of the output of running programs."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.blob_service = MemoryBlobService()
+        self.stdout = os.path.join(self.root, 'stdout.txt')
+        self.stderr = os.path.join(self.root, 'stderr.txt')
+        for path in (self.stdout, self.stderr):
+            open(path, 'w').close()
+        self.streamer = worker.LogStreamer(self.blob_service, 'bundles',
+                                           [('run/stdout.txt', self.stdout), ('run/stderr.txt', self.stderr)], 60)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _append(self, path, content):
+        with open(path, 'a') as f:
+            f.write(content)
+
+    def test_appended_output_is_committed_after_the_previous_blocks(self):
+        self._append(self.stdout, 'line 1\n')
+        self.streamer.sync()
+        self.assertEqual('line 1\n', self.blob_service.blobs['run/stdout.txt'][0])
+        self.assertNotIn('run/stderr.txt', self.blob_service.blobs)
+
+        self._append(self.stdout, 'line 2\n')
+        self.streamer.sync()
+        self.streamer.sync()
+        self.assertEqual('line 1\nline 2\n', self.blob_service.blobs['run/stdout.txt'][0])
+        self.assertEqual(2, len(self.blob_service.committed['run/stdout.txt']))
+
+    def test_files_left_to_upload_are_returned_on_close(self):
+        self.streamer.start()
+        self._append(self.stdout, 'done\n')
+        # stderr is empty: it is uploaded with the other output files
+        self.assertEqual([('run/stderr.txt', self.stderr)], self.streamer.close())
+        self.assertEqual('done\n', self.blob_service.blobs['run/stdout.txt'][0])
+
+    def test_streaming_stops_when_a_blob_has_too_many_blocks(self):
+        max_blocks = worker.MAX_BLOCKS
+        worker.MAX_BLOCKS = 1
+        try:
+            self._append(self.stdout, 'line 1\n')
+            self.streamer.sync()
+            self._append(self.stdout, 'line 2\n')
+            self.assertEqual([('run/stdout.txt', self.stdout), ('run/stderr.txt', self.stderr)], self.streamer.close())
+        finally:
+            worker.MAX_BLOCKS = max_blocks
+
+
+class SlotTests(TestCase):
+    """Tests for the slots of a compute worker."""
+
+    def test_single_slot_uses_the_local_root(self):
+        slot = Slot(0, 1, '/tmp/codalab')
+        self.assertEqual('/tmp/codalab', slot.root)
+        self.assertIsNone(slot.cpus)
+
+    def test_slots_have_their_own_directory_and_cpus(self):
+        slots = [Slot(index, 2, '/tmp/codalab') for index in range(2)]
+        self.assertEqual(['/tmp/codalab/slot-0', '/tmp/codalab/slot-1'], [slot.root for slot in slots])
+        self.assertTrue(all(slot.cpus for slot in slots))
+
+    def test_memory_budget_applies_to_programs(self):
+        limit = 2 * 1024 * 1024 * 1024
+        slot = Slot(0, 1, '/tmp/codalab', memory_limit=limit)
+        output = subprocess.check_output(
+            [sys.executable, '-c', 'import resource; print(resource.getrlimit(resource.RLIMIT_AS)[0])'],
+            preexec_fn=slot.preexec())
+        self.assertEqual(limit, int(output))
+        self.assertNotEqual(limit, resource.getrlimit(resource.RLIMIT_AS)[0])
+
+    def test_limits_of_a_phase_stay_within_the_slot(self):
+        slot = Slot(0, 1, '/tmp/codalab', memory_limit=1024)
+        limits = slot.get_limits(Limits(memory=4096, cpus=1, processes=10))
+        self.assertEqual(1024, limits.memory)
+        self.assertEqual(1, limits.cpus)
+        self.assertEqual(10, limits.processes)
+        self.assertEqual(512, slot.get_limits(Limits(memory=512)).memory)
+
+    def _get_program_limits(self, slot, **kwargs):
+        script = 'import resource, psutil; print(resource.getrlimit(resource.RLIMIT_FSIZE)[0], ' \
+                 'resource.getrlimit(resource.RLIMIT_NPROC)[0], len(psutil.Process().cpu_affinity()))'
+        limits = Limits(cpus=1, processes=50, disk=1024 * 1024)
+        output = subprocess.check_output([sys.executable, '-c', script], preexec_fn=slot.preexec(limits=limits, **kwargs))
+        return eval(output)
+
+    def test_limits_of_a_phase_apply_to_programs(self):
+        fsize, nproc, cpus = self._get_program_limits(Slot(0, 1, '/tmp/codalab'), own_user=True)
+        # The disk quota is enforced by supervise, not with an rlimit capping each file
+        self.assertEqual(resource.getrlimit(resource.RLIMIT_FSIZE)[0], fsize)
+        self.assertEqual(50, nproc)
+        self.assertEqual(1, cpus)
+
+    def test_process_limit_needs_a_user_per_slot(self):
+        nproc = resource.getrlimit(resource.RLIMIT_NPROC)[0]
+        shared = Slot(0, 2, '/tmp/codalab')
+        self.assertEqual(nproc, self._get_program_limits(shared, own_user=True)[1])
+        own = Slot(1, 2, '/tmp/codalab', users=['workeruser1', 'workeruser2'])
+        self.assertEqual('workeruser2', own.user)
+        self.assertEqual(50, self._get_program_limits(own, own_user=True)[1])
+        # Programs left running as the user of the worker
+        self.assertEqual(nproc, self._get_program_limits(own)[1])
+
+    def test_programs_in_a_cgroup_have_no_rlimits(self):
+        slot = Slot(0, 1, '/tmp/codalab', memory_limit=1024 * 1024 * 1024)
+        output = subprocess.check_output(
+            [sys.executable, '-c', 'import resource; print(resource.getrlimit(resource.RLIMIT_AS)[0])'],
+            preexec_fn=slot.preexec(rlimits=False))
+        self.assertEqual(resource.getrlimit(resource.RLIMIT_AS)[0], int(output))
+
+
+class SuperviseTests(TestCase):
+    """Tests for the supervision of the programs of a run."""
+
+    def test_exit_is_reported_without_delay(self):
+        start = time.time()
+        result = supervise([sys.executable, '-c', 'import sys; sys.exit(3)'], time_limit=30)
+        self.assertEqual(3, result.exit_code)
+        self.assertFalse(result.timed_out)
+        self.assertTrue(time.time() - start < 1)
+        self.assertTrue(result.user_time + result.system_time > 0)
+
+    def test_process_group_is_killed_on_timeout(self):
+        root = tempfile.mkdtemp()
+        try:
+            marker = os.path.join(root, 'marker')
+            # The child of the program would create the marker after the time limit
+            script = 'import subprocess, sys, time; subprocess.Popen([sys.executable, "-c", ' \
+                     '"import time; time.sleep(1); open(%r, \'w\')"]); time.sleep(30)' % marker
+            result = supervise([sys.executable, '-c', script], time_limit=0.5)
+            self.assertTrue(result.timed_out)
+            self.assertEqual(-9, result.exit_code)
+            self.assertTrue(result.elapsed_time < 5)
+            time.sleep(1)
+            self.assertFalse(os.path.exists(marker))
+        finally:
+            shutil.rmtree(root)
+
+    def test_usage_of_the_program_is_reported(self):
+        script = 'open("/dev/null", "w").write("x"); bytearray(64 * 1024 * 1024)'
+        result = supervise([sys.executable, '-c', script])
+        self.assertEqual(0, result.exit_code)
+        # At least the 64MB buffer, in kB
+        self.assertTrue(result.max_rss >= 64 * 1024)
+        usage = result.get_usage()
+        self.assertEqual(set(['exit_code', 'elapsed_time', 'user_time', 'system_time', 'max_rss',
+                              'read_bytes', 'write_bytes']), set(usage))
+
+    def test_cgroup_usage_is_read_from_its_controllers(self):
+        root = tempfile.mkdtemp()
+        try:
+            cgroup = CGroup(root)
+            files = {
+                'cpu.stat': 'usage_usec 3500000\nuser_usec 2500000\nsystem_usec 1000000\n',
+                'memory.peak': '104857600\n',
+                'io.stat': '8:0 rbytes=4096 wbytes=1024 rios=1 wios=1\n8:16 rbytes=4096 wbytes=0\n',
+            }
+            for name, content in files.items():
+                with open(os.path.join(cgroup.path, name), 'w') as f:
+                    f.write(content)
+            self.assertEqual({'user_time': 2.5, 'system_time': 1.0, 'max_rss': 102400,
+                              'read_bytes': 8192, 'write_bytes': 1024}, cgroup.get_usage())
+            for name in files:
+                os.remove(os.path.join(cgroup.path, name))
+            cgroup.remove()
+            self.assertEqual([], os.listdir(root))
+        finally:
+            shutil.rmtree(root)
+
+    def test_usage_of_the_commands_of_a_run_is_summed_up(self):
+        usages = [
+            {'exit_code': 0, 'elapsed_time': 1.5, 'user_time': 1.0, 'system_time': 0.25, 'max_rss': 2048,
+             'read_bytes': 100, 'write_bytes': 10},
+            {'exit_code': 0, 'elapsed_time': 2.0, 'user_time': 1.5, 'system_time': 0.5, 'max_rss': 1024,
+             'read_bytes': 200, 'write_bytes': 20},
+        ]
+        metadata = worker._summarize_usage(usages)
+        self.assertEqual(3.5, metadata['elapsed_time'])
+        self.assertEqual(2.5, metadata['cpu_user_time'])
+        self.assertEqual(0.75, metadata['cpu_system_time'])
+        self.assertEqual(2048 * 1024, metadata['peak_memory'])
+        self.assertEqual(300, metadata['io_read_bytes'])
+        self.assertEqual(30, metadata['io_write_bytes'])
+        self.assertEqual(usages, json.loads(metadata['command_usage']))
+
+    def test_disk_quota_is_reported(self):
+        root = tempfile.mkdtemp()
+        try:
+            # Many files, each below the quota
+            script = 'for i in range(16): open("data-%d" % i, "w").write("x" * 16 * 1024)'
+            limits = Limits(disk=64 * 1024)
+            result = supervise([sys.executable, '-c', script], preexec_fn=limits.set_rlimits, limits=limits,
+                               disk_path=root, cwd=root)
+            self.assertEqual('disk', result.limit_exceeded)
+            self.assertFalse(result.timed_out)
+        finally:
+            shutil.rmtree(root)
+
+    def test_memory_errors_are_reported_without_cgroup(self):
+        root = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(root, 'stderr.txt'), 'a+') as stderr:
+                stderr.write('MemoryError in an earlier program\n')
+                script = 'import sys; sys.exit(1)'
+                result = supervise([sys.executable, '-c', script], limits=Limits(memory=1024 * 1024 * 1024),
+                                   stderr=stderr)
+                self.assertIsNone(result.limit_exceeded)
+                script = 'raise MemoryError()'
+                result = supervise([sys.executable, '-c', script], limits=Limits(memory=1024 * 1024 * 1024),
+                                   stderr=stderr)
+                self.assertEqual('memory', result.limit_exceeded)
+        finally:
+            shutil.rmtree(root)
+
+    def test_files_within_the_disk_quota_are_accepted(self):
+        root = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(root, 'input'), 'w') as f:
+                f.write('x' * 128 * 1024)
+            script = 'open("data", "w").write("x" * 1024)'
+            result = supervise([sys.executable, '-c', script], limits=Limits(disk=64 * 1024),
+                               disk_path=root, cwd=root)
+            self.assertEqual(0, result.exit_code)
+            self.assertIsNone(result.limit_exceeded)
+        finally:
+            shutil.rmtree(root)
@@ -3,6 +3,8 @@
 Defines the worker process which handles computations.
 """
 import azure
+import base64
+import hashlib
 import json
 import datetime
 import logging
@@ -12,18 +14,22 @@ import platform
 import psutil
 import pwd
 import grp
-import signal
-import math
+import resource
 import select
 import shutil
 import socket
 import subprocess
 import sys
+import tarfile
 import tempfile
+import threading
 import time
 import traceback
 import yaml
 
+from collections import OrderedDict
+from contextlib import closing
+from multiprocessing.pool import ThreadPool
 from os.path import dirname, abspath, join
 from subprocess import Popen, PIPE, call
 from zipfile import ZipFile
@@ -35,6 +41,10 @@ sys.path.append(dirname(dirname(dirname(abspath(__file__)))))
 from azure.storage import BlobService
 from codalabtools import BaseWorker, BaseConfig
 from codalabtools.azure_extensions import AzureServiceBusQueue
+from codalabtools.compute.bundle_cache import BundleCache, WarmBundles
+from codalabtools.compute.stream_zip import ZipStreamWriter, write_tree
+from codalabtools.compute.supervisor import Limits, supervise
+from codalabtools.local_queue import SQLiteQueue
 
 logger = logging.getLogger('codalabtools')
 
@@ -77,13 +87,230 @@ class WorkerConfig(BaseConfig):
         """Gets the name of the Azure Service Bus queue to listen to."""
         return self._winfo['azure-service-bus']['listen-to']
 
+    def getLocalQueuePath(self):
+        """Gets the path of the SQLite queue database or None if the Azure Service Bus is used."""
+        return self._winfo['local-queue']['path'] if 'local-queue' in self._winfo else None
+
+    def getQueueName(self):
+        """Gets the name of the queue to listen to."""
+        if self.getLocalQueuePath() is not None:
+            return self._winfo['local-queue']['listen-to']
+        return self.getAzureServiceBusQueue()
+
+    def getQueue(self, name, peek_lock=False):
+        """Creates the Queue with the given name, in the local queue database when one is configured."""
+        path = self.getLocalQueuePath()
+        if path is not None:
+            return SQLiteQueue(path, name, peek_lock=peek_lock)
+        return AzureServiceBusQueue(self.getAzureServiceBusNamespace(),
+                                    self.getAzureServiceBusKey(),
+                                    self.getAzureServiceBusIssuer(),
+                                    name,
+                                    peek_lock=peek_lock)
+
+    def usePeekLock(self):
+        """True to lock the run messages until their run is done rather than delete them when they are received."""
+        return self._winfo.get('peek-lock', True)
+
+    def getLockRenewalInterval(self):
+        """Gets the number of seconds between two renewals of the lock on the message of a run."""
+        return self._winfo.get('lock-renewal-interval', 30)
+
+    def getMaxDeliveryCount(self):
+        """Gets the number of times a run is attempted before it is reported as failed."""
+        return self._winfo.get('max-delivery-count', 3)
+
+    def getDownloadThreads(self):
+        """Gets the number of bundles downloaded at once, and of ranged requests downloading a large bundle."""
+        return self._winfo.get('download-threads', 4)
+
+    def getUploadThreads(self):
+        """Gets the number of files, and of blocks of a large file, uploaded at once."""
+        return self._winfo.get('upload-threads', 4)
+
+    def getLogStreamInterval(self):
+        """Gets the seconds between two uploads of the output of a running program, 0 to upload it at the end."""
+        return float(self._winfo.get('log-stream-interval', 5))
+
+    def getSlots(self):
+        """
+        Gets the number of runs executed at once. With 'auto', one per CPU, or per
+        slot-memory-mb of memory if that gives fewer slots.
+        """
+        slots = self._winfo.get('slots', 1)
+        if slots != 'auto':
+            return int(slots)
+        slots = psutil.cpu_count()
+        if 'slot-memory-mb' in self._winfo:
+            slots = min(slots, psutil.virtual_memory().total // self.getSlotMemoryLimit())
+        return max(1, int(slots))
+
+    def getSlotUsers(self):
+        """
+        Gets the names of the users running the programs of each slot, or None when the
+        programs of all the slots run as workeruser.
+        """
+        return self._winfo.get('slot-users')
+
+    def getSlotMemoryLimit(self):
+        """Gets the memory in bytes which the programs of a run may use or None for no limit."""
+        if 'slot-memory-mb' in self._winfo:
+            return int(self._winfo['slot-memory-mb']) * 1024 * 1024
+        slots = self.getSlots()
+        return psutil.virtual_memory().total // slots if slots > 1 else None
+
     def getLocalRoot(self):
         """Gets the path for the local directory where files are staged or None if the path is not provided."""
         return self._winfo['local-root'] if 'local-root' in self._winfo else None
 
-def getBundle(root_path, blob_service, container, bundle_id, bundle_rel_path, max_depth=3):
+    def getCgroupRoot(self):
+        """Gets the cgroup directory delegated to the worker or None if programs do not run in cgroups."""
+        return self._winfo['cgroup-root'] if 'cgroup-root' in self._winfo else None
+
+    def getWarmPhases(self):
+        """Gets the number of phases whose bundles each slot keeps staged, 0 to stage them for each run."""
+        return int(self._winfo.get('warm-phases', 0))
+
+    def getBundleCachePath(self):
+        """Gets the path of the directory caching bundles or None if bundles are not cached."""
+        return self._winfo['bundle-cache']['path'] if 'bundle-cache' in self._winfo else None
+
+    def getBundleCacheMaxSize(self):
+        """Gets the maximum size of the bundle cache in bytes."""
+        return int(self._winfo['bundle-cache'].get('max-size-mb', 10240)) * 1024 * 1024
+
+    def getBundleCache(self):
+        """Creates the BundleCache shared by the workers of this host or returns None if bundles are not cached."""
+        path = self.getBundleCachePath()
+        return None if path is None else BundleCache(path, self.getBundleCacheMaxSize())
+
+# Blobs larger than this are downloaded with parallel ranged requests of RANGE_SIZE bytes
+RANGE_THRESHOLD = 32 * 1024 * 1024
+RANGE_SIZE = 4 * 1024 * 1024
+
+# Files larger than this are uploaded in blocks of this size
+BLOCK_SIZE = 4 * 1024 * 1024
+UPLOAD_RETRIES = 3
+
+# Bundles stored as tar files, extracted while they are downloaded
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz')
+
+# Maximum number of committed blocks of a Blob
+MAX_BLOCKS = 50000
+
+# Written to stderr, and reported as the reason of the failure, when a program exceeds a limit
+LIMIT_EXCEEDED_MESSAGES = {
+    'time': "Execution time limit exceeded!",
+    'memory': "Memory limit exceeded!",
+    'processes': "Process limit exceeded!",
+    'disk': "Disk quota exceeded!",
+}
+
+# Keys of the bundle metadata which do not reference other bundles
+BUNDLE_METADATA_KEYS = ("description", "command", "exitCode", "elapsedTime", "stdout", "stderr", "submitted-by", "submitted-at",
+                        "current-user")
+
+def _clone_blob_service(blob_service):
+    """
+    Returns a BlobService with the same account as blob_service. A BlobService keeps the state
+    of its last response, so each thread needs its own.
+    """
+    if not isinstance(blob_service, BlobService):
+        return blob_service
+    return BlobService(blob_service.account_name, blob_service.account_key,
+                       blob_service.protocol, blob_service.host_base)
+
+class BlobReader(object):
+    """
+    A file-like object reading a Blob sequentially, one ranged request of chunk_size bytes at a
+    time, so that at most a chunk of the Blob is held in memory.
     """
-    be controlled with the max_depth parameter.
+    def __init__(self, blob_service, container, blob_name, size, chunk_size=None):
+        self.blob_service = blob_service
+        self.container = container
+        self.blob_name = blob_name
+        self.size = size
+        self.chunk_size = chunk_size or RANGE_SIZE
+        self.position = 0
+        self.chunk = ''
+        self.offset = 0
+
+    def read(self, n=-1):
+        parts = []
+        while n != 0:
+            if self.offset >= len(self.chunk):
+                if self.position >= self.size:
+                    break
+                end = min(self.position + self.chunk_size, self.size) - 1
+                self.chunk = self.blob_service.get_blob(self.container, self.blob_name,
+                                                        x_ms_range='bytes=%d-%d' % (self.position, end))
+                self.offset = 0
+                self.position = end + 1
+            count = len(self.chunk) - self.offset if n < 0 else min(n, len(self.chunk) - self.offset)
+            parts.append(self.chunk[self.offset:self.offset + count])
+            self.offset += count
+            if n > 0:
+                n -= count
+        return ''.join(parts)
+
+def _get_blob_size(blob_service, container, blob_name):
+    return int(blob_service.get_blob_properties(container, blob_name).get('content-length', 0))
+
+def _download_blob(blob_service, container, blob_name, file_path, max_workers):
+    """
+    Downloads a Blob to a file in chunks of RANGE_SIZE bytes, with up to max_workers parallel
+    ranged requests for Blobs larger than RANGE_THRESHOLD.
+    """
+    size = _get_blob_size(blob_service, container, blob_name)
+    if size <= RANGE_SIZE:
+        with open(file_path, 'wb') as f:
+            f.write(blob_service.get_blob(container, blob_name))
+        return
+    if size <= RANGE_THRESHOLD or max_workers <= 1:
+        with open(file_path, 'wb') as f:
+            shutil.copyfileobj(BlobReader(blob_service, container, blob_name, size), f, RANGE_SIZE)
+        return
+
+    with open(file_path, 'wb') as f:
+        f.truncate(size)
+
+    def get_range(start):
+        end = min(start + RANGE_SIZE, size) - 1
+        data = _clone_blob_service(blob_service).get_blob(container, blob_name,
+                                                          x_ms_range='bytes=%d-%d' % (start, end))
+        with open(file_path, 'r+b') as f:
+            f.seek(start)
+            f.write(data)
+
+    pool = ThreadPool(max_workers)
+    try:
+        pool.map(get_range, range(0, size, RANGE_SIZE))
+    finally:
+        pool.close()
+        pool.join()
+
+def _extract_tar_stream(blob_service, container, blob_name, bundle_path):
+    """
+    Extracts a tar Blob, compressed or not, while it is being downloaded.
+    """
+    size = _get_blob_size(blob_service, container, blob_name)
+    reader = BlobReader(blob_service, container, blob_name, size)
+    root = os.path.realpath(bundle_path)
+    with closing(tarfile.open(fileobj=reader, mode='r|*')) as tar:
+        for member in tar:
+            target = os.path.realpath(join(bundle_path, member.name))
+            inside = target == root or target.startswith(root + os.sep)
+            if not (member.isfile() or member.isdir()) or not inside:
+                logger.warning("Skipping %s in bundle %s.", member.name, blob_name)
+                continue
+            tar.extract(member, bundle_path)
+
+def getBundle(root_path, blob_service, container, bundle_id, bundle_rel_path, max_depth=3, cache=None, max_workers=4,
+              warm=None):
+    """
+    Gets a bundle and the bundles it references. The references are resolved level by level
+    and the bundles of a level are staged concurrently. The depth of the references followed
+    can be controlled with the max_depth parameter.
 
     root_path: Path of the local directory under which all files are staged for execution.
     blob_service: Azure BlobService to access the storage account holding the bundles.
@@ -97,6 +324,10 @@ def getBundle(root_path, blob_service, container, bundle_id, bundle_rel_path, ma
         program bundle will be located at 'C:\\tmp123\\run\\program'.
     max_depth: An optional argument to limit the depth of recursion when resolving bundle
         dependencies.
+    cache: An optional BundleCache from which the bundles are staged.
+    max_workers: The number of bundles staged at once, and of ranged requests downloading a
+        large bundle.
+    warm: An optional WarmPhase from which the bundles of the phase are staged.
 
     Return value: A dictionary where each key denotes the relative path of a bundle which
         was staged. The value associated with a key is a dictionary representing the bundle's
@@ -104,64 +335,111 @@ def getBundle(root_path, blob_service, container, bundle_id, bundle_rel_path, ma
         the set of keys should contain at the minimum: 'run', 'run\\program' and 'run\\input'.
     """
 
-    def getThem(bundle_id, bundle_rel_path, bundles, depth):
-        """Recursively gets the bundles."""
-        # download the bundle and save it to a temporary location
-        try:
-            logger.debug("Getting bundle_id=%s from container=%s" % (container, bundle_id))
-            blob = blob_service.get_blob(container, bundle_id)
-        except azure.WindowsAzureMissingResourceError:
-            #file not found lets None this bundle
-            bundles[bundle_rel_path] = None
-            return bundles
-
+    def fetch(service, bundle_id, bundle_path):
+        """Downloads a bundle and stages it at bundle_path."""
+        logger.debug("Getting bundle_id=%s from container=%s" % (container, bundle_id))
+        if bundle_id.endswith(TAR_EXTENSIONS):
+            # Unlike zip files, tar files can be extracted as they are read
+            _extract_tar_stream(service, container, bundle_id, bundle_path)
+            return
         bundle_ext = os.path.splitext(bundle_id)[1]
         bundle_file = tempfile.NamedTemporaryFile(prefix='tmp', suffix=bundle_ext, dir=root_path, delete=False)
+        bundle_file.close()
 
         logger.debug("Reading from bundle_file.name=%s" % bundle_file.name)
 
         #take our temp file and write whatever is it form the blob
-        with open(bundle_file.name, 'wb') as f:
-            f.write(blob)
+        _download_blob(service, container, bundle_id, bundle_file.name, max_workers)
         # stage the bundle directory
-        bundle_path = join(root_path, bundle_rel_path)
-        metadata_path = join(bundle_path, 'metadata')
-
         if bundle_ext == '.zip':
-            with ZipFile(bundle_file.file, 'r') as z:
+            with ZipFile(bundle_file.name, 'r') as z:
                 z.extractall(bundle_path)
         else:
             os.mkdir(bundle_path)
-            shutil.copyfile(bundle_file.name, metadata_path)
+            shutil.copyfile(bundle_file.name, join(bundle_path, 'metadata'))
+
+    def stage(bundle):
+        """Stages a bundle and returns its metadata."""
+        bundle_id, bundle_rel_path = bundle
+        bundle_path = join(root_path, bundle_rel_path)
+        metadata_path = join(bundle_path, 'metadata')
+        service = _clone_blob_service(blob_service)
+
+        def fill(path):
+            if cache is None:
+                fetch(service, bundle_id, path)
+            else:
+                cache.stage(service, container, bundle_id, path, lambda cache_path: fetch(service, bundle_id, cache_path))
+
+        try:
+            if warm is not None and bundle_id in warm.bundle_ids:
+                warm.stage(service, container, bundle_id, bundle_path, fill)
+            else:
+                fill(bundle_path)
+        except azure.WindowsAzureMissingResourceError:
+            #file not found lets None this bundle
+            return None
+
         # read the metadata if it exists
         bundle_info = None
         if os.path.exists(metadata_path):
             with open(metadata_path) as mf:
                 bundle_info = yaml.load(mf)
-        bundles[bundle_rel_path] = bundle_info
-        # get referenced bundles
-
-        if (bundle_info is not None) and isinstance(bundle_info, dict) and (depth < max_depth):
-            for (k, v) in bundle_info.items():
-                if k not in ("description", "command", "exitCode", "elapsedTime", "stdout", "stderr", "submitted-by", "submitted-at"):
-                    if isinstance(v, str):
-                        getThem(v, join(bundle_rel_path, k), bundles, depth + 1)
-
-        return bundles
-
-    return getThem(bundle_id, bundle_rel_path, {}, 0)
-
-def _send_update(queue, task_id, status, extra=None):
+        return bundle_info
+
+    bundles = {}
+    level = [(bundle_id, bundle_rel_path)]
+    depth = 0
+    pool = ThreadPool(max_workers)
+    try:
+        while len(level) > 0:
+            # Bundles of a level are staged under the directories of the level above
+            next_level = []
+            for (bundle_id, bundle_rel_path), bundle_info in zip(level, pool.map(stage, level)):
+                bundles[bundle_rel_path] = bundle_info
+                # get referenced bundles
+                if (bundle_info is not None) and isinstance(bundle_info, dict) and (depth < max_depth):
+                    for (k, v) in bundle_info.items():
+                        if k not in BUNDLE_METADATA_KEYS and isinstance(v, str):
+                            next_level.append((v, join(bundle_rel_path, k)))
+            level = next_level
+            depth += 1
+    finally:
+        pool.close()
+        pool.join()
+    return bundles
+
+def _write_current_user(root_path, bundles):
+    """
+    Writes the current-user of the input metadata to current_user.txt in the coopetition
+    bundle, which is shared by all the submissions of a competition.
+    """
+    input_info = bundles.get(join('run', 'input'))
+    coopetition_dir = join(root_path, 'run', 'input', 'coopetition')
+    if not isinstance(input_info, dict) or 'current-user' not in input_info or not os.path.isdir(coopetition_dir):
+        return
+    # Staged files may be hard-linked from the bundle cache, so never write through one
+    current_user_path = join(coopetition_dir, 'current_user.txt')
+    if os.path.lexists(current_user_path):
+        os.unlink(current_user_path)
+    with open(current_user_path, 'wb') as f:
+        f.write(unicode(input_info['current-user']).encode('utf-8'))
+
+
+def _send_update(queue, task_id, status, extra=None, predict=None):
     """
     Sends a status update about the running task.
 
     queue: The Queue to send the update to.
     id: The task ID.
     status: The new status for the task. One of 'running', 'finished' or 'failed'.
+    predict: True for an update about a prediction run, False for a scoring run.
     """
     task_args = {'status': status}
     if extra:
         task_args['extra'] = extra
+    if predict is not None:
+        task_args['predict'] = predict
     body = json.dumps({
         'id': task_id,
         'task_type': 'run_update',
@@ -169,27 +447,284 @@ def _send_update(queue, task_id, status, extra=None):
     })
     queue.send_message(body)
 
-def _upload(blob_service, container, blob_id, blob_file, content_type = None):
+def _file_md5(path):
+    """Returns the base64-encoded MD5 hash of a file."""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(BLOCK_SIZE), ''):
+            md5.update(data)
+    return base64.b64encode(md5.digest())
+
+def _retry(fn, description):
+    """Calls fn, again after an Azure error, up to UPLOAD_RETRIES times."""
+    for attempt in range(UPLOAD_RETRIES):
+        try:
+            return fn()
+        except azure.WindowsAzureError:
+            if attempt + 1 == UPLOAD_RETRIES:
+                raise
+            logger.warning("Retrying %s after error. Attempt %s of %s.", description, attempt + 1, UPLOAD_RETRIES)
+            time.sleep(2 ** attempt)
+
+def _upload(blob_service, container, blob_id, blob_file, content_type = None, max_workers=4):
     """
-    Uploads a Blob.
+    Uploads a Blob. Files larger than BLOCK_SIZE are read and uploaded in blocks, up to max_workers
+    at once, then committed. The MD5 hash of each block is verified by the storage service.
 
     blob_service: A BlobService object.
     container: Name of the container to uplaod the Blob to.
     blob_id: Name of the Blob relative to the container.
     blob_file: Path of the local file to upload as a BlockBlob.
     """
-    with open(blob_file, 'rb') as f:
-        blob = f.read()
-        blob_service.put_blob(container, blob_id, blob, x_ms_blob_type='BlockBlob', x_ms_blob_content_type=content_type)
+    size = os.path.getsize(blob_file)
+    if size <= BLOCK_SIZE:
+        with open(blob_file, 'rb') as f:
+            blob = f.read()
+        md5 = base64.b64encode(hashlib.md5(blob).digest())
+        _retry(lambda: blob_service.put_blob(container, blob_id, blob, x_ms_blob_type='BlockBlob',
+                                             x_ms_blob_content_type=content_type, content_md5=md5),
+               "upload of %s" % blob_id)
+        return
+
+    def put_block(index):
+        with open(blob_file, 'rb') as f:
+            f.seek(index * BLOCK_SIZE)
+            block = f.read(BLOCK_SIZE)
+        block_id = '%08d' % index
+        md5 = base64.b64encode(hashlib.md5(block).digest())
+        service = _clone_blob_service(blob_service)
+        _retry(lambda: service.put_block(container, blob_id, block, block_id, content_md5=md5),
+               "upload of block %s of %s" % (block_id, blob_id))
+        return block_id
+
+    count = (size + BLOCK_SIZE - 1) // BLOCK_SIZE
+    pool = ThreadPool(max_workers)
+    try:
+        block_ids = pool.map(put_block, range(count))
+    finally:
+        pool.close()
+        pool.join()
+    _retry(lambda: blob_service.put_block_list(container, blob_id, block_ids,
+                                               x_ms_blob_content_type=content_type,
+                                               x_ms_blob_content_md5=_file_md5(blob_file)),
+           "commit of %s" % blob_id)
+
+def _upload_all(blob_service, container, uploads, max_workers=4):
+    """
+    Uploads several Blobs at once.
+
+    uploads: A list of (blob_id, blob_file, content_type) tuples. When a Blob appears more
+        than once, the last file is uploaded.
+    """
+    uploads = OrderedDict((upload[0], upload) for upload in uploads).values()
+
+    def upload(item):
+        blob_id, blob_file, content_type = item
+        _upload(_clone_blob_service(blob_service), container, blob_id, blob_file, content_type, max_workers)
+
+    pool = ThreadPool(max_workers)
+    try:
+        pool.map(upload, uploads)
+    finally:
+        pool.close()
+        pool.join()
 
 
-class ExecutionTimeLimitExceeded(Exception):
-    pass
+class BlobWriter(object):
+    """
+    A file-like object writing a BlockBlob. The data written is sent in blocks of BLOCK_SIZE
+    bytes, up to max_workers at once, and committed by close(), so at most max_workers + 1
+    blocks are held in memory.
+    """
+    def __init__(self, blob_service, container, blob_id, content_type=None, max_workers=4):
+        self.blob_service = blob_service
+        self.container = container
+        self.blob_id = blob_id
+        self.content_type = content_type
+        self.md5 = hashlib.md5()
+        self.buffer = []
+        self.buffered = 0
+        self.block_ids = []
+        self.results = []
+        self.pool = ThreadPool(max_workers)
+        self.slots = threading.BoundedSemaphore(max_workers)
+
+    def write(self, data):
+        self.md5.update(data)
+        self.buffer.append(data)
+        self.buffered += len(data)
+        while self.buffered >= BLOCK_SIZE:
+            data = ''.join(self.buffer)
+            self._put_block(data[:BLOCK_SIZE])
+            rest = data[BLOCK_SIZE:]
+            self.buffer = [rest] if rest else []
+            self.buffered = len(rest)
+
+    def _put_block(self, block):
+        # Fail early when a block could not be uploaded
+        for result in self.results:
+            if result.ready():
+                result.get()
+        block_id = '%08d' % len(self.block_ids)
+        self.block_ids.append(block_id)
+        self.slots.acquire()
+        def put_block():
+            try:
+                md5 = base64.b64encode(hashlib.md5(block).digest())
+                service = _clone_blob_service(self.blob_service)
+                _retry(lambda: service.put_block(self.container, self.blob_id, block, block_id, content_md5=md5),
+                       "upload of block %s of %s" % (block_id, self.blob_id))
+            finally:
+                self.slots.release()
+        self.results.append(self.pool.apply_async(put_block))
+
+    def close(self):
+        """Uploads the data left and commits the Blob."""
+        try:
+            data = ''.join(self.buffer)
+            self.buffer = []
+            if not self.block_ids:
+                md5 = base64.b64encode(self.md5.digest())
+                _retry(lambda: self.blob_service.put_blob(self.container, self.blob_id, data, x_ms_blob_type='BlockBlob',
+                                                          x_ms_blob_content_type=self.content_type, content_md5=md5),
+                       "upload of %s" % self.blob_id)
+                return
+            if data:
+                self._put_block(data)
+            for result in self.results:
+                result.get()
+            _retry(lambda: self.blob_service.put_block_list(self.container, self.blob_id, self.block_ids,
+                                                            x_ms_blob_content_type=self.content_type,
+                                                            x_ms_blob_content_md5=base64.b64encode(self.md5.digest())),
+                   "commit of %s" % self.blob_id)
+        finally:
+            self.pool.close()
+            self.pool.join()
+
+def _is_public_output(name):
+    """Tells whether a file of the output folder, named relative to it, is public."""
+    return not name.startswith('private/')
+
+def _stream_archives(blob_service, container, root, archives, level=6, max_workers=4):
+    """
+    Packs a folder into zip archives uploaded as they are written, in a single traversal of the
+    folder: each file is read and compressed once, whatever the number of archives holding it.
+
+    archives: A list of (blob_id, include) tuples: the Blob of an archive and a function telling
+        whether a file, named relative to the folder, belongs to it (None for all the files).
+    level: The compression level, from 0 (none) to 9 (best).
 
+    Returns the names of the files packed, relative to the folder.
+    """
+    writers = [BlobWriter(_clone_blob_service(blob_service), container, blob_id, max_workers=max_workers)
+               for blob_id, _ in archives]
+    try:
+        zips = [(ZipStreamWriter(writer), include or (lambda name: True))
+                for writer, (_, include) in zip(writers, archives)]
+        names = write_tree(root, zips, level)
+        for archive, _ in zips:
+            archive.close()
+        for writer in writers:
+            writer.close()
+    except:
+        for writer in writers:
+            writer.pool.terminate()
+        raise
+    return names
+
+class LogStreamer(object):
+    """
+    Uploads the output files of a run while its programs execute, so participants can follow
+    them. Every interval seconds, the bytes appended to each file since the last upload are sent
+    as a new block of its Blob and committed with the blocks sent before.
+    """
+    def __init__(self, blob_service, container, files, interval):
+        """
+        blob_service: A BlobService object.
+        container: Name of the container of the Blobs.
+        files: A list of (blob_id, path) tuples, the Blobs to write and the files they mirror.
+        interval: The seconds between two uploads.
+        """
+        self.blob_service = blob_service
+        self.container = container
+        self.files = files
+        self.interval = interval
+        self._offsets = dict((blob_id, 0) for blob_id, _ in files)
+        self._blocks = dict((blob_id, []) for blob_id, _ in files)
+        self._failed = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sync()
+
+    def _sync_file(self, blob_id, path):
+        """Uploads the bytes appended to a file. Returns False when its Blob holds too many blocks."""
+        blocks = self._blocks[blob_id]
+        committed = len(blocks)
+        with open(path, 'rb') as f:
+            f.seek(self._offsets[blob_id])
+            for data in iter(lambda: f.read(BLOCK_SIZE), ''):
+                if len(blocks) >= MAX_BLOCKS:
+                    return False
+                block_id = '%08d' % len(blocks)
+                md5 = base64.b64encode(hashlib.md5(data).digest())
+                self.blob_service.put_block(self.container, blob_id, data, block_id, content_md5=md5)
+                blocks.append(block_id)
+                self._offsets[blob_id] += len(data)
+        if len(blocks) > committed:
+            self.blob_service.put_block_list(self.container, blob_id, blocks)
+        return True
+
+    def sync(self):
+        """Uploads the bytes appended to the files since the last upload."""
+        for blob_id, path in self.files:
+            if blob_id in self._failed:
+                continue
+            try:
+                if not self._sync_file(blob_id, path):
+                    logger.warning("Stopped streaming %s: too many blocks.", blob_id)
+                    self._failed.add(blob_id)
+            except Exception:
+                # Blocks which were sent are committed with the next upload
+                logger.warning("Unable to stream %s.", blob_id, exc_info=True)
+
+    def close(self):
+        """
+        Stops the periodic uploads and uploads what remains of the files.
 
-def alarm_handler(signum, frame):
-    raise ExecutionTimeLimitExceeded
+        Returns the (blob_id, path) of the files which could not be streamed, or which are empty:
+        they must be uploaded.
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.sync()
+        return [(blob_id, path) for blob_id, path in self.files
+                if blob_id in self._failed or not self._blocks[blob_id] or
+                self._offsets[blob_id] < os.path.getsize(path)]
+
+def _summarize_usage(usages):
+    """
+    Sums up the resources used by the programs of a run into submission metadata.
 
+    usages: The list of the ProcessResult.get_usage() of the programs.
+    """
+    return {
+        'elapsed_time': sum(u['elapsed_time'] for u in usages),
+        'cpu_user_time': sum(u['user_time'] for u in usages),
+        'cpu_system_time': sum(u['system_time'] for u in usages),
+        # kB for the programs, bytes for the metadata
+        'peak_memory': max(u['max_rss'] for u in usages) * 1024,
+        'io_read_bytes': sum(u['read_bytes'] for u in usages),
+        'io_write_bytes': sum(u['write_bytes'] for u in usages),
+        'command_usage': json.dumps(usages),
+    }
 
 def demote(user='workeruser'):
     def result():
@@ -198,6 +733,86 @@ def demote(user='workeruser'):
     return result
 
 
+class Slot(object):
+    """
+    The share of the host given to a run: a directory under the local root, a set of CPUs, a
+    memory budget and the user running its programs. A worker with a single slot runs in the
+    local root without limits.
+    """
+    def __init__(self, index, count, local_root, memory_limit=None, users=None):
+        """
+        index: The index of the slot.
+        count: The number of slots of the worker.
+        local_root: The local directory shared by the slots.
+        memory_limit: The memory in bytes which the programs of a run may use or None for no limit.
+        users: The names of the users running the programs of each slot, workeruser for all
+            of them by default.
+        """
+        self.index = index
+        self.cpus = None
+        self.memory_limit = memory_limit
+        self.root = local_root
+        self.user = users[index % len(users)] if users else 'workeruser'
+        # Whether the user runs no other programs, which rlimits counting processes require
+        self.own_user = len(set(users or [])) >= count or count == 1
+        if count > 1:
+            self.root = join(local_root, 'slot-%d' % index)
+            cpus = range(psutil.cpu_count())
+            self.cpus = cpus[index::count] if len(cpus) >= count else [cpus[index % len(cpus)]]
+
+    def get_limits(self, limits=None):
+        """
+        Returns the Limits of a program run in the slot: the given limits, within the budget of
+        the slot.
+        """
+        limits = limits or Limits()
+        memory = limits.memory
+        if self.memory_limit is not None:
+            memory = self.memory_limit if memory is None else min(memory, self.memory_limit)
+        cpus = limits.cpus
+        if cpus is not None and self.cpus is not None:
+            cpus = min(cpus, len(self.cpus))
+        return Limits(memory=memory, cpus=cpus, processes=limits.processes, disk=limits.disk)
+
+    def preexec(self, then=None, limits=None, own_user=False, rlimits=True):
+        """
+        Returns the function to run in the process of a program before it starts: it applies the
+        budget of the slot and the given limits, then calls then().
+
+        own_user: True if then() switches to the user of the slot and it runs no other programs.
+        rlimits: False if the program runs in a cgroup, which applies the limits instead.
+        """
+        limits = self.get_limits(limits)
+        cpus = self.cpus
+        if limits.cpus is not None:
+            cpus = (cpus or range(psutil.cpu_count()))[:limits.cpus]
+        limit_processes = own_user and self.own_user
+        if rlimits and limits.processes is not None and not limit_processes:
+            logger.warning("Not applying the process limit: the programs of slot %s share their user.", self.index)
+        def result():
+            if cpus is not None:
+                psutil.Process().cpu_affinity(cpus)
+            if rlimits:
+                limits.set_rlimits(limit_processes)
+            if then is not None:
+                then()
+        return result
+
+# Slot of the current process in a worker running several slots
+_slot = None
+
+def get_slot_init_func(config):
+    """
+    Returns the function assigning its slot to each process of a worker running several slots.
+
+    config: A pre-configured instance of WorkerConfig.
+    """
+    def init_slot(lane):
+        global _slot
+        _slot = Slot(lane, config.getSlots(), config.getLocalRoot(), config.getSlotMemoryLimit(),
+                     config.getSlotUsers())
+    return init_slot
+
 def get_run_func(config):
     """
     Returns the function to invoke in order to do a run given the specified configuration.
@@ -206,26 +821,44 @@ def get_run_func(config):
 
     Returns: The function to invoke given a Run task: f(task_id, task_args)
     """
+    bundle_cache = config.getBundleCache()
+    # The WarmBundles of each slot, by slot directory
+    warm_bundles = {}
+
+    def get_warm_phase(slot, task_args):
+        """Returns the WarmPhase staging the bundles of the phase of a run, or None if they are not kept warm."""
+        if config.getWarmPhases() <= 0 or task_args.get('phase_id') is None:
+            return None
+        if slot.root not in warm_bundles:
+            warm_bundles[slot.root] = WarmBundles(join(slot.root, 'warm'), config.getWarmPhases())
+        return warm_bundles[slot.root].get_phase(task_args['phase_id'], task_args.get('phase_bundles', []))
 
     def run(task_id, task_args):
         """
         Performs a Run.
 
         task_id: The tracking ID for this task.
-        task_args: The input arguments for this task:
+        task_args: The input arguments for this task. Besides execution_time_limit, the limits
+            of the programs may include memory_limit and disk_limit (in bytes), cpu_limit (a
+            number of cores) and process_limit. phase_id and phase_bundles name the phase of the
+            run and the bundles shared by its runs, which may be kept warm:
         """
         run_id = task_args['bundle_id']
         execution_time_limit = task_args['execution_time_limit']
+        limits = Limits(memory=task_args.get('memory_limit'),
+                        cpus=task_args.get('cpu_limit'),
+                        processes=task_args.get('process_limit'),
+                        disk=task_args.get('disk_limit'))
         container = task_args['container_name']
         reply_to_queue_name = task_args['reply_to']
         is_predict_step = task_args.get("predict", False)
-        queue = AzureServiceBusQueue(config.getAzureServiceBusNamespace(),
-                                     config.getAzureServiceBusKey(),
-                                     config.getAzureServiceBusIssuer(),
-                                     reply_to_queue_name)
+        queue = config.getQueue(reply_to_queue_name)
         root_dir = None
-        current_dir = os.getcwd()
-        temp_dir = config.getLocalRoot()
+        log_streamer = None
+        slot = _slot if _slot is not None else Slot(0, 1, config.getLocalRoot(), users=config.getSlotUsers())
+        temp_dir = slot.root
+        if not os.path.exists(temp_dir):
+            os.makedirs(temp_dir)
         try:
            running_processes = subprocess.check_output(["fuser", temp_dir])
         except subprocess.CalledProcessError, e:
@@ -249,6 +882,10 @@ def get_run_func(config):
             # Cleanup dir in case any processes didn't clean up properly
             for the_file in os.listdir(temp_dir):
                 file_path = os.path.join(temp_dir, the_file)
+                if bundle_cache is not None and os.path.abspath(file_path) == bundle_cache.root:
+                    continue
+                if slot.root in warm_bundles and os.path.abspath(file_path) == warm_bundles[slot.root].root:
+                    continue
                 if os.path.isfile(file_path):
                     os.unlink(file_path)
                 elif os.path.isdir(file_path):
@@ -260,15 +897,17 @@ def get_run_func(config):
             except subprocess.CalledProcessError:
                 pass
 
-            _send_update(queue, task_id, 'running', extra={
+            _send_update(queue, task_id, 'running', predict=is_predict_step, extra={
                 'metadata': debug_metadata
             })
             # Create temporary directory for the run
-            root_dir = tempfile.mkdtemp(dir=config.getLocalRoot())
+            root_dir = tempfile.mkdtemp(dir=slot.root)
             # Fetch and stage the bundles
             blob_service = BlobService(config.getAzureStorageAccountName(),
                                        config.getAzureStorageAccountKey())
-            bundles = getBundle(root_dir, blob_service, container, run_id, 'run')
+            bundles = getBundle(root_dir, blob_service, container, run_id, 'run', cache=bundle_cache,
+                                max_workers=config.getDownloadThreads(), warm=get_warm_phase(slot, task_args))
+            _write_current_user(root_dir, bundles)
             # Verify we have an input folder: create one if it's not in the bundle.
             input_rel_path = join('run', 'input')
             if input_rel_path not in bundles:
@@ -305,8 +944,8 @@ def get_run_func(config):
             #
             # Invoke custom evaluation program
             run_dir = join(root_dir, 'run')
-            os.chdir(run_dir)
-            os.environ["PATH"] += os.pathsep + run_dir + "/program"
+            run_env = dict(os.environ)
+            run_env["PATH"] += os.pathsep + run_dir + "/program"
             logger.debug("Execution directory: %s", run_dir)
 
             if is_predict_step:
@@ -320,7 +959,16 @@ def get_run_func(config):
             stderr_file = join(run_dir, stderr_file_name)
             stdout = open(stdout_file, "a+")
             stderr = open(stderr_file, "a+")
+            stdout_id = "%s/%s" % (os.path.splitext(run_id)[0], stdout_file_name)
+            stderr_id = "%s/%s" % (os.path.splitext(run_id)[0], stderr_file_name)
+            log_files = [(stdout_id, stdout_file), (stderr_id, stderr_file)]
+            if config.getLogStreamInterval() > 0:
+                log_streamer = LogStreamer(_clone_blob_service(blob_service), container, log_files,
+                                           config.getLogStreamInterval())
+                log_streamer.start()
             prog_status = []
+            prog_usage = []
+            limit_exceeded = None
 
             for prog_cmd_counter, prog_cmd in enumerate(prog_cmd_list):
                 # Update command-line with the real paths
@@ -333,57 +981,40 @@ def get_run_func(config):
                                     .replace("\\", os.path.sep)
                 logger.debug("Invoking program: %s", prog_cmd)
 
-                startTime = time.time()
-                exit_code = None
-                timed_out = False
-
                 if 'Darwin' not in platform.platform():
                     prog_cmd = prog_cmd.replace("python", join(run_dir, "/home/azureuser/anaconda/bin/python"))
                     # Run as separate user
-                    evaluator_process = Popen(
-                        prog_cmd.split(' '),
-                        preexec_fn=demote(),  # this pre-execution function drops into a lower user
-                        stdout=stdout,
-                        stderr=stderr,
-                        env=os.environ
-                    )
+                    # this pre-execution function drops into a lower user
+                    preexec_fn = slot.preexec(demote(slot.user), limits, own_user=True,
+                                              rlimits=config.getCgroupRoot() is None)
                 else:
-                    evaluator_process = Popen(
-                        prog_cmd.split(' '),
-                        stdout=stdout,
-                        stderr=stderr,
-                        env=os.environ
-                    )
-
-                logger.debug("Started process, pid=%s" % evaluator_process.pid)
-
-                time_difference = time.time() - startTime
-                signal.signal(signal.SIGALRM, alarm_handler)
-                signal.alarm(int(math.fabs(math.ceil(execution_time_limit - time_difference))))
-
-                exit_code = None
-
-                logger.debug("Checking process, exit_code = %s" % exit_code)
-
-                try:
-                    while exit_code == None:
-                        time.sleep(1)
-                        exit_code = evaluator_process.poll()
-                except (ValueError, OSError):
-                    pass # tried to communicate with dead process
-                except ExecutionTimeLimitExceeded:
+                    preexec_fn = slot.preexec(limits=limits, rlimits=config.getCgroupRoot() is None)
+
+                result = supervise(
+                    prog_cmd.split(' '),
+                    time_limit=execution_time_limit,
+                    preexec_fn=preexec_fn,
+                    cgroup_root=config.getCgroupRoot(),
+                    limits=slot.get_limits(limits),
+                    disk_path=run_dir,
+                    stdout=stdout,
+                    stderr=stderr,
+                    cwd=run_dir,
+                    env=run_env
+                )
+                exit_code = result.exit_code
+                if result.limit_exceeded is not None:
                     exit_code = -1
-                    logger.info("Killed process for running too long!")
-                    stderr.write("Execution time limit exceeded!")
-                    evaluator_process.kill()
-                    timed_out = True
-
-                signal.alarm(0)
+                    limit_exceeded = result.limit_exceeded
+                    stderr.write(LIMIT_EXCEEDED_MESSAGES[limit_exceeded])
+                elapsedTime = result.elapsed_time
 
                 logger.debug("Exit Code: %d", exit_code)
-
-                endTime = time.time()
-                elapsedTime = endTime - startTime
+                logger.info("Program ran for %.3fs, using %.3fs of user and %.3fs of system CPU time (task_id=%s).",
+                            result.elapsed_time, result.user_time, result.system_time, task_id)
+                usage = result.get_usage()
+                usage['exit_code'] = exit_code
+                prog_usage.append(usage)
 
                 if len(prog_cmd_list) == 1:
                     # Overwrite prog_status array with dict
@@ -402,65 +1033,65 @@ def get_run_func(config):
 
             stdout.close()
             stderr.close()
+            debug_metadata.update(_summarize_usage(prog_usage))
 
             logger.debug("Saving output files")
-            stdout_id = "%s/%s" % (os.path.splitext(run_id)[0], stdout_file_name)
-            _upload(blob_service, container, stdout_id, stdout_file)
-            stderr_id = "%s/%s" % (os.path.splitext(run_id)[0], stderr_file_name)
-            _upload(blob_service, container, stderr_id, stderr_file)
-
-            private_dir = join(output_dir, 'private')
-            if os.path.exists(private_dir):
-                logger.debug("Packing private results...")
-                private_output_file = join(root_dir, 'run', 'private_output.zip')
-                shutil.make_archive(os.path.splitext(private_output_file)[0], 'zip', output_dir)
-                private_output_id = "%s/private_output.zip" % (os.path.splitext(run_id)[0])
-                _upload(blob_service, container, private_output_id, private_output_file)
-                shutil.rmtree(private_dir)
-
-            # Pack results and send them to Blob storage
+            if log_streamer is not None:
+                log_files = log_streamer.close()
+                log_streamer = None
+            # Files are uploaded together once all of them are ready
+            uploads = [(blob_id, path, None) for blob_id, path in log_files]
+
+            # Pack results and stream them to Blob storage. The private results are only packed
+            # into private_output.zip, which holds the whole output folder.
             logger.debug("Packing results...")
-            output_file = join(root_dir, 'run', 'output.zip')
-            shutil.make_archive(os.path.splitext(output_file)[0], 'zip', output_dir)
-            output_id = "%s/output.zip" % (os.path.splitext(run_id)[0])
-            _upload(blob_service, container, output_id, output_file)
+            archives = [("%s/output.zip" % (os.path.splitext(run_id)[0]), _is_public_output)]
+            if os.path.exists(join(output_dir, 'private')):
+                logger.debug("Packing private results...")
+                archives.append(("%s/private_output.zip" % (os.path.splitext(run_id)[0]), None))
+            output_names = _stream_archives(blob_service, container, output_dir, archives,
+                                            level=task_args.get('output_compression_level', 6),
+                                            max_workers=config.getUploadThreads())
 
             # Check if the output folder contain an "html file" and copy the html file as detailed_results.html
-            # traverse root directory, and list directories as dirs and files as files
-            html_found = False
-            for root, dirs, files in os.walk(output_dir):
-                if not (html_found):
-                    path = root.split('/')
-                    for file in files:
-                        file_to_upload = os.path.join(root,file)
-                        file_ext = os.path.splitext(file_to_upload)[1]
-                        if file_ext.lower() ==".html":
-                            html_file_id = "%s/html/%s" % (os.path.splitext(run_id)[0],"detailed_results.html")
-                            _upload(blob_service, container, html_file_id, file_to_upload, "html")
-                            html_found = True
+            for name in output_names:
+                if _is_public_output(name) and os.path.splitext(name)[1].lower() == ".html":
+                    html_file_id = "%s/html/%s" % (os.path.splitext(run_id)[0],"detailed_results.html")
+                    uploads.append((html_file_id, join(output_dir, name), "html"))
+                    break
+
+            _upload_all(blob_service, container, uploads, max_workers=config.getUploadThreads())
 
             # Save extra metadata
             debug_metadata["end_virtual_memory_usage"] = json.dumps(psutil.virtual_memory()._asdict())
             debug_metadata["end_swap_memory_usage"] = json.dumps(psutil.swap_memory()._asdict())
             debug_metadata["end_cpu_usage"] = psutil.cpu_percent(interval=None)
 
-            # check if timed out AFTER output files are written! If we exit sooner, no output is written
-            if timed_out:
-                logger.exception("Run task timed out (task_id=%s).", task_id)
-                _send_update(queue, task_id, 'failed', extra={
+            # check if a limit was exceeded AFTER output files are written! If we exit sooner, no output is written
+            if limit_exceeded is not None:
+                logger.exception("Run task exceeded its %s limit (task_id=%s).", limit_exceeded, task_id)
+                debug_metadata['limit_exceeded'] = limit_exceeded
+                _send_update(queue, task_id, 'failed', predict=is_predict_step, extra={
+                    'traceback': LIMIT_EXCEEDED_MESSAGES[limit_exceeded],
                     'metadata': debug_metadata
                 })
             elif exit_code != 0:
                 logger.exception("Run task exit code non-zero (task_id=%s).", task_id)
-                _send_update(queue, task_id, 'failed', extra={
+                _send_update(queue, task_id, 'failed', predict=is_predict_step, extra={
                     'traceback': open(stderr_file).read(),
                     'metadata': debug_metadata
                 })
             else:
-                _send_update(queue, task_id, 'finished', extra={
+                _send_update(queue, task_id, 'finished', predict=is_predict_step, extra={
                     'metadata': debug_metadata
                 })
         except Exception:
+            if log_streamer is not None:
+                # Participants see the output of the run until it failed
+                try:
+                    log_streamer.close()
+                except Exception:
+                    logger.warning("Unable to upload the output of the run (task_id=%s).", task_id, exc_info=True)
             if debug_metadata['end_virtual_memory_usage'] == None:
                 # We didnt' make it far enough to save end metadata... so do it!
                 debug_metadata["end_virtual_memory_usage"] = json.dumps(psutil.virtual_memory()._asdict())
@@ -468,7 +1099,7 @@ def get_run_func(config):
                 debug_metadata["end_cpu_usage"] = psutil.cpu_percent(interval=None)
 
             logger.exception("Run task failed (task_id=%s).", task_id)
-            _send_update(queue, task_id, 'failed', extra={
+            _send_update(queue, task_id, 'failed', predict=is_predict_step, extra={
                 'traceback': traceback.format_exc(),
                 'metadata': debug_metadata
             })
@@ -477,12 +1108,28 @@ def get_run_func(config):
         if root_dir is not None:
             # Try cleaning-up temporary directory
             try:
-                os.chdir(current_dir)
                 shutil.rmtree(root_dir)
             except:
                 logger.exception("Unable to clean-up local folder %s (task_id=%s)", root_dir, task_id)
     return run
 
+def get_dead_letter_func(config):
+    """
+    Returns the function to invoke when a run has been attempted too many times, likely because
+    the workers running it died: the run is reported as failed to the site.
+
+    config: A pre-configured instance of WorkerConfig.
+    """
+
+    def dead_letter(task_id, task_type, task_args):
+        if task_type != 'run' or not task_args or 'reply_to' not in task_args:
+            return
+        queue = config.getQueue(task_args['reply_to'])
+        _send_update(queue, task_id, 'failed', predict=task_args.get("predict", False), extra={
+            'traceback': "The run was abandoned after %s attempts." % config.getMaxDeliveryCount()
+        })
+    return dead_letter
+
 def main():
     """
     Setup the worker and start it.
@@ -492,16 +1139,18 @@ def main():
     logging.config.dictConfig(config.getLoggerDictConfig())
 
     # queue to listen to for notifications of tasks to perform
-    queue = AzureServiceBusQueue(config.getAzureServiceBusNamespace(),
-                                 config.getAzureServiceBusKey(),
-                                 config.getAzureServiceBusIssuer(),
-                                 config.getAzureServiceBusQueue())
+    queue = config.getQueue(config.getQueueName(), peek_lock=config.usePeekLock())
     # map task type to function to accomplish the task
     vtable = {
         'run' : get_run_func(config)
     }
     # create and start the worker
-    worker = BaseWorker(queue, vtable, logger)
+    worker = BaseWorker(queue, vtable, logger,
+                        concurrency=config.getSlots(),
+                        lane_init=get_slot_init_func(config),
+                        lock_renewal_interval=config.getLockRenewalInterval(),
+                        max_delivery_count=config.getMaxDeliveryCount(),
+                        dead_letter=get_dead_letter_func(config))
     logger.info("Starting compute worker.")
     worker.start()
 
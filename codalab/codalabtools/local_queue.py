@@ -0,0 +1,186 @@
+"""
+This module defines a Queue stored in a local SQLite database. It stands in for the Windows Azure
+Service Bus when developing or load testing CodaLab on a single machine: every process opening
+the same database file shares the queues it holds.
+"""
+import logging
+import os
+import sqlite3
+import time
+import uuid
+
+from codalabtools import (
+    Queue,
+    QueueMessage)
+
+logger = logging.getLogger('codalabtools')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue_message (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    queue TEXT NOT NULL,
+    body TEXT NOT NULL,
+    visible_at REAL NOT NULL,
+    lock_token TEXT,
+    delivery_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS queue_message_visible ON queue_message (queue, visible_at);
+"""
+
+class SQLiteQueueMessage(QueueMessage):
+    """
+    Implements a QueueMessage received from a SQLiteQueue.
+    """
+    def __init__(self, queue, message_id, body, lock_token, delivery_count):
+        self.queue = queue
+        self.message_id = message_id
+        self.body = body
+        self.lock_token = lock_token
+        self.delivery_count = delivery_count
+    def get_body(self):
+        return self.body
+    def get_queue(self):
+        return self.queue
+    def get_delivery_count(self):
+        return self.delivery_count
+    def complete(self):
+        self.queue._complete(self)
+    def abandon(self):
+        self.queue._abandon(self)
+    def renew_lock(self):
+        self.queue._renew_lock(self)
+
+class SQLiteQueue(Queue):
+    """
+    Implements a Queue backed by a table of a SQLite database.
+
+    Receiving a message claims it in a write transaction, so any number of threads or processes
+    can consume the same queue. By default a received message is deleted (as with the Service
+    Bus queues used by CodaLab). With peek_lock, the message is hidden for visibility_timeout
+    seconds instead: it must be completed, or it becomes visible to consumers again.
+    """
+
+    # Timeout in seconds. receive_message is blocking and returns as soon as one of two
+    # conditions occurs: a message is received or the timeout period has elapsed.
+    polling_timeout = 60
+
+    # Seconds between two checks for new messages while receive_message is blocked.
+    polling_interval = 0.5
+
+    def __init__(self, path, name, peek_lock=False, visibility_timeout=300):
+        """
+        path: Path of the SQLite database file, created if needed.
+        name: Name of the queue.
+        peek_lock: True to lock received messages instead of deleting them.
+        visibility_timeout: Seconds a locked message stays hidden from other consumers.
+        """
+        self.path = os.path.abspath(path)
+        self.name = name
+        self.peek_lock = peek_lock
+        self.visibility_timeout = visibility_timeout
+        connection = self._connect()
+        try:
+            connection.executescript(_SCHEMA)
+        finally:
+            connection.close()
+
+    def _connect(self):
+        # A connection per operation: connections cannot be shared by threads or forked processes.
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _claim(self):
+        """Claims the next visible message, or returns None when there is none."""
+        connection = self._connect()
+        try:
+            # An immediate transaction takes the write lock up front so two consumers never
+            # claim the same message.
+            connection.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = connection.execute(
+                "SELECT id, body, delivery_count FROM queue_message WHERE queue = ? AND visible_at <= ? "
+                "ORDER BY visible_at, id LIMIT 1", (self.name, now)).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            message_id, body, delivery_count = row
+            lock_token = None
+            if self.peek_lock:
+                lock_token = uuid.uuid4().hex
+                connection.execute(
+                    "UPDATE queue_message SET visible_at = ?, lock_token = ?, delivery_count = delivery_count + 1 "
+                    "WHERE id = ?", (now + self.visibility_timeout, lock_token, message_id))
+            else:
+                connection.execute("DELETE FROM queue_message WHERE id = ?", (message_id,))
+            connection.execute("COMMIT")
+            return SQLiteQueueMessage(self, message_id, body, lock_token, delivery_count + 1)
+        except:
+            try:
+                connection.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            raise
+        finally:
+            connection.close()
+
+    def receive_message(self):
+        deadline = time.time() + self.polling_timeout
+        while True:
+            msg = self._claim()
+            if msg is not None or time.time() >= deadline:
+                return msg
+            time.sleep(min(self.polling_interval, max(0, deadline - time.time())))
+
+    def send_message(self, body):
+        connection = self._connect()
+        try:
+            connection.execute("INSERT INTO queue_message (queue, body, visible_at) VALUES (?, ?, ?)",
+                               (self.name, body, time.time()))
+        finally:
+            connection.close()
+
+    def send_messages(self, bodies):
+        connection = self._connect()
+        try:
+            # A single transaction for the batch
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                connection.executemany("INSERT INTO queue_message (queue, body, visible_at) VALUES (?, ?, ?)",
+                                       [(self.name, body, now) for body in bodies])
+                connection.execute("COMMIT")
+            except:
+                connection.execute("ROLLBACK")
+                raise
+        finally:
+            connection.close()
+
+    def _update_locked(self, msg, statement, args=()):
+        """Applies a statement to a message if the caller still holds its lock."""
+        connection = self._connect()
+        try:
+            cursor = connection.execute(statement + " WHERE id = ? AND lock_token = ?",
+                                        args + (msg.message_id, msg.lock_token))
+            if cursor.rowcount == 0:
+                logger.warning("Lock lost on message %s of queue %s.", msg.message_id, self.name)
+        finally:
+            connection.close()
+
+    def _complete(self, msg):
+        if msg.lock_token is not None:
+            self._update_locked(msg, "DELETE FROM queue_message")
+
+    def _abandon(self, msg):
+        if msg.lock_token is not None:
+            self._update_locked(msg, "UPDATE queue_message SET visible_at = ?, lock_token = NULL", (time.time(),))
+
+    def _renew_lock(self, msg):
+        if msg.lock_token is not None:
+            self._update_locked(msg, "UPDATE queue_message SET visible_at = ?", (time.time() + self.visibility_timeout,))
+
+    def count(self):
+        """Returns the number of messages in the queue, locked or not."""
+        connection = self._connect()
+        try:
+            return connection.execute("SELECT COUNT(*) FROM queue_message WHERE queue = ?", (self.name,)).fetchone()[0]
+        finally:
+            connection.close()
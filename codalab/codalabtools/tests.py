@@ -0,0 +1,270 @@
+"""
+Defines unit tests for this package.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from Queue import Queue as ThreadQueue
+from unittest import TestCase
+
+from codalabtools import BaseWorker, Queue, QueueMessage
+from codalabtools.local_queue import SQLiteQueue
+
+
+class MemoryMessage(QueueMessage):
+    def __init__(self, queue, body):
+        self.queue = queue
+        self.body = body
+
+    def get_body(self):
+        return self.body
+
+    def get_queue(self):
+        return self.queue
+
+
+class MemoryQueue(Queue):
+    """A Queue kept in memory, shared by the threads of a test."""
+    def __init__(self):
+        self.bodies = []
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def receive_message(self):
+        with self.lock:
+            if self.bodies:
+                return MemoryMessage(self, self.bodies.pop(0))
+        time.sleep(0.01)
+        return None
+
+    def send_message(self, body):
+        with self.lock:
+            self.sent.append(body)
+            self.bodies.append(body)
+
+    def add_task(self, task_id, task_type):
+        self.send_message(json.dumps({'id': task_id, 'task_type': task_type}))
+
+
+class BaseWorkerPoolTests(TestCase):
+    """Tests for the pool mode of BaseWorker."""
+
+    def setUp(self):
+        self.queue = MemoryQueue()
+        self.release_slow = threading.Event()
+        self.completed = []
+
+        def slow(task_id, task_args):
+            self.release_slow.wait(5)
+            self.completed.append(task_id)
+
+        def fast(task_id, task_args):
+            self.completed.append(task_id)
+
+        self.worker = BaseWorker(self.queue, {'slow': slow, 'fast': fast}, logging.getLogger(__name__),
+                                 concurrency=2, task_limits={'slow': 1}, use_threads=True, limit_wait=0.05)
+
+    def _start_lanes(self, count):
+        status_queue = ThreadQueue()
+        stop_event = threading.Event()
+        semaphores = {'slow': multiprocessing.BoundedSemaphore(1)}
+        lanes = []
+        for lane in range(count):
+            worker = threading.Thread(target=self.worker._pool_lane, args=(lane, status_queue, stop_event, semaphores))
+            worker.daemon = True
+            worker.start()
+            lanes.append(worker)
+        return lanes, status_queue, stop_event
+
+    def _wait_for(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_slow_task_does_not_block_other_lanes(self):
+        lanes, status_queue, stop_event = self._start_lanes(2)
+        self.queue.add_task(1, 'slow')
+        self.assertTrue(self._wait_for(lambda: len(self.queue.bodies) == 0))
+        self.queue.add_task(2, 'fast')
+        self.assertTrue(self._wait_for(lambda: self.completed == [2]))
+
+        stop_event.set()
+        self.release_slow.set()
+        self.worker._drain(lanes)
+        self.assertEqual([2, 1], self.completed)
+
+    def test_task_over_its_limit_is_requeued(self):
+        semaphore = multiprocessing.BoundedSemaphore(1)
+        semaphore.acquire()
+        message = MemoryMessage(self.queue, json.dumps({'id': 3, 'task_type': 'slow'}))
+
+        self.worker._run_message(message, {'slow': semaphore})
+        self.assertEqual([], self.completed)
+        self.assertEqual([message.get_body()], self.queue.sent)
+
+        semaphore.release()
+        self.release_slow.set()
+        self.worker._run_message(message, {'slow': semaphore})
+        self.assertEqual([3], self.completed)
+
+    def test_drain_lets_running_tasks_finish(self):
+        lanes, status_queue, stop_event = self._start_lanes(2)
+        self.queue.add_task(4, 'slow')
+        self.assertTrue(self._wait_for(lambda: len(self.queue.bodies) == 0))
+        stop_event.set()
+        threading.Timer(0.1, self.release_slow.set).start()
+        self.worker._drain(lanes)
+
+        self.assertEqual([4], self.completed)
+        statuses = []
+        while not status_queue.empty():
+            statuses.append(status_queue.get())
+        self.assertEqual(set([(0, 'stopped'), (1, 'stopped')]), set(s for s in statuses if s[1] == 'stopped'))
+
+
+class SQLiteQueueTests(TestCase):
+    """Tests for the queues stored in a local SQLite database."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'queues.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _queue(self, name='jobs', **kwargs):
+        queue = SQLiteQueue(self.path, name, **kwargs)
+        queue.polling_timeout = 0.2
+        queue.polling_interval = 0.01
+        return queue
+
+    def test_messages_are_received_in_order_and_once(self):
+        queue = self._queue()
+        queue.send_message('a')
+        queue.send_message('b')
+        self._queue('other').send_message('c')
+
+        self.assertEqual('a', queue.receive_message().get_body())
+        self.assertEqual('b', self._queue().receive_message().get_body())
+        self.assertIsNone(queue.receive_message())
+        self.assertEqual(1, self._queue('other').count())
+
+    def test_batch_of_messages_is_received_in_order(self):
+        queue = self._queue()
+        queue.send_message('a')
+        queue.send_messages(['b', 'c', 'd'])
+
+        self.assertEqual(['a', 'b', 'c', 'd'], [queue.receive_message().get_body() for _ in range(4)])
+        self.assertIsNone(queue.receive_message())
+
+    def test_concurrent_consumers_never_share_a_message(self):
+        queue = self._queue()
+        for i in range(100):
+            queue.send_message(str(i))
+        received = []
+        lock = threading.Lock()
+
+        def consume():
+            consumer = self._queue()
+            while True:
+                msg = consumer.receive_message()
+                if msg is None:
+                    return
+                with lock:
+                    received.append(msg.get_body())
+
+        consumers = [threading.Thread(target=consume) for _ in range(4)]
+        for consumer in consumers:
+            consumer.start()
+        for consumer in consumers:
+            consumer.join()
+        self.assertEqual(sorted(str(i) for i in range(100)), sorted(received))
+
+    def test_locked_message_reappears_after_visibility_timeout(self):
+        queue = self._queue(peek_lock=True, visibility_timeout=0.1)
+        queue.send_message('a')
+        msg = queue.receive_message()
+        self.assertEqual(1, msg.delivery_count)
+        queue.polling_timeout = 0
+        self.assertIsNone(queue.receive_message())
+
+        time.sleep(0.15)
+        queue.polling_timeout = 0.2
+        redelivered = queue.receive_message()
+        self.assertEqual('a', redelivered.get_body())
+        self.assertEqual(2, redelivered.delivery_count)
+        # The first consumer lost its lock: completing the message has no effect.
+        msg.complete()
+        self.assertEqual(1, queue.count())
+        redelivered.complete()
+        self.assertEqual(0, queue.count())
+
+    def test_abandoned_message_is_visible_again(self):
+        queue = self._queue(peek_lock=True)
+        queue.send_message('a')
+        queue.receive_message().abandon()
+        self.assertEqual('a', queue.receive_message().get_body())
+
+
+class PeekLockWorkerTests(TestCase):
+    """Tests for the handling of locked messages by BaseWorker."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.queue = SQLiteQueue(os.path.join(self.root, 'queues.sqlite'), 'jobs', peek_lock=True,
+                                 visibility_timeout=0.3)
+        self.queue.polling_timeout = 0
+        self.runs = []
+        self.dead = []
+
+        def run(task_id, task_args):
+            self.runs.append(task_id)
+            if task_args and task_args.get('sleep'):
+                time.sleep(task_args['sleep'])
+            if task_args and task_args.get('fail'):
+                raise Exception("Run failed.")
+
+        self.worker = BaseWorker(self.queue, {'run': run}, logging.getLogger(__name__),
+                                 lock_renewal_interval=0.1, max_delivery_count=2,
+                                 dead_letter=lambda *args: self.dead.append(args))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _send(self, task_id, task_args=None):
+        self.queue.send_message(json.dumps({'id': task_id, 'task_type': 'run', 'task_args': task_args}))
+
+    def test_message_is_completed_when_its_task_is_done(self):
+        self._send(1)
+        self.worker._run_message(self.queue.receive_message())
+        self.assertEqual([1], self.runs)
+        self.assertEqual(0, self.queue.count())
+
+    def test_lock_is_renewed_while_the_task_runs(self):
+        self._send(2, {'sleep': 0.6})
+        msg = self.queue.receive_message()
+        other = SQLiteQueue(self.queue.path, 'jobs', peek_lock=True)
+        other.polling_timeout = 0
+        thread = threading.Thread(target=self.worker._run_message, args=(msg,))
+        thread.start()
+        time.sleep(0.45)
+        self.assertIsNone(other.receive_message())
+        thread.join()
+        self.assertEqual(0, self.queue.count())
+
+    def test_failed_task_is_retried_then_dead_lettered(self):
+        self._send(3, {'fail': True})
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                self.worker._run_message(self.queue.receive_message())
+        self.worker._run_message(self.queue.receive_message())
+
+        self.assertEqual([3, 3], self.runs)
+        self.assertEqual([(3, 'run', {'fail': True})], self.dead)
+        self.assertEqual(0, self.queue.count())